@@ -9,6 +9,8 @@ from .models import (
     Location, UserLocation, PageCategory, Page, PromoCode, Notification, Banner, ProductBanner, StaticPage
 )
 from .analytics import AnalyticsService
+from .forms import STOCK_ON_HAND_HELP_TEXT
+from .inventory import InventoryService
 
 
 @admin.register(User)
@@ -102,15 +104,9 @@ class CategoryAdmin(TranslatableAdmin):
     create_subcategories.short_description = _('Создать подкатегории для выбранных категорий')
     
     def update_products_count(self, request, queryset):
-        """Массовое действие для обновления счетчиков товаров"""
-        updated_count = 0
-        for category in queryset:
-            old_count = category.products_count
-            new_count = category.update_products_count()
-            category.save()
-            if old_count != new_count:
-                updated_count += 1
-        
+        """Массовое действие для обновления счетчиков товаров (пересчитывает все дерево)"""
+        from .category_counts import CategoryCounterService
+        updated_count = CategoryCounterService.rebuild()
         self.message_user(request, f'Обновлены счетчики для {updated_count} категорий', level='SUCCESS')
     
     update_products_count.short_description = _('Обновить счетчики товаров')
@@ -129,10 +125,8 @@ class CategoryAdmin(TranslatableAdmin):
     
     def save_model(self, request, obj, form, change):
         """Переопределяем сохранение для обновления иерархии"""
+        # Счетчики товаров пересчитывает Category.save при перемещении или (де)активации
         super().save_model(request, obj, form, change)
-        # Обновляем счетчик товаров после сохранения
-        obj.update_products_count()
-        obj.save()
     
     class Media:
         css = {
@@ -187,6 +181,16 @@ class ProductAdmin(TranslatableAdmin):
     )
     readonly_fields = ('sku', 'rating', 'reviews_count', 'views_count', 'created_at', 'updated_at')
 
+    def get_form(self, request, obj=None, **kwargs):
+        kwargs['help_texts'] = {'stock_quantity': STOCK_ON_HAND_HELP_TEXT}
+        return super().get_form(request, obj, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        # Введено число единиц на складе: действующие резервы вычитаются из него
+        if change and 'stock_quantity' in form.changed_data:
+            obj.stock_quantity = InventoryService.set_on_hand(obj.pk, form.cleaned_data['stock_quantity'])
+        super().save_model(request, obj, form, change)
+
 
 @admin.register(Seller)
 class SellerAdmin(admin.ModelAdmin):
@@ -7,6 +7,7 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 from .models import Category, Product
+from .category_counts import CategoryCounterService
 
 logger = logging.getLogger(__name__)
 
@@ -39,7 +40,7 @@ def category_preview(request, category_id):
     if not featured_products.exists():
         featured_products = category.products.filter(
             is_active=True
-        ).order_by('-views_count', '-rating')[:6]
+        ).order_by('-popularity_score', 'id')[:6]
     
     context = {
         'category': category,
@@ -158,17 +159,8 @@ def update_category_counts(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
     
-    category_ids = request.POST.getlist('category_ids')
-    updated_count = 0
-    
-    for category_id in category_ids:
-        try:
-            category = Category.objects.get(id=category_id)
-            category.update_products_count()
-            category.save()
-            updated_count += 1
-        except Category.DoesNotExist:
-            continue
+    # Счетчики зависят от всей ветки, поэтому пересчитывается все дерево одним проходом
+    updated_count = CategoryCounterService.rebuild()
     
     return JsonResponse({
         'updated_count': updated_count,
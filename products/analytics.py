@@ -6,6 +6,7 @@ from django.db.models import Count, Sum, Avg, Q
 from django.utils import timezone
 from datetime import timedelta
 from .models import Product, Order, User, Category
+from .view_stats import ProductViewStatsService
 import json
 
 
@@ -82,16 +83,10 @@ class AnalyticsService:
             product = Product.objects.get(id=product_id)
             
             # Статистика просмотров за последние 30 дней
-            now = timezone.now()
-            views_data = []
-            views_labels = []
-            
-            for i in range(30):
-                date = now - timedelta(days=29-i)
-                # Здесь можно добавить модель для отслеживания просмотров по дням
-                # Пока используем случайные данные для демонстрации
-                views_data.append(product.views_count // 30)
-                views_labels.append(date.strftime('%d.%m'))
+            end = timezone.localdate()
+            start = end - timedelta(days=29)
+            views_data = ProductViewStatsService.get_daily_views([product.id], start, end)[product.id]
+            views_labels = [(start + timedelta(days=i)).strftime('%d.%m') for i in range(30)]
             
             return {
                 'product': product,
@@ -4,7 +4,6 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.db.models import F
 # PostgreSQL search imports (conditionally imported where needed)
 # from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
 from django.core.cache import cache
@@ -13,7 +12,16 @@ from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_headers
 from django_ratelimit.decorators import ratelimit
 from django_ratelimit.exceptions import Ratelimited
+from ..catalog_filters import ProductQueryCompiler
+from ..category_tree import CategoryTreeService
+from ..pagination import DEFAULT_SORT
+from ..search import get_search_backend
+from ..search.results import RELEVANCE_SORT, SearchResultCache
+from ..view_counter import ViewCounterService
 from ..models import Product, Category, Shop, Tag, User, Location, UserLocation, Order, OrderItem, Cart, CartItem
+from ..cart import DatabaseCartStore
+from ..checkout import CheckoutService
+from ..inventory import InventoryService
 from .serializers import ProductSerializer, CategorySerializer, ShopSerializer, TagSerializer, UserSerializer, LocationSerializer, UserLocationSerializer, OrderSerializer, OrderItemSerializer, CartSerializer, CartItemSerializer
 from .permissions import IsManagerOrAdmin, IsOwnerOrAdmin
 
@@ -90,10 +98,14 @@ class TagViewSet(viewsets.ModelViewSet):
 class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all().select_related('category', 'seller').prefetch_related('images', 'shops', 'tags', 'characteristics')
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = ['category', 'shops', 'tags', 'price', 'discount_price', 'currency']
-    search_fields = ['translations__name', 'translations__description', 'category__translations__name', 'shops__translations__name', 'tags__translations__name']
-    ordering_fields = ['name', 'price', 'created_at', 'views_count']
+    # Фильтры и поиск (category, shops, tags, price_min, price_max, brand,
+    # min_rating, in_stock, currency, search/q, sort) применяет ProductQueryCompiler;
+    # точные price= и discount_price= по-прежнему обрабатывает DjangoFilterBackend,
+    # а ordering=name/-name переводится в сортировку компилятора по названию
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['price', 'discount_price']
+    ordering_fields = ['price', 'created_at', 'views_count', 'rating']
+    name_orderings = {'name': 'name_asc', '-name': 'name_desc'}
     
     @method_decorator(ratelimit(key='ip', rate='100/h', method='GET'))
     @method_decorator(cache_page(60 * 15))  # Кэшируем на 15 минут
@@ -121,6 +133,17 @@ class ProductViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            params = self.request.query_params
+            name_sort = self.name_orderings.get(params.get('ordering'))
+            compiler = ProductQueryCompiler(params, default_sort=name_sort or DEFAULT_SORT)
+            queryset = compiler.filter(queryset)
+            if 'sort' in params or name_sort:
+                queryset = compiler.order(queryset)
+        return queryset
+
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             return [AllowAny()]
@@ -150,9 +173,8 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        # Увеличиваем счетчик просмотров
-        instance.views_count = F('views_count') + 1
-        instance.save(update_fields=['views_count'])
+        # Просмотр копится в памяти и попадает в базу пачкой (ViewCounterService)
+        ViewCounterService.record(request, instance.pk)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
@@ -174,24 +196,14 @@ class ProductViewSet(viewsets.ModelViewSet):
         if not query:
             return Response({'detail': _('Параметр "q" обязателен для поиска.')}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Проверяем, используем ли мы PostgreSQL (только PostgreSQL поддерживает SearchVector)
-        from django.conf import settings
-        db_engine = settings.DATABASES['default']['ENGINE']
-        
-        if 'postgresql' in db_engine:
-            # Используем полнотекстовый поиск PostgreSQL
-            from django.contrib.postgres.search import SearchQuery, SearchRank
-            from django.db.models import F
-            search_query = SearchQuery(query)
-            products = self.get_queryset().annotate(
-                rank=SearchRank(F('search_vector'), search_query)
-            ).filter(search_vector=search_query).order_by('-rank')
-        else:
-            # Для других баз данных (например, SQLite) используем простой поиск по названию и описанию
-            from django.db import models
-            products = self.get_queryset().filter(
-                models.Q(name__icontains=query) | models.Q(description__icontains=query)
-            )
+        # Поисковый бэкенд (SEARCH_BACKEND) сортирует результат по релевантности;
+        # упорядоченный список id кэшируется, страница догружается одним запросом
+        queryset = self.get_queryset()
+        products = SearchResultCache.results(
+            {'q': SearchResultCache.normalize_query(query), 'sort': RELEVANCE_SORT},
+            lambda: get_search_backend().rank(queryset, query),
+            queryset,
+        )
 
         page = self.paginate_queryset(products)
         if page is not None:
@@ -322,40 +334,30 @@ class CatalogViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['get'])
     def categories(self, request):
         """Получить все категории с подкатегориями для каталога"""
-        root_categories = Category.objects.filter(
-            parent__isnull=True, 
-            is_active=True, 
-            show_in_megamenu=True
-        ).order_by('sort_order', 'slug')
-        
-        result = []
-        for category in root_categories:
-            category_data = {
-                'id': category.id,
-                'name': category.name,
-                'icon': category.icon,
-                'subcategories': []
-            }
-            
-            for subcategory in category.get_children():
-                subcategory_data = {
-                    'id': subcategory.id,
-                    'name': subcategory.name,
-                    'slug': subcategory.slug,
-                    'subsubcategories': []
-                }
-                
-                for subsubcategory in subcategory.get_children():
-                    subsubcategory_data = {
-                        'id': subsubcategory.id,
-                        'name': subsubcategory.name,
-                        'slug': subsubcategory.slug
+        result = [
+            {
+                'id': category['id'],
+                'name': category['name'],
+                'icon': category['icon'],
+                'subcategories': [
+                    {
+                        'id': subcategory['id'],
+                        'name': subcategory['name'],
+                        'slug': subcategory['slug'],
+                        'subsubcategories': [
+                            {
+                                'id': subsubcategory['id'],
+                                'name': subsubcategory['name'],
+                                'slug': subsubcategory['slug'],
+                            }
+                            for subsubcategory in subcategory['children']
+                        ],
                     }
-                    subsubcategory_data['subsubcategories'].append(subsubcategory_data)
-                
-                category_data['subcategories'].append(subcategory_data)
-            
-            result.append(category_data)
+                    for subcategory in category['children']
+                ],
+            }
+            for category in CategoryTreeService.get_menu()
+        ]
         
         return Response(result)
 
@@ -381,9 +383,7 @@ class OrderViewSet(viewsets.ModelViewSet):
     def cancel(self, request, pk=None):
         """Отменить заказ"""
         order = self.get_object()
-        if order.status in ['pending', 'confirmed']:
-            order.status = 'cancelled'
-            order.save()
+        if CheckoutService.cancel_order(order):
             return Response({'message': 'Заказ отменен'}, status=status.HTTP_200_OK)
         return Response({'error': 'Заказ нельзя отменить'}, status=status.HTTP_400_BAD_REQUEST)
     
@@ -429,22 +429,19 @@ class CartViewSet(viewsets.ModelViewSet):
             return Response({'error': 'product_id обязателен'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            product = Product.objects.get(id=product_id)
+            product = Product.objects.get(id=product_id, is_active=True)
         except Product.DoesNotExist:
             return Response({'error': 'Товар не найден'}, status=status.HTTP_404_NOT_FOUND)
         
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
+        # Свободный остаток плюс собственный резерв покупателя
+        available = InventoryService.get_available(product, request.user)
+        if quantity <= 0 or quantity > available:
+            return Response({'error': 'Недостаточно товара на складе'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        store = DatabaseCartStore(request.user)
+        store.add(product.pk, quantity, limit=available)
         
-        serializer = self.get_serializer(cart)
+        serializer = self.get_serializer(store.get_cart())
         return Response(serializer.data)
     
     @method_decorator(ratelimit(key='user', rate='50/h', method='POST'))
@@ -464,6 +461,8 @@ class CartViewSet(viewsets.ModelViewSet):
         
         if quantity <= 0:
             cart_item.delete()
+        elif quantity > InventoryService.get_available(cart_item.product, request.user):
+            return Response({'error': 'Недостаточно товара на складе'}, status=status.HTTP_400_BAD_REQUEST)
         else:
             cart_item.quantity = quantity
             cart_item.save()
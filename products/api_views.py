@@ -4,16 +4,16 @@ API views для мега меню и каталога товаров
 import logging
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
-from django.views.decorators.cache import cache_page
 from django.core.cache import cache
 from django.db.models import Q, Count, Prefetch
 from .models import Category, Product
+from .category_tree import CategoryTreeService
+from .search.suggest import SuggestService
 
 logger = logging.getLogger(__name__)
 
 
 @require_http_methods(["GET"])
-@cache_page(60 * 15)  # Кэшируем на 15 минут
 def mega_menu_categories(request):
     """
     API endpoint для получения дерева категорий для мега меню
@@ -24,66 +24,8 @@ def mega_menu_categories(request):
     try:
         logger.info("Loading mega menu categories")
         
-        # Получаем все активные категории с подкатегориями
-        categories = Category.objects.filter(
-            is_active=True,
-            show_in_megamenu=True,
-            parent=None  # Только корневые категории
-        ).prefetch_related(
-            Prefetch(
-                'children',
-                queryset=Category.objects.filter(
-                    is_active=True,
-                    show_in_megamenu=True
-                ).prefetch_related(
-                    Prefetch(
-                        'children',
-                        queryset=Category.objects.filter(
-                            is_active=True,
-                            show_in_megamenu=True
-                        ).order_by('sort_order')
-                    )
-                ).order_by('sort_order')
-            )
-        ).order_by('sort_order')
-        
-        def serialize_category(category):
-            """Сериализует категорию в словарь"""
-            try:
-                return {
-                    'id': category.id,
-                    'name': category.name,
-                    'slug': category.slug,
-                    'icon': category.icon or '',
-                    'level': getattr(category, 'category_level', 0),
-                    'products_count': getattr(category, 'products_count', 0),
-                    'has_products': getattr(category, 'has_products', False),
-                    'image_url': category.mega_menu_image.url if category.mega_menu_image else None,
-                    'description': getattr(category, 'mega_menu_description', ''),
-                    'children': [serialize_category(child) for child in category.children.all()]
-                }
-            except Exception as e:
-                logger.error(f"Error serializing category {category.id}: {str(e)}")
-                return {
-                    'id': category.id,
-                    'name': category.name,
-                    'slug': category.slug,
-                    'icon': '',
-                    'level': 0,
-                    'products_count': 0,
-                    'has_products': False,
-                    'image_url': None,
-                    'description': '',
-                    'children': []
-                }
-        
-        serialized_categories = []
-        for cat in categories:
-            try:
-                serialized_categories.append(serialize_category(cat))
-            except Exception as e:
-                logger.error(f"Error processing category {cat.id}: {str(e)}")
-                continue
+        # Дерево мегаменю строится одним запросом и хранится в кэше
+        serialized_categories = CategoryTreeService.get_menu()
         
         data = {
             'success': True,
@@ -242,20 +184,15 @@ def search_categories(request):
         Q(name__icontains=query) | Q(description__icontains=query),
         is_active=True,
         show_in_megamenu=True
-    ).select_related('parent').order_by(
+    ).order_by(
         'category_level',  # Сначала корневые категории
         'products_count',  # Потом по количеству товаров
         'name'
     )[:limit]
     
-    def get_category_path(category):
-        """Возвращает полный путь категории"""
-        path = []
-        current = category
-        while current:
-            path.append(current.name)
-            current = current.parent
-        return ' > '.join(reversed(path))
+    # Пути всех найденных категорий разрешаются одним обращением к кэшу названий
+    categories = list(categories)
+    breadcrumbs = CategoryTreeService.get_breadcrumbs_bulk(categories)
     
     results = []
     for category in categories:
@@ -264,7 +201,7 @@ def search_categories(request):
             'name': category.name,
             'slug': category.slug,
             'level': category.category_level,
-            'path': get_category_path(category),
+            'path': ' > '.join(crumb['name'] for crumb in breadcrumbs[category.pk]),
             'products_count': category.products_count,
             'has_products': category.has_products,
             'icon': category.icon,
@@ -618,4 +555,27 @@ def product_banner_reorder(request):
         return JsonResponse({
             'success': False,
             'error': 'Ошибка при изменении порядка баннеров'
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def search_suggest(request):
+    """
+    API подсказок для строки поиска: товары, бренды и категории по префиксу
+    
+    Подсказки берутся из индекса в памяти процесса, база на каждое нажатие
+    клавиши не запрашивается.
+    
+    Query parameters:
+        q: Начало поискового запроса
+        limit: Количество подсказок каждого типа (по умолчанию 5, максимум 10)
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 5)), 1), 10)
+    except ValueError:
+        limit = 5
+    
+    data = SuggestService.suggest(query, limit=limit)
+    data['query'] = query
+    return JsonResponse(data)
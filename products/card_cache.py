@@ -0,0 +1,58 @@
+"""
+Кэш отрендеренных карточек товаров (фрагменты HTML)
+
+Ключ фрагмента включает язык, товар и момент последнего изменения его
+карточки в ProductListing, поэтому изменение товара, его основного
+изображения или цены просто дает новый ключ — старые фрагменты явно не
+удаляются, а истекают по таймауту.
+"""
+import logging
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+logger = logging.getLogger(__name__)
+
+CARD_TEMPLATE = 'components/product_card.html'
+# Увеличить при изменении шаблона карточки, чтобы не отдавать старую разметку
+CARD_TEMPLATE_VERSION = 1
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class ProductCardCache:
+    """Сборка сетки карточек из закэшированных фрагментов"""
+
+    @staticmethod
+    def cache_key(listing):
+        """Версионированный ключ фрагмента карточки ProductListing"""
+        stamp = int(listing.updated_at.timestamp() * 1000000) if listing.updated_at else 0
+        return f'product_card:v{CARD_TEMPLATE_VERSION}:{listing.language_code}:{listing.product_id}:{stamp}'
+
+    @staticmethod
+    def render_cards(listings):
+        """
+        Возвращает HTML карточек в порядке listings
+
+        Готовые фрагменты читаются одним get_many, недостающие рендерятся
+        и сохраняются одним set_many.
+        """
+        listings = list(listings)
+        keys = [ProductCardCache.cache_key(listing) for listing in listings]
+        fragments = cache.get_many(keys)
+
+        missing = {}
+        for key, listing in zip(keys, listings):
+            if key not in fragments:
+                missing[key] = render_to_string(CARD_TEMPLATE, {'product': listing})
+        if missing:
+            cache.set_many(missing, CARD_CACHE_TIMEOUT)
+            fragments.update(missing)
+            logger.debug('Отрендерено карточек: %s из %s', len(missing), len(keys))
+
+        return [mark_safe(fragments[key]) for key in keys]
+
+    @staticmethod
+    def render_html(listings):
+        """HTML всей сетки карточек одной строкой (для AJAX-ответов)"""
+        return mark_safe(''.join(ProductCardCache.render_cards(listings)))
@@ -0,0 +1,438 @@
+"""
+Корзина: хранение количеств и содержимое с ценами и итогами
+
+Корзина в любом хранилище — это только {product_id: количество}:
+- CacheCartStore — корзина гостя в кэше (Redis), по ключу на позицию;
+  в сессию пишется лишь токен корзины, поэтому добавление товара не
+  перезаписывает сессию целиком;
+- DatabaseCartStore — CartItem авторизованного пользователя.
+
+При входе корзина гостя сливается в CartItem (CartService.merge_guest_cart).
+Старые корзины в сессии (session['cart'], в том числе в формате
+{'quantity', 'price'}) переносятся в хранилище при первом обращении.
+
+CartService догружает все товары корзины одним запросом, один раз
+считает цену каждой позиции (со скидкой, как Product.final_price) и
+возвращает позиции вместе с итогами. Сводка (количество, сумма, валюта)
+для значка в шапке хранится в кэше и сбрасывается при изменении корзины.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Cart, CartItem, Product
+
+# Список id товаров корзины гостя и количество каждого из них под своим ключом
+CART_CACHE_KEY = 'cart:{token}'
+CART_LINE_KEY = 'cart:{token}:{product_id}'
+# Блокировка списка товаров корзины гостя на время его дописывания
+CART_LOCK_KEY = 'cart_lock:{token}'
+CART_LOCK_TIMEOUT = 5
+CART_SESSION_KEY = 'cart_id'
+LEGACY_CART_SESSION_KEY = 'cart'
+CART_TIMEOUT = 60 * 60 * 24 * 30
+# Сводка для значка корзины: сбрасывается при изменении корзины, а цены
+# товаров в ней могут отставать не дольше этого времени
+CART_SUMMARY_KEY = 'cart_summary:{owner}'
+CART_SUMMARY_TIMEOUT = 60 * 10
+DEFAULT_CURRENCY = 'RUB'
+
+_state = threading.local()
+
+
+class CartLine:
+    """Позиция корзины"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.unit_price = product.final_price
+        self.total_price = self.unit_price * quantity
+
+    @property
+    def image(self):
+        """Первое изображение товара из уже загруженных"""
+        images = self.product.images.all()
+        return images[0] if images else None
+
+
+class CartContents:
+    """Позиции корзины и итоги по ним"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.total_items = sum(line.quantity for line in lines)
+        self.total_price = sum((line.total_price for line in lines), Decimal('0'))
+
+    @property
+    def product_ids(self):
+        return [line.product.pk for line in self.lines]
+
+    @property
+    def summary(self):
+        """Сводка для значка корзины: количество, сумма и валюта"""
+        currency = self.lines[0].product.currency if self.lines else DEFAULT_CURRENCY
+        return {'count': self.total_items, 'subtotal': self.total_price, 'currency': currency}
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+
+def normalize_quantities(cart):
+    """
+    Приводит корзину к виду {product_id: количество}
+
+    Понимает ключи-строки из сессии и значения как в старом формате
+    {'quantity': ..., 'price': ...}; пустые позиции отбрасываются.
+    """
+    quantities = {}
+    for product_id, quantity in cart.items():
+        if isinstance(quantity, dict):
+            quantity = quantity.get('quantity', 0)
+        try:
+            product_id, quantity = int(product_id), int(quantity)
+        except (TypeError, ValueError):
+            continue
+        if quantity > 0:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+class CacheCartStore:
+    """
+    Корзина гостя в кэше: отдельный ключ на каждую позицию
+
+    Количество товара хранится под своим ключом и меняется через
+    cache.add/cache.incr, поэтому параллельные добавления разных товаров
+    (или одного товара из двух вкладок) не перезаписывают друг друга.
+    Под ключом корзины лежит список id ее товаров; он дописывается только
+    при появлении нового товара и только под блокировкой (locked), чтобы
+    два запроса не записали каждый свой список. Удаленные позиции просто
+    пропускаются при чтении.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    @property
+    def key(self):
+        token = self.session.get(CART_SESSION_KEY)
+        return CART_CACHE_KEY.format(token=token) if token else None
+
+    @property
+    def summary_key(self):
+        token = self.session.get(CART_SESSION_KEY)
+        return CART_SUMMARY_KEY.format(owner=f'guest:{token}') if token else None
+
+    def line_key(self, product_id):
+        return CART_LINE_KEY.format(token=self.session.get(CART_SESSION_KEY), product_id=product_id)
+
+    def get_product_ids(self):
+        """id товаров, когда-либо добавленных в корзину (с удаленными позициями)"""
+        key = self.key
+        product_ids = (cache.get(key) if key else None) or []
+        if isinstance(product_ids, dict):
+            # Корзина прежнего формата: весь словарь одним значением
+            quantities = normalize_quantities(product_ids)
+            cache.set_many({self.line_key(product_id): quantity for product_id, quantity in quantities.items()}, CART_TIMEOUT)
+            product_ids = list(quantities)
+            cache.set(key, product_ids, CART_TIMEOUT)
+        return product_ids
+
+    def get(self):
+        keys = {self.line_key(product_id): product_id for product_id in self.get_product_ids()}
+        if not keys:
+            return {}
+        return {
+            keys[key]: quantity
+            for key, quantity in cache.get_many(list(keys)).items() if quantity and quantity > 0
+        }
+
+    def ensure_token(self):
+        if self.key is None:
+            # Сессия меняется только при первом добавлении товара
+            self.session[CART_SESSION_KEY] = uuid.uuid4().hex
+
+    @contextmanager
+    def locked(self):
+        """
+        Блокирует список товаров корзины между запросами (cache.add)
+
+        Ключ блокировки живет CART_LOCK_TIMEOUT, поэтому блокировку упавшего
+        запроса можно дождаться; снимает ее только тот, кто ее взял.
+
+        Raises:
+            RuntimeError: Блокировку не удалось взять и после ее истечения
+        """
+        lock_key = CART_LOCK_KEY.format(token=self.session.get(CART_SESSION_KEY))
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + CART_LOCK_TIMEOUT + 1
+        while not cache.add(lock_key, owner, CART_LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'Не удалось заблокировать корзину {lock_key}')
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if cache.get(lock_key) == owner:
+                cache.delete(lock_key)
+
+    def track(self, product_ids):
+        """Дописывает новые товары в список корзины и продлевает его"""
+        with self.locked():
+            current = self.get_product_ids()
+            missing = [product_id for product_id in product_ids if product_id not in current]
+            if missing:
+                cache.set(self.key, current + missing, CART_TIMEOUT)
+            else:
+                cache.touch(self.key, CART_TIMEOUT)
+
+    def changed(self):
+        cache.delete(self.summary_key)
+
+    def increment(self, product_id, quantity):
+        """Прибавляет количество к позиции и возвращает новое"""
+        key = self.line_key(product_id)
+        if cache.add(key, quantity, CART_TIMEOUT):
+            return quantity
+        try:
+            total = cache.incr(key, quantity)
+        except ValueError:
+            # Позиция истекла между add и incr
+            cache.set(key, quantity, CART_TIMEOUT)
+            return quantity
+        # incr в некоторых бэкендах не сохраняет срок жизни ключа
+        cache.touch(key, CART_TIMEOUT)
+        return total
+
+    def save(self, quantities):
+        """Заменяет содержимое корзины"""
+        self.ensure_token()
+        with self.locked():
+            current = self.get_product_ids()
+            cache.delete_many([self.line_key(product_id) for product_id in current if product_id not in quantities])
+            cache.set_many({self.line_key(product_id): quantity for product_id, quantity in quantities.items()}, CART_TIMEOUT)
+            cache.set(self.key, list(quantities), CART_TIMEOUT)
+        self.changed()
+
+    def add(self, product_id, quantity, limit=None):
+        """Прибавляет количество (не больше limit) и возвращает новое"""
+        self.ensure_token()
+        total = self.increment(product_id, quantity)
+        if limit is not None and total > limit:
+            cache.set(self.line_key(product_id), limit, CART_TIMEOUT)
+            total = limit
+        self.track([product_id])
+        self.changed()
+        return total
+
+    def add_many(self, quantities):
+        self.ensure_token()
+        for product_id, quantity in quantities.items():
+            self.increment(product_id, quantity)
+        self.track(list(quantities))
+        self.changed()
+
+    def set(self, product_id, quantity):
+        if quantity <= 0:
+            self.remove(product_id)
+            return
+        self.ensure_token()
+        cache.set(self.line_key(product_id), quantity, CART_TIMEOUT)
+        self.track([product_id])
+        self.changed()
+
+    def remove(self, product_id):
+        if self.key:
+            cache.delete(self.line_key(product_id))
+            self.changed()
+
+    def clear(self):
+        key = self.key
+        if key:
+            lines = [self.line_key(product_id) for product_id in self.get_product_ids()]
+            cache.delete_many([key, self.summary_key] + lines)
+
+
+class DatabaseCartStore:
+    """Корзина пользователя в CartItem"""
+
+    def __init__(self, user):
+        self.user = user
+
+    @property
+    def summary_key(self):
+        return CartService.get_summary_key(self.user.pk)
+
+    def get_cart(self):
+        cart, _created = Cart.objects.get_or_create(user=self.user)
+        return cart
+
+    def get(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def add(self, product_id, quantity, limit=None):
+        """Прибавляет количество (не больше limit) и возвращает новое"""
+        cart_item, created = CartItem.objects.get_or_create(
+            cart=self.get_cart(), product_id=product_id, defaults={'quantity': quantity},
+        )
+        if not created:
+            cart_item.quantity += quantity
+            if limit is not None:
+                cart_item.quantity = min(cart_item.quantity, limit)
+            cart_item.save(update_fields=['quantity'])
+        return cart_item.quantity
+
+    def add_many(self, quantities):
+        """
+        Сливает количества в корзину: одним bulk_update для имеющихся
+        позиций и одним bulk_create для новых
+        """
+        product_ids = set(Product.objects.filter(pk__in=list(quantities)).values_list('pk', flat=True))
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if product_id in product_ids}
+        if not quantities:
+            return
+        cart = self.get_cart()
+        with transaction.atomic():
+            existing = {item.product_id: item for item in CartItem.objects.filter(cart=cart, product_id__in=list(quantities))}
+            for product_id, item in existing.items():
+                item.quantity += quantities[product_id]
+            CartItem.objects.bulk_update(list(existing.values()), ['quantity'])
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product_id=product_id, quantity=quantity)
+                for product_id, quantity in quantities.items() if product_id not in existing
+            ])
+            # Пакетные запросы не вызывают сигналы CartItem
+            CartService.invalidate_summary(self.user.pk)
+
+    def set(self, product_id, quantity):
+        if quantity > 0:
+            CartItem.objects.update_or_create(cart=self.get_cart(), product_id=product_id, defaults={'quantity': quantity})
+        else:
+            self.remove(product_id)
+
+    def remove(self, product_id):
+        CartItem.objects.filter(cart__user=self.user, product_id=product_id).delete()
+
+    def clear(self):
+        # Сводка сбрасывается один раз, а не сигналом на каждую позицию
+        with CartService.summary_invalidation_suspended():
+            CartItem.objects.filter(cart__user=self.user).delete()
+        CartService.invalidate_summary(self.user.pk)
+
+
+class CartService:
+    """Доступ к корзине гостя или пользователя"""
+
+    @staticmethod
+    def get_store(request):
+        """
+        Хранилище корзины текущего посетителя
+
+        Корзина старого формата из сессии при этом переносится в хранилище.
+        """
+        if request.user.is_authenticated:
+            store = DatabaseCartStore(request.user)
+        else:
+            store = CacheCartStore(request.session)
+        legacy = request.session.pop(LEGACY_CART_SESSION_KEY, None)
+        if legacy:
+            store.add_many(normalize_quantities(legacy))
+        return store
+
+    @staticmethod
+    def merge_guest_cart(request, user):
+        """Переносит корзину гостя в CartItem пользователя после входа"""
+        guest = CacheCartStore(request.session)
+        quantities = guest.get()
+        legacy = request.session.pop(LEGACY_CART_SESSION_KEY, None)
+        if legacy:
+            for product_id, quantity in normalize_quantities(legacy).items():
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+        if quantities:
+            DatabaseCartStore(user).add_many(quantities)
+        guest.clear()
+        request.session.pop(CART_SESSION_KEY, None)
+
+    @staticmethod
+    def get_quantities(request):
+        """Количества товаров корзины: {product_id: количество}"""
+        return CartService.get_store(request).get()
+
+    @staticmethod
+    def hydrate(quantities):
+        """
+        Позиции корзины по количествам одним запросом товаров
+
+        Товары, удаленные из каталога, пропускаются.
+        """
+        products = Product.objects.filter(pk__in=list(quantities)).prefetch_related('translations', 'images').in_bulk()
+        return CartContents([
+            CartLine(products[product_id], quantity)
+            for product_id, quantity in quantities.items()
+            if product_id in products and quantity > 0
+        ])
+
+    @staticmethod
+    def get_contents(request):
+        """Позиции и итоги корзины текущего посетителя (заодно обновляет сводку в кэше)"""
+        store = CartService.get_store(request)
+        contents = CartService.hydrate(store.get())
+        if store.summary_key:
+            cache.set(store.summary_key, contents.summary, CART_SUMMARY_TIMEOUT)
+        return contents
+
+    @staticmethod
+    def get_summary(request):
+        """
+        Количество, сумма и валюта корзины из кэша
+
+        При попадании в кэш не читает ни CartItem, ни товары; у гостя без
+        корзины сводка пустая без обращений к кэшу.
+        """
+        store = CartService.get_store(request)
+        key = store.summary_key
+        if key is None:
+            return CartContents([]).summary
+        summary = cache.get(key)
+        if summary is None:
+            summary = CartService.hydrate(store.get()).summary
+            cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+        return summary
+
+    @staticmethod
+    def get_summary_key(user_id):
+        return CART_SUMMARY_KEY.format(owner=f'user:{user_id}')
+
+    @staticmethod
+    def invalidate_summary(user_id):
+        """Сбрасывает сводку корзины пользователя после фиксации транзакции"""
+        key = CartService.get_summary_key(user_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    @staticmethod
+    def is_summary_invalidation_suspended():
+        return getattr(_state, 'suspended', 0) > 0
+
+    @staticmethod
+    @contextmanager
+    def summary_invalidation_suspended():
+        """
+        Отключает сброс сводки сигналами CartItem в текущем потоке
+
+        Для массовых изменений одной корзины: вызывающий код сам сбрасывает
+        сводку один раз через invalidate_summary.
+        """
+        _state.suspended = getattr(_state, 'suspended', 0) + 1
+        try:
+            yield
+        finally:
+            _state.suspended -= 1
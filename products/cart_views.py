@@ -4,95 +4,41 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
-from .models import Cart, CartItem, Product
+from .models import Product
+from .cart import CartService
+from .inventory import InventoryService
+from .recommendations import RecommendationPoolService
 from django.utils.translation import gettext_lazy as _
 import json
 
 
-def get_session_cart(request):
-    """Получить корзину из сессии"""
-    if 'cart' not in request.session:
-        request.session['cart'] = {}
-    return request.session['cart']
-
-
-def save_session_cart(request, cart):
-    """Сохранить корзину в сессию"""
-    request.session['cart'] = cart
-
-
 def get_cart_items(request):
     """Получить товары корзины (из БД для авторизованных или из сессии для неавторизованных)"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        return cart.items.select_related('product').prefetch_related('product__images')
-    else:
-        session_cart = get_session_cart(request)
-        cart_items = []
-        for product_id, quantity in session_cart.items():
-            try:
-                product = Product.objects.get(id=product_id)
-                cart_items.append({
-                    'product': product,
-                    'quantity': quantity,
-                    'total_price': product.price * quantity
-                })
-            except Product.DoesNotExist:
-                continue
-        return cart_items
+    return CartService.get_contents(request).lines
 
 
 def get_cart_total_items(request):
     """Получить общее количество товаров в корзине"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        return cart.total_items
-    else:
-        session_cart = get_session_cart(request)
-        return sum(session_cart.values())
+    return sum(CartService.get_quantities(request).values())
 
 
 def get_cart_total_price(request):
     """Получить общую стоимость корзины"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        return cart.total_price
-    else:
-        session_cart = get_session_cart(request)
-        total = 0
-        for product_id, quantity in session_cart.items():
-            try:
-                product = Product.objects.get(id=product_id)
-                total += product.price * quantity
-            except Product.DoesNotExist:
-                continue
-        return total
+    return CartService.get_contents(request).total_price
 
 
 def cart_view(request):
     """Страница корзины"""
-    cart_items = get_cart_items(request)
-    cart_total_items = get_cart_total_items(request)
-    cart_total_price = get_cart_total_price(request)
+    # Позиции и итоги считаются за один проход по товарам корзины
+    contents = CartService.get_contents(request)
     
     # Получаем рекомендуемые товары (исключая те, что уже в корзине)
-    cart_product_ids = []
-    if request.user.is_authenticated:
-        cart_product_ids = [item.product.id for item in cart_items]
-    else:
-        cart_product_ids = [int(pid) for pid in get_session_cart(request).keys()]
-    
-    recommended_products = Product.objects.filter(
-        is_active=True
-    ).exclude(
-        id__in=cart_product_ids
-    ).order_by('?')[:12]  # Случайные товары для демонстрации
+    recommended_products = RecommendationPoolService.draw(contents.product_ids, 12)
     
     context = {
-        'cart_items': cart_items,
-        'cart_total_items': cart_total_items,
-        'cart_total_price': cart_total_price,
+        'cart_items': contents.lines,
+        'cart_total_items': contents.total_items,
+        'cart_total_price': contents.total_price,
         'user_authenticated': request.user.is_authenticated,
         'recommended_products': recommended_products,
     }
@@ -115,44 +61,17 @@ def add_to_cart(request, product_id):
     if quantity <= 0:
         return JsonResponse({'success': False, 'message': 'Количество должно быть больше 0'})
     
-    if quantity > product.stock_quantity:
+    # Свободный остаток плюс собственный резерв покупателя
+    available = InventoryService.get_available(product, request.user)
+    if quantity > available:
         return JsonResponse({'success': False, 'message': 'Недостаточно товара на складе'})
     
-    if request.user.is_authenticated:
-        # Для авторизованных пользователей - работаем с БД
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            if cart_item.quantity > product.stock_quantity:
-                cart_item.quantity = product.stock_quantity
-            cart_item.save()
-        
-        cart_total_items = cart.total_items
-        cart_total_price = cart.total_price
-    else:
-        # Для неавторизованных пользователей - работаем с сессией
-        session_cart = get_session_cart(request)
-        product_id_str = str(product_id)
-        
-        if product_id_str in session_cart:
-            session_cart[product_id_str] += quantity
-        else:
-            session_cart[product_id_str] = quantity
-        
-        # Проверяем лимит склада
-        if session_cart[product_id_str] > product.stock_quantity:
-            session_cart[product_id_str] = product.stock_quantity
-        
-        save_session_cart(request, session_cart)
-        cart_total_items = get_cart_total_items(request)
-        cart_total_price = get_cart_total_price(request)
+    # CartItem для авторизованных, кэш для гостей; количество ограничено складом
+    CartService.get_store(request).add(product.pk, quantity, limit=available)
+    
+    contents = CartService.get_contents(request)
+    cart_total_items = contents.total_items
+    cart_total_price = contents.total_price
     
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({
@@ -179,46 +98,24 @@ def update_cart_item(request, product_id):
     else:
         quantity = int(request.POST.get('quantity', 1))
     
+    store = CartService.get_store(request)
     if quantity <= 0:
         # Удаляем товар из корзины
-        if request.user.is_authenticated:
-            try:
-                cart_item = CartItem.objects.get(cart__user=request.user, product=product)
-                cart_item.delete()
-            except CartItem.DoesNotExist:
-                pass
-        else:
-            session_cart = get_session_cart(request)
-            product_id_str = str(product_id)
-            if product_id_str in session_cart:
-                del session_cart[product_id_str]
-                save_session_cart(request, session_cart)
-        
+        store.remove(product.pk)
         message = 'Товар удален из корзины'
     else:
-        if quantity > product.stock_quantity:
-            quantity = product.stock_quantity
+        available = InventoryService.get_available(product, request.user)
+        if quantity > available:
+            quantity = available
             message = f'Количество ограничено наличием на складе ({quantity} шт.)'
         else:
             message = 'Количество обновлено'
         
-        if request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                defaults={'quantity': quantity}
-            )
-            if not created:
-                cart_item.quantity = quantity
-                cart_item.save()
-        else:
-            session_cart = get_session_cart(request)
-            session_cart[str(product_id)] = quantity
-            save_session_cart(request, session_cart)
+        store.set(product.pk, quantity)
     
-    cart_total_items = get_cart_total_items(request)
-    cart_total_price = get_cart_total_price(request)
+    contents = CartService.get_contents(request)
+    cart_total_items = contents.total_items
+    cart_total_price = contents.total_price
     
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({
@@ -238,21 +135,11 @@ def remove_from_cart(request, product_id):
     """Удалить товар из корзины"""
     product = get_object_or_404(Product, id=product_id)
     
-    if request.user.is_authenticated:
-        try:
-            cart_item = CartItem.objects.get(cart__user=request.user, product=product)
-            cart_item.delete()
-        except CartItem.DoesNotExist:
-            pass
-    else:
-        session_cart = get_session_cart(request)
-        product_id_str = str(product_id)
-        if product_id_str in session_cart:
-            del session_cart[product_id_str]
-            save_session_cart(request, session_cart)
+    CartService.get_store(request).remove(product.pk)
     
-    cart_total_items = get_cart_total_items(request)
-    cart_total_price = get_cart_total_price(request)
+    contents = CartService.get_contents(request)
+    cart_total_items = contents.total_items
+    cart_total_price = contents.total_price
     
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({
@@ -281,10 +168,7 @@ def clear_cart(request):
             messages.error(request, 'Необходимо войти в систему')
             return redirect('auth:login')
     
-    cart = get_object_or_404(Cart, user=request.user)
-    cart.items.all().delete()
-    cart.updated_at = cart.updated_at
-    cart.save()
+    CartService.get_store(request).clear()
     
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({
@@ -300,10 +184,11 @@ def clear_cart(request):
 
 def cart_count(request):
     """Получить количество товаров в корзине для AJAX"""
-    count = get_cart_total_items(request)
-    total_price = get_cart_total_price(request)
+    # Сводка берется из кэша без обращения к Cart/CartItem
+    summary = CartService.get_summary(request)
     
     return JsonResponse({
-        'count': count,
-        'total_price': str(total_price)
+        'count': summary['count'],
+        'total_price': str(summary['subtotal']),
+        'currency': summary['currency'],
     })
@@ -0,0 +1,168 @@
+"""
+Единый компилятор фильтров и сортировки каталога
+
+Превращает параметры запроса (GET страницы или query_params API) в один
+QuerySet товаров (Product) или их карточек (ProductListing). Фильтры по
+категории, магазинам и тегам идут по id, а условия по связям многие-ко-многим
+и переводам строятся через EXISTS, поэтому запросу не нужны JOIN с последующим
+distinct().
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import translation
+
+from .models import Product, ProductListing
+from .pagination import SORT_ORDERS, DEFAULT_SORT
+from .search import get_search_backend
+
+NAME_SORTS = ('name_asc', 'name_desc')
+SORT_CHOICES = tuple(SORT_ORDERS) + NAME_SORTS
+
+
+class ProductQueryCompiler:
+    """
+    Компилятор параметров каталога в QuerySet товаров
+
+    Args:
+        params: QueryDict или dict с параметрами запроса
+        category: Категория из URL — фильтрует по всему ее поддереву
+        default_sort: Сортировка, если параметр sort не задан или неизвестен
+    """
+
+    def __init__(self, params, category=None, default_sort=DEFAULT_SORT):
+        self.category = category
+        self.filters = self.clean(params)
+        sort = params.get('sort') or default_sort
+        self.sort = sort if sort in SORT_CHOICES else default_sort
+        # Сортировку выбрал пользователь, а не подставило значение по умолчанию
+        self.explicit_sort = params.get('sort') in SORT_CHOICES
+
+    @staticmethod
+    def clean(params):
+        """Нормализует параметры запроса, отбрасывая некорректные значения"""
+        def get_list(name):
+            if hasattr(params, 'getlist'):
+                values = params.getlist(name)
+            else:
+                values = params.get(name) or []
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+            ids = []
+            for value in values:
+                for part in str(value).split(','):
+                    if part.strip().isdigit():
+                        ids.append(int(part))
+            return ids
+
+        def get_decimal(name):
+            try:
+                return Decimal(str(params.get(name)).replace(',', '.')) if params.get(name) else None
+            except InvalidOperation:
+                return None
+
+        category = (params.get('category') or '').split(':')[0].strip()
+        return {
+            'q': (params.get('q') or params.get('search') or '').strip(),
+            'category': category,
+            'shops': get_list('shops'),
+            'tags': get_list('tags'),
+            'price_min': get_decimal('price_min'),
+            'price_max': get_decimal('price_max'),
+            'brand': (params.get('brand') or '').strip(),
+            'min_rating': get_decimal('min_rating'),
+            'in_stock': params.get('in_stock') == '1',
+            'currency': (params.get('currency') or '').strip().upper(),
+        }
+
+    def compile(self, queryset=None):
+        """Фильтрует и сортирует QuerySet"""
+        return self.order(self.filter(queryset))
+
+    def filter(self, queryset=None, search=True):
+        """Применяет фильтры (без сортировки); search=False — все, кроме поискового запроса"""
+        if queryset is None:
+            queryset = Product.objects.filter(is_active=True)
+        filters = self.filters
+        ref = self._product_ref(queryset)
+
+        if self.category is not None:
+            queryset = queryset.filter(category_id__in=self.category.get_descendant_ids())
+        if filters['category']:
+            if filters['category'].isdigit():
+                queryset = queryset.filter(category_id=int(filters['category']))
+            else:
+                queryset = queryset.filter(category__slug=filters['category'])
+
+        if filters['shops']:
+            queryset = self.filter_shops(queryset, filters['shops'], ref)
+        if filters['tags']:
+            queryset = self.filter_tags(queryset, filters['tags'], ref)
+        if filters['price_min'] is not None:
+            queryset = queryset.filter(price__gte=filters['price_min'])
+        if filters['price_max'] is not None:
+            queryset = queryset.filter(price__lte=filters['price_max'])
+        if filters['brand']:
+            queryset = queryset.filter(brand__icontains=filters['brand'])
+        if filters['min_rating'] is not None:
+            queryset = queryset.filter(rating__gte=filters['min_rating'])
+        if filters['in_stock']:
+            queryset = queryset.filter(stock_quantity__gt=0)
+        if filters['currency']:
+            queryset = queryset.filter(currency=filters['currency'])
+        if filters['q'] and search:
+            queryset = self.search(queryset, filters['q'], ref)
+        return queryset
+
+    def order(self, queryset):
+        """Применяет сортировку; в конце ключа всегда id для стабильной пагинации"""
+        prefix = '-' if self.sort == 'name_desc' else ''
+        if self.sort in NAME_SORTS and queryset.model is ProductListing:
+            # В карточке название уже на языке строки
+            return queryset.order_by(f'{prefix}name', 'id')
+        if self.sort in NAME_SORTS:
+            # Название берется подзапросом по текущему языку, чтобы JOIN с
+            # таблицей переводов не размножал строки товаров
+            translation_model = Product._parler_meta.root_model
+            queryset = queryset.annotate(sort_name=Subquery(
+                translation_model.objects.filter(
+                    master_id=OuterRef('pk'),
+                    language_code=translation.get_language(),
+                ).values('name')[:1]
+            ))
+            return queryset.order_by(f'{prefix}sort_name', 'id')
+        return queryset.order_by(*SORT_ORDERS[self.sort])
+
+    @property
+    def relevance_sort(self):
+        """Выдача поиска без явно выбранной сортировки упорядочивается по релевантности"""
+        return bool(self.filters['q']) and not self.explicit_sort
+
+    @property
+    def keyset_sort(self):
+        """Ключ сортировки для KeysetPaginator или None, если курсор неприменим"""
+        return self.sort if self.sort in SORT_ORDERS else None
+
+    @staticmethod
+    def filter_shops(queryset, shop_ids, ref='pk'):
+        """Товары, представленные хотя бы в одном из магазинов"""
+        return queryset.filter(Exists(Product.shops.through.objects.filter(
+            product_id=OuterRef(ref), shop_id__in=shop_ids,
+        )))
+
+    @staticmethod
+    def filter_tags(queryset, tag_ids, ref='pk'):
+        """Товары, отмеченные хотя бы одним из тегов"""
+        return queryset.filter(Exists(Product.tags.through.objects.filter(
+            product_id=OuterRef(ref), tag_id__in=tag_ids,
+        )))
+
+    @staticmethod
+    def search(queryset, query, ref='pk'):
+        """Поиск по названию и описанию (на любом языке), тегам, бренду и характеристикам"""
+        return get_search_backend().filter(queryset, query, ref)
+
+    @staticmethod
+    def _product_ref(queryset):
+        """Поле, по которому подзапросы EXISTS связываются с товаром"""
+        return 'product_id' if queryset.model is ProductListing else 'pk'
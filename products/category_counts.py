@@ -0,0 +1,119 @@
+"""
+Счетчики активных товаров в категориях (Category.products_count / has_products)
+
+Счетчик категории включает товары всего ее поддерева, кроме веток под
+неактивными подкатегориями — так же, как Category.get_descendant_ids().
+Изменения товаров применяются инкрементально вдоль пути к корню, полная
+пересборка выполняется одним сгруппированным запросом по товарам.
+"""
+import logging
+
+from django.db.models import BooleanField, Count, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Greatest
+
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryCounterService:
+    """Сервис поддержки счетчиков товаров в категориях"""
+
+    @staticmethod
+    def get_counted_ancestors(category_id):
+        """
+        Категории, в счетчик которых входит товар категории category_id
+
+        Путь поднимается от категории к корню и обрывается на первой
+        неактивной категории (она сама товар еще учитывает).
+        """
+        path = Category.objects.filter(pk=category_id).values_list('path', flat=True).first()
+        if not path:
+            return []
+        parts = path.split(Category.PATH_SEPARATOR)
+        prefixes = [Category.PATH_SEPARATOR.join(parts[:depth]) for depth in range(1, len(parts) + 1)]
+        ancestors = Category.objects.filter(path__in=prefixes).values_list('id', 'is_active').order_by('-category_level')
+
+        counted = []
+        for ancestor_id, is_active in ancestors:
+            counted.append(ancestor_id)
+            if not is_active:
+                break
+        return counted
+
+    @staticmethod
+    def apply_delta(category_id, delta):
+        """Прибавляет delta к счетчикам категории и ее учитывающих предков одним UPDATE"""
+        if not category_id or not delta:
+            return
+        CategoryCounterService.update_counters(CategoryCounterService.get_counted_ancestors(category_id), delta)
+
+    @staticmethod
+    def update_counters(category_ids, delta):
+        """
+        Прибавляет delta к счетчикам перечисленных категорий одним UPDATE
+
+        Нужен, когда цепочку предков приходится взять заранее: после
+        удаления категории путь к ее предкам уже не прочитать.
+        """
+        if not category_ids or not delta:
+            return
+        if delta > 0:
+            has_products = Value(True)
+        else:
+            # В SET обе колонки вычисляются по старому значению products_count
+            has_products = ExpressionWrapper(Q(products_count__gt=-delta), output_field=BooleanField())
+        Category.objects.filter(id__in=category_ids).update(
+            products_count=Greatest(F('products_count') + delta, 0),
+            has_products=has_products,
+        )
+        from .category_tree import CategoryTreeService
+        CategoryTreeService.bump_generation()
+
+    @staticmethod
+    def product_changed(old_category_id, old_active, new_category_id, new_active):
+        """Переносит вклад товара из прежнего состояния в новое"""
+        old = old_category_id if old_active else None
+        new = new_category_id if new_active else None
+        if old == new:
+            return
+        CategoryCounterService.apply_delta(old, -1)
+        CategoryCounterService.apply_delta(new, 1)
+
+    @staticmethod
+    def rebuild():
+        """
+        Пересчитывает счетчики всего дерева
+
+        Один сгруппированный запрос по товарам и один по категориям,
+        суммирование вдоль родителей выполняется в памяти.
+        """
+        direct = dict(
+            Product.objects.filter(is_active=True, category__isnull=False)
+            .values('category_id').annotate(total=Count('id')).order_by().values_list('category_id', 'total')
+        )
+        categories = list(
+            Category.objects.only('id', 'parent_id', 'is_active', 'category_level', 'products_count', 'has_products')
+            .order_by('-category_level')
+        )
+        totals = {category.id: direct.get(category.id, 0) for category in categories}
+        by_id = {category.id: category for category in categories}
+        # От листьев к корню: неактивная категория не передает товары выше
+        for category in categories:
+            if category.parent_id in totals and category.is_active:
+                totals[category.parent_id] += totals[category.id]
+
+        changed = []
+        for category_id, total in totals.items():
+            category = by_id[category_id]
+            if category.products_count != total or category.has_products != (total > 0):
+                category.products_count = total
+                category.has_products = total > 0
+                changed.append(category)
+        Category.objects.bulk_update(changed, ['products_count', 'has_products'], batch_size=500)
+
+        if changed:
+            from .category_tree import CategoryTreeService
+            CategoryTreeService.bump_generation()
+        logger.info('Пересчитаны счетчики товаров: изменено %s категорий', len(changed))
+        return len(changed)
@@ -0,0 +1,186 @@
+"""
+Дерево категорий каталога для мегаменю, API, шаблонов и хлебных крошек
+
+Дерево строится одним запросом и хранится в кэше как обычные словари под
+ключом текущего поколения. Любое изменение категории увеличивает поколение,
+поэтому старые версии дерева больше не читаются и истекают сами.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import CharField, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import translation
+
+from .models import Category
+
+logger = logging.getLogger(__name__)
+
+TREE_GENERATION_KEY = 'category_tree:generation'
+TREE_CACHE_KEY = 'category_tree:{generation}:{language}'
+NAMES_CACHE_KEY = 'category_names:{generation}:{language}'
+TREE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class CategoryTreeService:
+    """Сервис построения и кэширования дерева категорий"""
+
+    @staticmethod
+    def get_generation():
+        """Текущее поколение дерева"""
+        generation = cache.get(TREE_GENERATION_KEY)
+        if generation is None:
+            cache.add(TREE_GENERATION_KEY, 1, None)
+            generation = cache.get(TREE_GENERATION_KEY, 1)
+        return generation
+
+    @staticmethod
+    def bump_generation():
+        """Делает все закэшированные версии дерева устаревшими"""
+        try:
+            cache.incr(TREE_GENERATION_KEY)
+        except ValueError:
+            cache.set(TREE_GENERATION_KEY, 2, None)
+
+    @staticmethod
+    def get_tree(language=None):
+        """Все активные категории в виде вложенных словарей (корни по порядку сортировки)"""
+        return CategoryTreeService._get_cached(language)['tree']
+
+    @staticmethod
+    def get_menu(language=None):
+        """Дерево мегаменю: только категории с show_in_megamenu на всех уровнях"""
+        return CategoryTreeService._get_cached(language)['menu']
+
+    @staticmethod
+    def build(language):
+        """
+        Строит дерево одним запросом
+
+        Название на нужном языке (с откатом на язык по умолчанию) берется
+        подзапросом к таблице переводов; ветки под неактивными категориями
+        отбрасываются.
+        """
+        rows = Category.objects.filter(is_active=True).annotate(
+            tree_name=CategoryTreeService._name_expression(language)
+        ).values(
+            'id', 'parent_id', 'slug', 'path', 'icon', 'category_level', 'products_count',
+            'has_products', 'show_in_megamenu', 'mega_menu_image', 'mega_menu_description', 'tree_name',
+        ).order_by('category_level', 'sort_order', 'slug')
+
+        image_storage = Category._meta.get_field('mega_menu_image').storage
+        nodes = {}
+        roots = []
+        for row in rows:
+            node = {
+                'id': row['id'],
+                'name': row['tree_name'],
+                'slug': row['slug'],
+                'path': row['path'],
+                'icon': row['icon'] or '',
+                'level': row['category_level'],
+                'products_count': row['products_count'],
+                'has_products': row['has_products'],
+                'show_in_megamenu': row['show_in_megamenu'],
+                'image_url': image_storage.url(row['mega_menu_image']) if row['mega_menu_image'] else None,
+                'description': row['mega_menu_description'],
+                'children': [],
+            }
+            if row['parent_id'] is None:
+                roots.append(node)
+            elif row['parent_id'] in nodes:
+                nodes[row['parent_id']]['children'].append(node)
+            else:
+                # Родитель неактивен или еще не встречен — ветка скрыта
+                continue
+            nodes[row['id']] = node
+        return roots
+
+    @staticmethod
+    def get_names(language=None):
+        """
+        Названия всех категорий (включая неактивные) для хлебных крошек
+
+        Returns:
+            dict: {'by_id': {id: (name, slug)}, 'by_path': {path: id}}
+        """
+        language = CategoryTreeService._language(language)
+        cache_key = NAMES_CACHE_KEY.format(generation=CategoryTreeService.get_generation(), language=language)
+        names = cache.get(cache_key)
+        if names is None:
+            rows = Category.objects.annotate(
+                tree_name=CategoryTreeService._name_expression(language)
+            ).values_list('id', 'path', 'slug', 'tree_name')
+            names = {'by_id': {}, 'by_path': {}}
+            for category_id, path, slug, name in rows:
+                names['by_id'][category_id] = (name, slug)
+                names['by_path'][path] = category_id
+            cache.set(cache_key, names, TREE_CACHE_TIMEOUT)
+        return names
+
+    @staticmethod
+    def get_breadcrumbs(category, language=None):
+        """Цепочка от корня до категории: [{'id', 'name', 'slug', 'path'}, ...]"""
+        return CategoryTreeService.get_breadcrumbs_bulk([category], language)[category.pk]
+
+    @staticmethod
+    def get_breadcrumbs_bulk(categories, language=None):
+        """
+        Хлебные крошки для любого числа категорий без обхода родителей
+
+        Предки берутся из префиксов сохраненного Category.path, а названия —
+        из одной закэшированной карты, поэтому запросов к базе нет.
+
+        Returns:
+            dict: {category_id: [{'id', 'name', 'slug', 'path'}, ...]}
+        """
+        names = CategoryTreeService.get_names(language)
+        result = {}
+        for category in categories:
+            crumbs = []
+            parts = (category.path or category.slug).split(Category.PATH_SEPARATOR)
+            for depth in range(1, len(parts) + 1):
+                path = Category.PATH_SEPARATOR.join(parts[:depth])
+                category_id = names['by_path'].get(path)
+                if category_id is None:
+                    continue
+                name, slug = names['by_id'][category_id]
+                crumbs.append({'id': category_id, 'name': name, 'slug': slug, 'path': path})
+            result[category.pk] = crumbs
+        return result
+
+    @staticmethod
+    def _name_expression(language):
+        """Название на языке language с откатом на язык по умолчанию и slug"""
+        translations = Category._parler_meta.root_model.objects.filter(master_id=OuterRef('pk'))
+        return Coalesce(
+            Subquery(translations.filter(language_code=language).values('name')[:1]),
+            Subquery(translations.filter(language_code=settings.PARLER_DEFAULT_LANGUAGE_CODE).values('name')[:1]),
+            F('slug'),
+            output_field=CharField(),
+        )
+
+    @staticmethod
+    def _language(language=None):
+        return language or translation.get_language() or settings.LANGUAGE_CODE
+
+    @staticmethod
+    def _menu(nodes):
+        return [
+            dict(node, children=CategoryTreeService._menu(node['children']))
+            for node in nodes
+            if node['show_in_megamenu']
+        ]
+
+    @staticmethod
+    def _get_cached(language=None):
+        language = CategoryTreeService._language(language)
+        cache_key = TREE_CACHE_KEY.format(generation=CategoryTreeService.get_generation(), language=language)
+        data = cache.get(cache_key)
+        if data is None:
+            tree = CategoryTreeService.build(language)
+            data = {'tree': tree, 'menu': CategoryTreeService._menu(tree)}
+            cache.set(cache_key, data, TREE_CACHE_TIMEOUT)
+            logger.debug('Построено дерево категорий %s', cache_key)
+        return data
@@ -0,0 +1,166 @@
+"""
+Оформление заказа из корзины пользователя
+
+Заказ оформляется в одной транзакции: строки товаров корзины блокируются
+(SELECT ... FOR UPDATE в порядке id, чтобы параллельные заказы не
+блокировали друг друга крест-накрест), остатки списываются из резерва
+покупателя и условным UPDATE из свободного остатка (InventoryService),
+позиции заказа создаются одним bulk_create, корзина очищается. Цены
+считаются один раз по заблокированным строкам, поэтому число запросов не
+зависит от размера корзины.
+
+Отмена заказа возвращает его товары на склад в той же транзакции, что и
+смена статуса, — если остатки были списаны при оформлении (stock_taken).
+"""
+import logging
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .cart import DatabaseCartStore
+from .inventory import InsufficientStock, InventoryService
+from .models import Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+SHIPPING_COSTS = {
+    'courier': Decimal('300.00'),
+    'post': Decimal('150.00'),
+    'pickup': Decimal('0.00'),
+}
+# Статусы, из которых покупатель может отменить заказ (сайт и API)
+CANCELLABLE_STATUSES = ('pending', 'confirmed', 'processing')
+
+
+class CheckoutError(Exception):
+    """Заказ нельзя оформить: корзина пуста или товаров не хватает"""
+
+
+class CheckoutService:
+    """Оформление заказа с проверкой и списанием остатков"""
+
+    @staticmethod
+    def get_shipping_cost(delivery_method):
+        """Стоимость доставки (самовывоз и неизвестные способы — бесплатно)"""
+        return SHIPPING_COSTS.get(delivery_method, Decimal('0.00'))
+
+    @staticmethod
+    def get_unavailable(products, product_ids):
+        """id товаров, удаленных из каталога или снятых с продажи"""
+        return [
+            product_id for product_id in product_ids
+            if product_id not in products or not products[product_id].is_active
+        ]
+
+    @staticmethod
+    def get_names(products, product_ids):
+        return ', '.join(str(products[product_id]) for product_id in product_ids if product_id in products)
+
+    @staticmethod
+    def reserve_cart(user):
+        """
+        Резервирует товары корзины при открытии страницы оформления
+
+        Returns:
+            list: Товары корзины, которых не хватило на складе
+        """
+        shortages = InventoryService.reserve(user, DatabaseCartStore(user).get())
+        return list(Product.objects.filter(pk__in=shortages)) if shortages else []
+
+    @staticmethod
+    def place_order(user, order, delivery_method, payment_method=None):
+        """
+        Оформляет заказ из корзины пользователя
+
+        Args:
+            order: Несохраненный Order с адресом и примечаниями (из OrderForm)
+
+        Returns:
+            Order: Сохраненный заказ с суммой, доставкой и позициями
+
+        Raises:
+            CheckoutError: Корзина пуста или каких-то товаров не хватает
+                (в этом случае ничего не меняется)
+        """
+        store = DatabaseCartStore(user)
+        with transaction.atomic():
+            quantities = store.get()
+            if not quantities:
+                raise CheckoutError(_("Ваша корзина пуста"))
+
+            products = {
+                product.pk: product
+                for product in Product.objects.select_for_update().filter(
+                    pk__in=list(quantities),
+                ).order_by('pk').only('pk', 'price', 'discount_price', 'is_active', 'sku')
+            }
+            unavailable = CheckoutService.get_unavailable(products, quantities)
+            if unavailable:
+                names = CheckoutService.get_names(products, unavailable)
+                raise CheckoutError(
+                    _("Товары сняты с продажи: {}").format(names) if names
+                    else _("Некоторые товары больше не продаются")
+                )
+
+            try:
+                InventoryService.consume(user, quantities)
+            except InsufficientStock as error:
+                raise CheckoutError(
+                    _("Недостаточно товара на складе: {}").format(CheckoutService.get_names(products, error.product_ids))
+                )
+
+            items = []
+            subtotal = Decimal('0')
+            for product_id, quantity in quantities.items():
+                price = products[product_id].final_price
+                items.append(OrderItem(product_id=product_id, quantity=quantity, price=price, total_price=price * quantity))
+                subtotal += price * quantity
+
+            order.user = user
+            order.payment_method = payment_method
+            order.delivery_method = delivery_method
+            order.shipping_cost = CheckoutService.get_shipping_cost(delivery_method)
+            order.total_amount = subtotal + order.shipping_cost
+            order.created_at = order.created_at or timezone.now()
+            order.stock_taken = True
+            order.save()
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+
+            store.clear()
+
+        logger.info('Оформлен заказ %s: %s позиций', order.order_number, len(items))
+        return order
+
+    @staticmethod
+    def cancel_order(order):
+        """
+        Отменяет заказ и возвращает его товары на склад
+
+        Строка заказа блокируется и отменяется, только если ее статус в
+        CANCELLABLE_STATUSES, поэтому при повторной или параллельной отмене
+        остаток возвращается один раз. Заказы, при оформлении которых
+        остатки не списывались (stock_taken=False), отменяются без возврата.
+
+        Returns:
+            bool: True, если заказ отменен этим вызовом
+        """
+        with transaction.atomic():
+            stock_taken = Order.objects.select_for_update().filter(
+                pk=order.pk, status__in=CANCELLABLE_STATUSES,
+            ).values_list('stock_taken', flat=True).first()
+            if stock_taken is None:
+                return False
+            Order.objects.filter(pk=order.pk).update(status='cancelled', stock_taken=False, updated_at=timezone.now())
+            quantities = Counter()
+            if stock_taken:
+                for product_id, quantity in OrderItem.objects.filter(order=order).values_list('product_id', 'quantity'):
+                    quantities[product_id] += quantity
+                InventoryService.put_back(quantities)
+        order.status, order.stock_taken = 'cancelled', False
+        logger.info('Отменен заказ %s: возвращено позиций на склад %s', order.order_number, len(quantities))
+        return True
@@ -3,18 +3,23 @@ from .client_auth import get_current_client
 def client(request):
     return {'client': getattr(request, 'client', None) or get_current_client(request)}
 
-from .models import Category
+from django.utils.functional import SimpleLazyObject
+
+from .cart import CartService
+from .category_tree import CategoryTreeService
 
 
 def catalog_categories(request):
     """Контекстный процессор для передачи категорий каталога во все шаблоны"""
+    # Дерево читается из кэша только если шаблон действительно обращается к меню
     return {
-        'catalog_categories': Category.objects.filter(
-            parent__isnull=True, 
-            is_active=True, 
-            show_in_megamenu=True
-        ).prefetch_related(
-            'children__children'
-        ).order_by('sort_order', 'slug')
+        'catalog_categories': SimpleLazyObject(CategoryTreeService.get_menu),
     }
 
+
+def cart_summary(request):
+    """Контекстный процессор со сводкой корзины для значка в шапке"""
+    # Сводка читается из кэша только если шаблон действительно к ней обращается
+    return {
+        'cart_summary': SimpleLazyObject(lambda: CartService.get_summary(request)),
+    }
@@ -0,0 +1,135 @@
+"""
+Фасеты (агрегаты для боковой панели фильтров) по поддереву категории
+"""
+import logging
+import math
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+FACETS_CACHE_KEY = 'facets:category:{}'
+FACETS_CACHE_TIMEOUT = 60 * 60
+PRICE_BUCKETS = 5
+RATING_THRESHOLDS = (4, 3, 2, 1)
+# Поля товара, от которых зависят фасеты
+FACET_FIELDS = frozenset({'category', 'category_id', 'brand', 'price', 'rating', 'stock_quantity', 'is_active'})
+
+
+class FacetService:
+    """Сервис расчета и кэширования фасетов каталога"""
+
+    @staticmethod
+    def get_category_facets(category):
+        """Возвращает фасеты поддерева категории (из кэша или с пересчетом)"""
+        cache_key = FACETS_CACHE_KEY.format(category.pk)
+        facets = cache.get(cache_key)
+        if facets is None:
+            facets = FacetService.compute_facets(category.get_descendant_ids())
+            cache.set(cache_key, facets, FACETS_CACHE_TIMEOUT)
+        return facets
+
+    @staticmethod
+    def compute_facets(category_ids):
+        """
+        Считает фасеты активных товаров указанных категорий
+
+        Бренды — одним GROUP BY, остальные счетчики — условной агрегацией,
+        поэтому пересчет занимает три запроса независимо от числа фасетов.
+        """
+        products = Product.objects.filter(category_id__in=category_ids, is_active=True).order_by()
+
+        brands = [
+            {'brand': row['brand'], 'count': row['count']}
+            for row in products.exclude(brand='').values('brand').annotate(count=Count('id')).order_by('-count', 'brand')
+        ]
+
+        rating_counts = {
+            f'rating_{threshold}': Count('id', filter=Q(rating__gte=threshold))
+            for threshold in RATING_THRESHOLDS
+        }
+        stats = products.aggregate(
+            total=Count('id'),
+            in_stock=Count('id', filter=Q(stock_quantity__gt=0)),
+            min_price=Min('price'),
+            max_price=Max('price'),
+            **rating_counts,
+        )
+
+        edges = FacetService._price_edges(stats['min_price'], stats['max_price'])
+        buckets = []
+        if edges:
+            bucket_counts = products.aggregate(**{
+                f'bucket_{index}': Count('id', filter=FacetService._bucket_filter(edges, index))
+                for index in range(len(edges) - 1)
+            })
+            buckets = [
+                {'from': edges[index], 'to': edges[index + 1], 'count': bucket_counts[f'bucket_{index}']}
+                for index in range(len(edges) - 1)
+            ]
+
+        return {
+            'total': stats['total'],
+            'in_stock': stats['in_stock'],
+            'brands': brands,
+            'price': {
+                'min': stats['min_price'],
+                'max': stats['max_price'],
+                'buckets': buckets,
+            },
+            'ratings': [
+                {'min_rating': threshold, 'count': stats[f'rating_{threshold}']}
+                for threshold in RATING_THRESHOLDS
+            ],
+        }
+
+    @staticmethod
+    def invalidate_categories(category_ids):
+        """
+        Сбрасывает фасеты категорий и всех их предков
+
+        Предки берутся из префиксов path, поэтому хватает одного запроса
+        на весь набор затронутых категорий.
+        """
+        category_ids = {category_id for category_id in category_ids if category_id}
+        if not category_ids:
+            return
+
+        ancestor_paths = set()
+        for path in Category.objects.filter(id__in=category_ids).values_list('path', flat=True):
+            parts = (path or '').split(Category.PATH_SEPARATOR)
+            for depth in range(1, len(parts) + 1):
+                ancestor_paths.add(Category.PATH_SEPARATOR.join(parts[:depth]))
+
+        ancestor_ids = set(category_ids)
+        if ancestor_paths:
+            ancestor_ids.update(Category.objects.filter(path__in=ancestor_paths).values_list('id', flat=True))
+
+        cache.delete_many([FACETS_CACHE_KEY.format(category_id) for category_id in ancestor_ids])
+        logger.debug('Сброшены фасеты категорий: %s', sorted(ancestor_ids))
+
+    @staticmethod
+    def _price_edges(min_price, max_price, buckets=PRICE_BUCKETS):
+        """Границы ценовых интервалов с целым шагом"""
+        if min_price is None or max_price is None:
+            return []
+        low = Decimal(math.floor(min_price))
+        high = Decimal(math.ceil(max_price))
+        if high <= low:
+            return [low, high]
+        step = Decimal(math.ceil((high - low) / buckets))
+        edges = [low + step * index for index in range(buckets) if low + step * index < high]
+        edges.append(high)
+        return edges
+
+    @staticmethod
+    def _bucket_filter(edges, index):
+        """Полуинтервал [from, to), последний интервал включает верхнюю границу"""
+        condition = Q(price__gte=edges[index])
+        if index == len(edges) - 2:
+            return condition & Q(price__lte=edges[index + 1])
+        return condition & Q(price__lt=edges[index + 1])
@@ -6,6 +6,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.core.paginator import Paginator
 from django.db.models import Q
 from .models import Product, Favorite
+from .cart import CartService
 import json
 
 
@@ -143,25 +144,10 @@ def add_multiple_to_cart(request):
         if not product_ids:
             return JsonResponse({'success': False, 'message': 'Товары не выбраны'}, status=400)
         
-        # Получаем корзину из сессии
-        cart = request.session.get('cart', {})
-        added_count = 0
-        
-        for product_id in product_ids:
-            product = get_object_or_404(Product, id=product_id)
-            product_id_str = str(product_id)
-            
-            if product_id_str in cart:
-                cart[product_id_str]['quantity'] += 1
-            else:
-                cart[product_id_str] = {
-                    'quantity': 1,
-                    'price': float(product.price)
-                }
-            added_count += 1
-        
-        request.session['cart'] = cart
-        request.session.modified = True
+        # Все товары проверяются одним запросом и сливаются в корзину пользователя разом
+        found = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        CartService.get_store(request).add_many({product_id: 1 for product_id in found})
+        added_count = len(found)
         
         return JsonResponse({
             'success': True, 
@@ -2,24 +2,26 @@ import django_filters
 from django import forms
 from parler.forms import TranslatableModelForm
 from .models import Product, Category, Shop, Tag
+from .catalog_filters import ProductQueryCompiler
 from django.utils.translation import gettext_lazy as _
 
 class ProductFilter(django_filters.FilterSet):
+    # Фильтры по id: без JOIN с таблицами переводов и без distinct()
     category = django_filters.ModelChoiceFilter(
         queryset=Category.objects.all(),
-        field_name='category__translations__name',
+        field_name='category',
         label=_('Категория'),
         empty_label=_('Все категории')
     )
     shops = django_filters.ModelMultipleChoiceFilter(
         queryset=Shop.objects.all(),
-        field_name='shops__translations__name',
+        method='filter_shops',
         label=_('Магазины'),
         widget=forms.CheckboxSelectMultiple
     )
     tags = django_filters.ModelMultipleChoiceFilter(
         queryset=Tag.objects.all(),
-        field_name='tags__translations__name',
+        method='filter_tags',
         label=_('Теги'),
         widget=forms.CheckboxSelectMultiple
     )
@@ -34,4 +36,14 @@ class ProductFilter(django_filters.FilterSet):
         super().__init__(*args, **kwargs)
         self.form.fields['category'].empty_label = _('Все категории')
         self.form.fields['shops'].empty_label = _('Все магазины')
-        self.form.fields['tags'].empty_label = _('Все теги')
\ No newline at end of file
+        self.form.fields['tags'].empty_label = _('Все теги')
+
+    def filter_shops(self, queryset, name, value):
+        if not value:
+            return queryset
+        return ProductQueryCompiler.filter_shops(queryset, [shop.pk for shop in value])
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return ProductQueryCompiler.filter_tags(queryset, [tag.pk for tag in value])
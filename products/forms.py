@@ -7,6 +7,9 @@ from crispy_forms.layout import Layout, Submit, Row, Column, Field
 from crispy_forms.bootstrap import FormActions
 from .models import Product, ProductImage, Category, Shop, Tag, Order, OrderItem, Review, PromoCode, Task, MoodTracking
 
+# Поле остатка в админке и форме товара (InventoryService.set_on_hand)
+STOCK_ON_HAND_HELP_TEXT = _("Единиц на складе. Товары, зарезервированные покупателями, вычитаются из этого числа при сохранении")
+
 User = get_user_model()
 
 class CustomUserCreationForm(UserCreationForm):
@@ -68,6 +71,9 @@ class ProductForm(forms.ModelForm):
             'tags': forms.CheckboxSelectMultiple(),
             'shops': forms.CheckboxSelectMultiple(),
         }
+        help_texts = {
+            'stock_quantity': STOCK_ON_HAND_HELP_TEXT,
+        }
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
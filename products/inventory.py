@@ -0,0 +1,281 @@
+"""
+Резервирование и списание остатков товаров
+
+Остаток Product.stock_quantity меняется только условным UPDATE:
+
+    UPDATE products_product SET stock_quantity = stock_quantity - n
+    WHERE id = ... AND stock_quantity >= n
+
+Для нескольких товаров это один запрос с CASE; если хотя бы одна строка
+не подошла под условие, изменения откатываются целиком. Поэтому два
+покупателя не могут забрать одну и ту же последнюю единицу, даже если
+оба видели ее на странице.
+
+При открытии страницы оформления заказа товары корзины резервируются на
+RESERVATION_TTL: зарезервированные единицы сразу вычитаются из остатка и
+хранятся в StockReservation. Заказ сначала списывает собственный резерв
+покупателя и только недостающее берет из свободного остатка. Просроченные
+резервы возвращает на склад периодическая задача.
+
+Поэтому stock_quantity — это свободный остаток, а не число единиц на
+складе. Админка и форма товара принимают число единиц на складе и
+сохраняют его через set_on_hand, которое вычитает действующие резервы,
+иначе при их истечении единицы вернулись бы сверх введенного. Прямая
+запись stock_quantity (save(), QuerySet.update(), импорт) задает
+свободный остаток как есть.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+
+from .facets import FacetService
+from .listing import ProductListingService
+from .models import Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL = timedelta(minutes=15)
+
+
+class InsufficientStock(Exception):
+    """Каких-то товаров нет в нужном количестве"""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Недостаточно товара на складе: {product_ids}')
+
+
+class InventoryService:
+    """Условное списание, возврат и резервирование остатков"""
+
+    @staticmethod
+    def stock_delta(quantities, sign):
+        """CASE-выражение, меняющее остаток каждого товара на sign * количество"""
+        return Case(
+            *[When(pk=product_id, then=F('stock_quantity') + sign * quantity) for product_id, quantity in quantities.items()],
+            default=F('stock_quantity'),
+            output_field=PositiveIntegerField(),
+        )
+
+    @staticmethod
+    def take(quantities):
+        """
+        Списывает остатки одним условным UPDATE
+
+        Args:
+            quantities: {product_id: количество}
+
+        Raises:
+            InsufficientStock: Какого-то товара не хватает или он снят с
+                продажи (тогда ничего не списывается)
+        """
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        if not quantities:
+            return
+        condition = Q()
+        for product_id, quantity in quantities.items():
+            condition |= Q(pk=product_id, stock_quantity__gte=quantity)
+        with transaction.atomic():
+            updated = Product.objects.filter(condition, is_active=True).update(
+                stock_quantity=InventoryService.stock_delta(quantities, -1),
+            )
+            if updated != len(quantities):
+                # Часть строк не подошла под условие — откатываем и остальные
+                transaction.set_rollback(True)
+        if updated != len(quantities):
+            available = dict(
+                Product.objects.filter(pk__in=list(quantities), is_active=True).values_list('pk', 'stock_quantity')
+            )
+            raise InsufficientStock([
+                product_id for product_id, quantity in quantities.items()
+                if available.get(product_id, 0) < quantity
+            ])
+
+        sold_out = Product.objects.filter(pk__in=list(quantities), stock_quantity=0).values_list('category_id', flat=True)
+        InventoryService.sync_on_commit(list(quantities), set(sold_out))
+
+    @staticmethod
+    def put_back(quantities):
+        """Возвращает единицы на склад одним UPDATE"""
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        if not quantities:
+            return
+        Product.objects.filter(pk__in=list(quantities)).update(
+            stock_quantity=InventoryService.stock_delta(quantities, 1),
+        )
+        # Товары, которые снова появились в наличии (остаток был нулевым)
+        condition = Q()
+        for product_id, quantity in quantities.items():
+            condition |= Q(pk=product_id, stock_quantity=quantity)
+        restocked = Product.objects.filter(condition).values_list('category_id', flat=True)
+        InventoryService.sync_on_commit(list(quantities), set(restocked))
+
+    @staticmethod
+    def sync_on_commit(product_ids, changed_category_ids):
+        """После фиксации переносит остатки в карточки каталога и сбрасывает фасеты"""
+        def sync():
+            ProductListingService.update_stock(product_ids)
+            if changed_category_ids:
+                # Счетчик «в наличии» меняется, только когда товар закончился или вернулся
+                FacetService.invalidate_categories(changed_category_ids)
+        transaction.on_commit(sync)
+
+    @staticmethod
+    def get_available(product, user=None):
+        """Сколько единиц может взять пользователь: свободный остаток и его резерв"""
+        available = product.stock_quantity
+        if user is not None and user.is_authenticated:
+            available += sum(
+                StockReservation.objects.filter(user=user, product=product).values_list('quantity', flat=True)
+            )
+        return available
+
+    @staticmethod
+    def set_on_hand(product_id, on_hand):
+        """
+        Переводит число единиц на складе в свободный остаток товара
+
+        Действующие резервы вычитаются из on_hand. Резервы сверх on_hand
+        урезаются, начиная с самых поздних, чтобы при их истечении на склад
+        не вернулось больше единиц, чем там есть.
+
+        Returns:
+            int: Свободный остаток для записи в stock_quantity
+        """
+        held = 0
+        with transaction.atomic():
+            reservations = StockReservation.objects.select_for_update().filter(
+                product_id=product_id,
+            ).order_by('created_at', 'pk')
+            for reservation in reservations:
+                kept = min(reservation.quantity, on_hand - held)
+                if kept <= 0:
+                    reservation.delete()
+                elif kept < reservation.quantity:
+                    reservation.quantity = kept
+                    reservation.save(update_fields=['quantity'])
+                held += max(kept, 0)
+        return on_hand - held
+
+    @staticmethod
+    def release(user):
+        """Возвращает на склад все резервы пользователя"""
+        with transaction.atomic():
+            reservations = list(StockReservation.objects.select_for_update().filter(user=user))
+            InventoryService.release_reservations(reservations)
+        return len(reservations)
+
+    @staticmethod
+    def release_reservations(reservations):
+        """Удаляет резервы и возвращает их единицы на склад (внутри транзакции)"""
+        if not reservations:
+            return
+        returned = Counter()
+        for reservation in reservations:
+            returned[reservation.product_id] += reservation.quantity
+        StockReservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).delete()
+        InventoryService.put_back(returned)
+
+    @staticmethod
+    def reserve(user, quantities, ttl=RESERVATION_TTL):
+        """
+        Резервирует товары корзины на время оформления заказа
+
+        Если резервы пользователя уже совпадают с корзиной (страницу
+        обновили или открыли во второй вкладке), они только продлеваются, и
+        остатки не трогаются. Иначе прежние резервы заменяются новыми.
+        Товары, которых не хватает, не резервируются.
+
+        Returns:
+            list: id товаров, которые не удалось зарезервировать
+        """
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        shortages = []
+        expires_at = timezone.now() + ttl
+        with transaction.atomic():
+            held = list(StockReservation.objects.select_for_update().filter(user=user))
+            if {reservation.product_id: reservation.quantity for reservation in held} == quantities:
+                StockReservation.objects.filter(pk__in=[reservation.pk for reservation in held]).update(expires_at=expires_at)
+                return shortages
+            InventoryService.release_reservations(held)
+            try:
+                InventoryService.take(quantities)
+            except InsufficientStock as error:
+                shortages = error.product_ids
+                quantities = {
+                    product_id: quantity for product_id, quantity in quantities.items() if product_id not in shortages
+                }
+                try:
+                    InventoryService.take(quantities)
+                except InsufficientStock:
+                    # Остатки успели измениться еще раз — ничего не резервируем
+                    shortages, quantities = list(quantities) + shortages, {}
+
+            StockReservation.objects.bulk_create([
+                StockReservation(user=user, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+        return shortages
+
+    @staticmethod
+    def consume(user, quantities):
+        """
+        Списывает товары заказа: сначала из резерва пользователя, затем из
+        свободного остатка (внутри транзакции оформления заказа)
+
+        Лишние и ненужные резервы пользователя возвращаются на склад.
+        Просроченный, но еще не освобожденный резерв тоже засчитывается:
+        его единицы по-прежнему вычтены из остатка.
+
+        Raises:
+            InsufficientStock: Не хватает свободного остатка
+        """
+        reservations = {
+            reservation.product_id: reservation
+            for reservation in StockReservation.objects.select_for_update().filter(user=user)
+        }
+        needed, surplus = {}, {}
+        for product_id, quantity in quantities.items():
+            held = reservations[product_id].quantity if product_id in reservations else 0
+            covered = min(held, quantity)
+            needed[product_id] = quantity - covered
+            surplus[product_id] = held - covered
+        for product_id, reservation in reservations.items():
+            if product_id not in quantities:
+                surplus[product_id] = reservation.quantity
+
+        InventoryService.take(needed)
+        if reservations:
+            StockReservation.objects.filter(pk__in=[reservation.pk for reservation in reservations.values()]).delete()
+        InventoryService.put_back(surplus)
+
+    @staticmethod
+    def release_expired(batch_size=500):
+        """
+        Возвращает на склад просроченные резервы
+
+        Строки, заблокированные идущим оформлением заказа, пропускаются —
+        их заберет следующий проход, если заказ их не списал.
+
+        Returns:
+            int: Количество освобожденных резервов
+        """
+        total = 0
+        while True:
+            with transaction.atomic():
+                reservations = list(
+                    StockReservation.objects.select_for_update(skip_locked=True).filter(
+                        expires_at__lte=timezone.now(),
+                    ).order_by('expires_at')[:batch_size]
+                )
+                InventoryService.release_reservations(reservations)
+            total += len(reservations)
+            if len(reservations) < batch_size:
+                break
+        if total:
+            logger.info('Освобождено просроченных резервов: %s', total)
+        return total
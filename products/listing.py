@@ -0,0 +1,156 @@
+"""
+Денормализованная модель чтения для карточек товаров в списках каталога
+"""
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Q, Subquery, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone, translation
+
+from .models import Product, ProductImage, ProductListing
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые переносятся в карточку как есть — их можно обновить
+# одним UPDATE без пересборки строки (в том числе F-выражения счетчиков)
+DIRECT_FIELDS = frozenset({'views_count', 'popularity_score', 'reviews_count', 'rating', 'stock_quantity', 'brand', 'currency', 'created_at'})
+
+
+class ProductListingService:
+    """Сервис заполнения и чтения таблицы ProductListing"""
+
+    @staticmethod
+    def get_languages():
+        """Языки, для которых строятся карточки"""
+        return [code for code, _name in settings.LANGUAGES]
+
+    @staticmethod
+    def get_language(language_code=None):
+        """Приводит код языка к одному из settings.LANGUAGES"""
+        languages = ProductListingService.get_languages()
+        language_code = language_code or translation.get_language() or settings.LANGUAGE_CODE
+        if language_code not in languages:
+            language_code = language_code.split('-')[0]
+        return language_code if language_code in languages else settings.LANGUAGE_CODE
+
+    @staticmethod
+    def listing_queryset(language_code=None):
+        """Карточки активных товаров на текущем (или указанном) языке"""
+        return ProductListing.objects.filter(language_code=ProductListingService.get_language(language_code))
+
+    @staticmethod
+    def refresh_products(product_ids):
+        """
+        Пересобирает карточки указанных товаров на всех языках
+
+        Неактивные и удаленные товары из таблицы просто исчезают.
+        """
+        product_ids = {product_id for product_id in product_ids if product_id}
+        if not product_ids:
+            return 0
+
+        products = Product.objects.filter(pk__in=product_ids, is_active=True).select_related(
+            'seller', 'category'
+        ).prefetch_related(
+            'translations',
+            Prefetch('images', queryset=ProductImage.objects.order_by('-is_primary', 'order', 'created_at')),
+        )
+
+        rows = []
+        languages = ProductListingService.get_languages()
+        for product in products:
+            rows.extend(ProductListingService._build_rows(product, languages))
+
+        with transaction.atomic():
+            ProductListing.objects.filter(product_id__in=product_ids).delete()
+            ProductListing.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
+
+    @staticmethod
+    def update_fields(product, fields):
+        """Переносит в карточки простые поля товара одним UPDATE"""
+        values = {name: getattr(product, name) for name in fields if name in DIRECT_FIELDS}
+        if set(values) - {'views_count', 'popularity_score'}:
+            # Видимые в карточке поля меняют ее версию (ключ фрагмента в ProductCardCache)
+            values['updated_at'] = timezone.now()
+        if values:
+            ProductListing.objects.filter(product_id=product.pk).update(**values)
+
+    @staticmethod
+    def update_stock(product_ids):
+        """Переносит остатки пачки товаров в карточки одним UPDATE"""
+        ProductListing.objects.filter(product_id__in=list(product_ids)).update(
+            stock_quantity=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('stock_quantity')[:1]),
+            updated_at=timezone.now(),
+        )
+
+    @staticmethod
+    def update_seller_name(seller):
+        """Обновляет название продавца во всех его карточках (и версию для кэша фрагментов)"""
+        ProductListing.objects.filter(product__seller=seller).update(
+            seller_name=seller.company_name,
+            updated_at=timezone.now(),
+        )
+
+    @staticmethod
+    def move_category_path(old_path, new_path):
+        """Переписывает путь категории в карточках после перемещения поддерева"""
+        if not old_path or old_path == new_path:
+            return
+        ProductListing.objects.filter(
+            Q(category_path=old_path) | Q(category_path__startswith=f"{old_path}/")
+        ).update(category_path=Concat(Value(new_path), Substr('category_path', len(old_path) + 1)))
+
+    @staticmethod
+    def rebuild(batch_size=500):
+        """Полная пересборка таблицы пачками товаров"""
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        total = 0
+        for start in range(0, len(product_ids), batch_size):
+            total += ProductListingService.refresh_products(product_ids[start:start + batch_size])
+        # Карточки языков, убранных из settings.LANGUAGES
+        ProductListing.objects.exclude(language_code__in=ProductListingService.get_languages()).delete()
+        logger.info('Пересобрано карточек каталога: %s', total)
+        return total
+
+    @staticmethod
+    def _build_rows(product, languages):
+        names = {item.language_code: item.name for item in product.translations.all()}
+        fallback_name = names.get(settings.PARLER_DEFAULT_LANGUAGE_CODE) or next(iter(names.values()), '') or product.sku
+
+        images = list(product.images.all())
+        image_url = ''
+        if images and images[0].image:
+            try:
+                image_url = images[0].get_medium_url()
+            except ValueError:
+                image_url = ''
+
+        discount_percentage = Decimal(product.discount_percentage).quantize(Decimal('0.01'))
+        return [
+            ProductListing(
+                product=product,
+                language_code=language_code,
+                name=names.get(language_code) or fallback_name,
+                price=product.price,
+                discount_price=product.discount_price,
+                final_price=product.final_price,
+                discount_percentage=discount_percentage,
+                currency=product.currency,
+                image_url=image_url,
+                seller_name=product.seller.company_name if product.seller else '',
+                brand=product.brand,
+                category_id=product.category_id,
+                category_path=product.category.path if product.category else '',
+                rating=product.rating,
+                reviews_count=product.reviews_count,
+                views_count=product.views_count,
+                popularity_score=product.popularity_score,
+                stock_quantity=product.stock_quantity,
+                created_at=product.created_at,
+            )
+            for language_code in languages
+        ]
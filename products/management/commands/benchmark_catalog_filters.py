@@ -0,0 +1,94 @@
+"""
+Management команда для сравнения старых фильтров каталога (JOIN + distinct)
+с запросами ProductQueryCompiler (фильтры по id и EXISTS)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
+
+from products.catalog_filters import ProductQueryCompiler
+from products.models import Product, Shop, Tag
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает число и время запросов старых фильтров каталога и ProductQueryCompiler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Количество повторов каждого сценария')
+        parser.add_argument('--query', default='а', help='Поисковая строка для сценария поиска')
+        parser.add_argument('--explain', action='store_true', help='Показать планы запросов')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        scenarios = self._scenarios(options['query'])
+        if not scenarios:
+            self.stdout.write(self.style.WARNING('Нет данных для сравнения: добавьте товары, теги и магазины'))
+            return
+
+        self.stdout.write(f'{"Сценарий":<28} {"Вариант":<10} {"Запросов":>9} {"Строк":>7} {"мс/запрос":>10}')
+        for title, legacy, compiled in scenarios:
+            for label, build in (('legacy', legacy), ('compiler', compiled)):
+                queries, rows, elapsed = self._measure(build, repeat)
+                self.stdout.write(f'{title:<28} {label:<10} {queries:>9} {rows:>7} {elapsed:>10.2f}')
+                if options['explain']:
+                    self.stdout.write(build().explain())
+            self.stdout.write('')
+
+    def _measure(self, build, repeat):
+        """Считает запросы одной страницы (COUNT + 20 строк) и среднее время"""
+        with CaptureQueriesContext(connection) as context:
+            queryset = build()
+            rows = queryset.count()
+            list(queryset[:20])
+        queries = len(context.captured_queries)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            queryset = build()
+            queryset.count()
+            list(queryset[:20])
+        elapsed = (time.perf_counter() - started) * 1000 / repeat
+        return queries, rows, elapsed
+
+    def _scenarios(self, query):
+        base = Product.objects.filter(is_active=True)
+        scenarios = []
+
+        scenarios.append((
+            'Поиск',
+            lambda: base.filter(
+                Q(translations__name__icontains=query) |
+                Q(translations__description__icontains=query) |
+                Q(tags__translations__name__icontains=query) |
+                Q(brand__icontains=query)
+            ).distinct().order_by('-views_count', '-reviews_count'),
+            lambda: ProductQueryCompiler(QueryDict(f'q={query}')).compile(base),
+        ))
+
+        tag_ids = list(Tag.objects.values_list('id', flat=True)[:3])
+        if tag_ids:
+            tags_params = QueryDict(mutable=True)
+            tags_params.setlist('tags', [str(tag_id) for tag_id in tag_ids])
+            scenarios.append((
+                'Теги',
+                lambda: base.filter(tags__id__in=tag_ids).distinct().order_by('-views_count', '-reviews_count'),
+                lambda: ProductQueryCompiler(tags_params).compile(base),
+            ))
+
+        shop_ids = list(Shop.objects.values_list('id', flat=True)[:3])
+        if shop_ids:
+            shops_params = QueryDict(mutable=True)
+            shops_params.setlist('shops', [str(shop_id) for shop_id in shop_ids])
+            scenarios.append((
+                'Магазины',
+                lambda: base.filter(shops__id__in=shop_ids).distinct().order_by('-views_count', '-reviews_count'),
+                lambda: ProductQueryCompiler(shops_params).compile(base),
+            ))
+
+        if not base.exists():
+            return []
+        return scenarios
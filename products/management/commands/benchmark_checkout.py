@@ -0,0 +1,115 @@
+"""
+Management команда для нагрузочной проверки оформления заказов на один товар
+
+Много покупателей одновременно оформляют заказ на один «горячий» товар с
+маленьким остатком. Проверяется, что заказов оформлено не больше, чем было
+единиц на складе, и что остаток не ушел в минус. Команда создает временных
+пользователей и заказы и удаляет их по окончании; остаток товара
+восстанавливается. Запускать на тестовой или staging-базе.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.utils import OperationalError
+
+from products.checkout import CheckoutError, CheckoutService
+from products.inventory import InventoryService
+from products.listing import ProductListingService
+from products.models import Cart, CartItem, Order, Product, User
+
+
+class Command(BaseCommand):
+    help = 'Одновременно оформляет заказы многих покупателей на один товар и проверяет, что нет перепродажи'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int, help='id товара')
+        parser.add_argument('--buyers', type=int, default=50, help='Количество одновременных покупателей')
+        parser.add_argument('--stock', type=int, default=10, help='Остаток товара на время проверки')
+        parser.add_argument('--quantity', type=int, default=1, help='Единиц товара в корзине каждого покупателя')
+        parser.add_argument('--reserve', action='store_true', help='Сначала открыть страницу оформления (резерв), затем оформить заказ')
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(pk=options['product_id'])
+        except Product.DoesNotExist:
+            raise CommandError(f"Товар {options['product_id']} не найден")
+        if not product.is_active:
+            raise CommandError(f'Товар {product.pk} снят с продажи')
+
+        original_stock = product.stock_quantity
+        stock, quantity = options['stock'], options['quantity']
+        prefix = f'checkout-bench-{uuid.uuid4().hex[:8]}'
+        users = [
+            User.objects.create_user(username=f'{prefix}-{number}', email=f'{prefix}-{number}@example.com')
+            for number in range(options['buyers'])
+        ]
+        try:
+            carts = {cart.user_id: cart for cart in Cart.objects.filter(user__in=users)}
+            carts.update({
+                user.pk: Cart.objects.create(user=user) for user in users if user.pk not in carts
+            })
+            CartItem.objects.bulk_create([
+                CartItem(cart=carts[user.pk], product=product, quantity=quantity) for user in users
+            ])
+            Product.objects.filter(pk=product.pk).update(stock_quantity=stock)
+
+            results, timings = self.run_buyers(users, options['reserve'])
+            final_stock = Product.objects.get(pk=product.pk).stock_quantity
+        finally:
+            Order.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            Product.objects.filter(pk=product.pk).update(stock_quantity=original_stock)
+            ProductListingService.update_stock([product.pk])
+
+        placed = results.count('placed')
+        timings.sort()
+        self.stdout.write(
+            f"Покупателей: {len(users)}, на складе: {stock}, в корзине: {quantity} шт., "
+            f"оформлено: {placed}, отказов: {results.count('rejected')}, ошибок БД: {results.count('error')}"
+        )
+        if timings:
+            p50 = timings[len(timings) // 2]
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(f'p50: {p50:.1f} мс, p99: {p99:.1f} мс, max: {timings[-1]:.1f} мс')
+        self.stdout.write(f'Остаток после проверки: {final_stock}')
+
+        if placed * quantity > stock or final_stock + placed * quantity != stock:
+            raise CommandError('Перепродажа: списано больше, чем было на складе')
+        self.stdout.write(self.style.SUCCESS('Перепродажи нет'))
+
+    def run_buyers(self, users, reserve):
+        """Запускает оформление заказов всех покупателей одновременно"""
+        barrier = threading.Barrier(len(users))
+
+        def buy(user):
+            try:
+                if reserve:
+                    try:
+                        CheckoutService.reserve_cart(user)
+                    except OperationalError:
+                        pass
+                barrier.wait()
+                started = time.perf_counter()
+                try:
+                    CheckoutService.place_order(user, Order(shipping_address='benchmark'), 'pickup', 'card')
+                    result = 'placed'
+                except CheckoutError:
+                    result = 'rejected'
+                except OperationalError:
+                    # SQLite без OPTIONS['transaction_mode'] = 'IMMEDIATE' сразу
+                    # отвечает «database is locked» вместо ожидания блокировки
+                    result = 'error'
+                return result, (time.perf_counter() - started) * 1000
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            outcomes = list(executor.map(buy, users))
+        # Резервы покупателей без заказа возвращаются сразу, не дожидаясь истечения
+        for user in users:
+            InventoryService.release(user)
+        return [result for result, _timing in outcomes], [timing for _result, timing in outcomes]
@@ -0,0 +1,73 @@
+"""
+Management команда для замера полноты и задержки исправления поисковых запросов
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.search.rewrite import QueryRewriteService, swap_layout, to_latin
+from products.search.text import CYRILLIC_RE, stem
+
+RU_LETTERS = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+
+def make_typo(word, rng):
+    """Одна случайная опечатка: замена, пропуск, лишняя буква или перестановка соседних"""
+    position = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(('replace', 'delete', 'insert', 'transpose'))
+    if kind == 'replace':
+        return word[:position] + rng.choice(RU_LETTERS) + word[position + 1:]
+    if kind == 'delete':
+        return word[:position] + word[position + 1:]
+    if kind == 'insert':
+        return word[:position] + rng.choice(RU_LETTERS) + word[position:]
+    return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+
+
+CORRUPTIONS = {
+    'раскладка': lambda word, rng: swap_layout(word),
+    'транслит': lambda word, rng: to_latin(word),
+    'опечатка': make_typo,
+    'раскладка+опечатка': lambda word, rng: swap_layout(make_typo(word, rng)),
+}
+
+
+class Command(BaseCommand):
+    help = 'Замеряет полноту (recall) и задержку переписывания запросов на искаженных словах каталога'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=1000, help='Количество слов для каждого вида искажений')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        QueryRewriteService.build()
+        rewriter = QueryRewriteService.get_rewriter()
+        words = sorted(word for word in rewriter.words if len(word) >= 5 and CYRILLIC_RE.fullmatch(word[0]))
+        if not words:
+            self.stdout.write(self.style.WARNING('Словарь пуст: добавьте товары и категории'))
+            return
+        self.stdout.write(f'Слов в словаре: {len(rewriter.words)}, ключей удалений: {len(rewriter.deletes)}')
+
+        timings = []
+        for name, corrupt in CORRUPTIONS.items():
+            found = unchanged = 0
+            for _ in range(options['samples']):
+                word = rng.choice(words)
+                query = corrupt(word, rng)
+                started = time.perf_counter()
+                rewritten = rewriter.rewrite(query)
+                timings.append((time.perf_counter() - started) * 1000)
+                found += stem(rewritten) == stem(word)
+                # Без переписывания запрос нашел бы то же, только если искажение не изменило основу
+                unchanged += stem(query) == stem(word)
+            self.stdout.write(
+                f'{name}: recall {found / options["samples"]:.1%} '
+                f'(без переписывания {unchanged / options["samples"]:.1%})'
+            )
+
+        timings.sort()
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(f'p50: {p50:.3f} мс, p99: {p99:.3f} мс, max: {timings[-1]:.3f} мс')
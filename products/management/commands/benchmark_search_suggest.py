@@ -0,0 +1,51 @@
+"""
+Management команда для замера задержки подсказок поиска (p50/p99)
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import translation
+
+from products.search.suggest import SuggestService, normalize
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержку SuggestService.suggest на префиксах названий из каталога'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--language', default='ru', help='Язык индекса подсказок')
+        parser.add_argument('--samples', type=int, default=2000, help='Количество случайных префиксов')
+
+    def handle(self, *args, **options):
+        language = options['language']
+        with translation.override(language):
+            SuggestService.build(language)
+            index = SuggestService.get_index(language)
+            texts = [normalize(text) for _type, text, _url, _weight in index.entries if normalize(text)]
+            if not texts:
+                self.stdout.write(self.style.WARNING('Индекс подсказок пуст: добавьте товары'))
+                return
+
+            # Префиксы длиной 1..12 символов, как при наборе текста
+            prefixes = []
+            for _ in range(options['samples']):
+                text = random.choice(texts)
+                prefixes.append(text[:random.randint(1, min(12, len(text)))])
+
+            timings = []
+            with CaptureQueriesContext(connection) as context:
+                for prefix in prefixes:
+                    started = time.perf_counter()
+                    SuggestService.suggest(prefix, language)
+                    timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f'Записей: {len(index.entries)}, ключей: {len(index.keys)}, запросов к БД: {len(context.captured_queries)}'
+        )
+        self.stdout.write(f'p50: {p50:.3f} мс, p99: {p99:.3f} мс, max: {timings[-1]:.3f} мс')
@@ -4,6 +4,7 @@ Management команда для создания подкатегорий
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from products.models import Category
+from products.category_counts import CategoryCounterService
 from products.utils import CategorySubcategoryGenerator
 
 
@@ -127,7 +128,4 @@ class Command(BaseCommand):
 
     def _update_products_count(self):
         """Обновляет счетчики товаров для всех категорий"""
-        categories = Category.objects.all()
-        for category in categories:
-            category.update_products_count()
-            category.save(update_fields=['products_count', 'has_products'])
\ No newline at end of file
+        CategoryCounterService.rebuild()
\ No newline at end of file
@@ -4,6 +4,7 @@ Management команда для загрузки товаров с реальн
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from products.models import Category, Product
+from products.category_counts import CategoryCounterService
 from products.services import ProductLoader
 
 
@@ -198,15 +199,5 @@ class Command(BaseCommand):
 
     def _update_category_counters(self):
         """Обновляет счетчики товаров во всех категориях"""
-        categories = Category.objects.all()
-        updated_count = 0
-        
-        for category in categories:
-            old_count = category.products_count
-            new_count = category.update_products_count()
-            
-            if old_count != new_count:
-                category.save(update_fields=['products_count', 'has_products'])
-                updated_count += 1
-        
+        updated_count = CategoryCounterService.rebuild()
         self.stdout.write(f'Обновлено счетчиков: {updated_count}')
\ No newline at end of file
@@ -10,6 +10,7 @@ from products.models import (
     Seller, Shop, Tag, Location
 )
 from django.utils.translation import get_language
+from products.search.queue import SearchIndexQueueService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -419,7 +420,8 @@ class Command(BaseCommand):
 
         # Генерируем товары
         products_created = 0
-        with transaction.atomic():
+        # Поиск не переиндексируется по каждому сохранению, а пересобирается один раз в конце
+        with SearchIndexQueueService.suspended(), transaction.atomic():
             for i in range(count):
                 try:
                     # Выбираем случайную категорию
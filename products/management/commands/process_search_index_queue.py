@@ -0,0 +1,17 @@
+"""
+Management команда для обработки очереди переиндексации поиска
+"""
+from django.core.management.base import BaseCommand
+
+from products.search.queue import SearchIndexQueueService
+
+
+class Command(BaseCommand):
+    help = 'Переиндексирует товары из очереди SearchIndexQueue (то же, что периодическая задача Celery)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество товаров в одной пачке')
+
+    def handle(self, *args, **options):
+        total = SearchIndexQueueService.process(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Переиндексировано товаров: {total}'))
@@ -0,0 +1,14 @@
+"""
+Management команда для пересчета счетчиков товаров в категориях
+"""
+from django.core.management.base import BaseCommand
+
+from products.category_counts import CategoryCounterService
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает products_count и has_products для всего дерева категорий'
+
+    def handle(self, *args, **options):
+        changed = CategoryCounterService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено категорий: {changed}'))
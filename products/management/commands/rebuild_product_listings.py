@@ -0,0 +1,17 @@
+"""
+Management команда для пересборки денормализованных карточек каталога
+"""
+from django.core.management.base import BaseCommand
+
+from products.listing import ProductListingService
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицу ProductListing для всех товаров и языков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество товаров в одной пачке')
+
+    def handle(self, *args, **options):
+        total = ProductListingService.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересобрано карточек: {total}'))
@@ -0,0 +1,17 @@
+"""
+Management команда для пересчета похожих товаров
+"""
+from django.core.management.base import BaseCommand
+
+from products.related import RelatedProductService
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицу похожих товаров RelatedProduct (то же, что периодическая задача Celery)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество товаров в одной пачке')
+
+    def handle(self, *args, **options):
+        total = RelatedProductService.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны похожие товары для {total} товаров'))
@@ -0,0 +1,17 @@
+"""
+Management команда для пересборки поискового индекса товаров
+"""
+from django.core.management.base import BaseCommand
+
+from products.search.queue import SearchIndexQueueService
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поиск товаров: search_vector и индекс SEARCH_BACKEND'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество товаров в одной пачке')
+
+    def handle(self, *args, **options):
+        total = SearchIndexQueueService.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {total}'))
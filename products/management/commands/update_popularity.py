@@ -0,0 +1,18 @@
+"""
+Management команда для пересчета популярности товаров
+"""
+from django.core.management.base import BaseCommand
+
+from products.popularity import PopularityService
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает popularity_score товаров (то же, что периодическая задача Celery)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать все товары, а не только с новыми событиями')
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество товаров в одной пачке')
+
+    def handle(self, *args, **options):
+        total = PopularityService.update(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитана популярность товаров: {total}'))
@@ -0,0 +1,41 @@
+# Индекс поддерева категорий по префиксу path
+
+from django.db import migrations, models
+
+
+def rebuild_category_paths(apps, schema_editor):
+    """Пересчитывает path и category_level для всех категорий обходом дерева в памяти"""
+    Category = apps.get_model('products', 'Category')
+    categories = list(Category.objects.only('id', 'parent_id', 'slug', 'path', 'category_level'))
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    changed = []
+    stack = [(category, '', -1) for category in children.get(None, [])]
+    while stack:
+        category, parent_path, parent_level = stack.pop()
+        path = f"{parent_path}/{category.slug}" if parent_path else category.slug
+        level = parent_level + 1
+        if category.path != path or category.category_level != level:
+            category.path = path
+            category.category_level = level
+            changed.append(category)
+        stack.extend((child, path, level) for child in children.get(category.id, []))
+
+    Category.objects.bulk_update(changed, ['path', 'category_level'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_create_parler_translation_tables'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(rebuild_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,106 @@
+# Денормализованные карточки товаров для списков каталога
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_product_listings(apps, schema_editor):
+    """Заполняет карточки активных товаров на всех языках"""
+    Product = apps.get_model('products', 'Product')
+    ProductTranslation = apps.get_model('products', 'ProductTranslation')
+    ProductImage = apps.get_model('products', 'ProductImage')
+    ProductListing = apps.get_model('products', 'ProductListing')
+
+    languages = [code for code, _name in settings.LANGUAGES]
+    names = {}
+    for master_id, language_code, name in ProductTranslation.objects.values_list('master_id', 'language_code', 'name'):
+        names.setdefault(master_id, {})[language_code] = name
+    images = {}
+    for image in ProductImage.objects.only('id', 'product_id', 'image', 'medium').order_by('-is_primary', 'order', 'created_at'):
+        images.setdefault(image.product_id, image)
+
+    rows = []
+    # Состояние миграций еще содержит удаленные поля name/description, поэтому
+    # загружаем только нужные колонки
+    products = Product.objects.filter(is_active=True).select_related('seller', 'category').only(
+        'id', 'sku', 'price', 'discount_price', 'currency', 'brand', 'category_id', 'rating',
+        'reviews_count', 'views_count', 'stock_quantity', 'created_at',
+        'seller__company_name', 'category__path',
+    )
+    for product in products:
+        product_names = names.get(product.pk, {})
+        fallback_name = product_names.get(settings.PARLER_DEFAULT_LANGUAGE_CODE) or next(iter(product_names.values()), '') or product.sku
+        image = images.get(product.pk)
+        image_url = ''
+        if image is not None and image.image:
+            image_url = image.medium.url if image.medium else image.image.url
+        discount_percentage = Decimal(0)
+        if product.discount_price and product.price:
+            discount_percentage = ((product.price - product.discount_price) / product.price * 100).quantize(Decimal('0.01'))
+        for language_code in languages:
+            rows.append(ProductListing(
+                product_id=product.pk,
+                language_code=language_code,
+                name=product_names.get(language_code) or fallback_name,
+                price=product.price,
+                discount_price=product.discount_price,
+                final_price=product.discount_price or product.price,
+                discount_percentage=discount_percentage,
+                currency=product.currency,
+                image_url=image_url,
+                seller_name=product.seller.company_name if product.seller else '',
+                brand=product.brand,
+                category_id=product.category_id,
+                category_path=product.category.path if product.category else '',
+                rating=product.rating,
+                reviews_count=product.reviews_count,
+                views_count=product.views_count,
+                stock_quantity=product.stock_quantity,
+                created_at=product.created_at,
+            ))
+    ProductListing.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language_code', models.CharField(max_length=15, verbose_name='Язык')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена')),
+                ('discount_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Цена со скидкой')),
+                ('final_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Итоговая цена')),
+                ('discount_percentage', models.DecimalField(decimal_places=2, default=0, max_digits=5, verbose_name='Процент скидки')),
+                ('currency', models.CharField(default='RUB', max_length=3, verbose_name='Валюта')),
+                ('image_url', models.CharField(blank=True, max_length=500, verbose_name='URL изображения')),
+                ('seller_name', models.CharField(blank=True, max_length=255, verbose_name='Продавец')),
+                ('brand', models.CharField(blank=True, max_length=100, verbose_name='Бренд')),
+                ('category_path', models.CharField(blank=True, max_length=500, verbose_name='Путь категории')),
+                ('rating', models.DecimalField(decimal_places=2, default=0, max_digits=3, verbose_name='Рейтинг')),
+                ('reviews_count', models.PositiveIntegerField(default=0, verbose_name='Количество отзывов')),
+                ('views_count', models.PositiveIntegerField(default=0, verbose_name='Количество просмотров')),
+                ('stock_quantity', models.PositiveIntegerField(default=0, verbose_name='Количество на складе')),
+                ('created_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.category', verbose_name='Категория')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listings', to='products.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Карточка товара в каталоге',
+                'verbose_name_plural': 'Карточки товаров в каталоге',
+                'indexes': [models.Index(fields=['language_code', '-views_count', '-reviews_count', 'id'], name='listing_popularity_idx'), models.Index(fields=['language_code', 'price', 'id'], name='listing_price_idx'), models.Index(fields=['language_code', '-rating', '-reviews_count', 'id'], name='listing_rating_idx'), models.Index(fields=['language_code', '-created_at', 'id'], name='listing_newest_idx'), models.Index(fields=['category', 'language_code'], name='listing_category_idx')],
+                'unique_together': {('product', 'language_code')},
+            },
+        ),
+        migrations.RunPython(fill_product_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Очередь отложенной переиндексации товаров в поиске
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_productlisting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField(unique=True, verbose_name='ID товара')),
+                ('queued_at', models.DateTimeField(verbose_name='Поставлен в очередь')),
+            ],
+            options={
+                'verbose_name': 'Товар в очереди индексации',
+                'verbose_name_plural': 'Очередь индексации поиска',
+                'ordering': ['queued_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Просмотры товаров по дням и популярность по недавним просмотрам
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_searchindexqueue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailyViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотры')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='products.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Просмотры товара за день',
+                'verbose_name_plural': 'Просмотры товаров по дням',
+                'constraints': [models.UniqueConstraint(fields=('product', 'date'), name='product_daily_views_unique')],
+                'indexes': [models.Index(fields=['date', 'product'], name='product_daily_views_date_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='recent_views',
+            field=models.PositiveIntegerField(default=0, verbose_name='Просмотры за последние дни'),
+        ),
+        migrations.AddField(
+            model_name='productlisting',
+            name='recent_views',
+            field=models.PositiveIntegerField(default=0, verbose_name='Просмотры за последние дни'),
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_popularity_keyset_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-recent_views', '-views_count', 'id'], name='product_popularity_keyset_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='productlisting',
+            name='listing_popularity_idx',
+        ),
+        migrations.AddIndex(
+            model_name='productlisting',
+            index=models.Index(fields=['language_code', '-recent_views', '-views_count', 'id'], name='listing_popularity_idx'),
+        ),
+    ]
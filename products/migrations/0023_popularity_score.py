@@ -0,0 +1,39 @@
+# Популярность с затуханием по времени: оценка и индексы сортировки по ней
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0022_productdailyviews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='popularity_score',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.AddField(
+            model_name='productlisting',
+            name='popularity_score',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_popularity_keyset_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-popularity_score', 'id'], name='product_popularity_keyset_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='productlisting',
+            name='listing_popularity_idx',
+        ),
+        migrations.AddIndex(
+            model_name='productlisting',
+            index=models.Index(fields=['language_code', '-popularity_score', 'id'], name='listing_popularity_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Убирает из состояния миграций поля, перенесенные в таблицы переводов
+
+# Миграция 0016 удалила колонки name/description SQL-запросами, но в
+# состоянии миграций поля остались. На SQLite каждая следующая перестройка
+# таблицы (AlterField) создавала их заново, причем description — как
+# NOT NULL без значения по умолчанию, и создать товар или категорию через
+# ORM в такой базе нельзя. Колонки удаляются, только если они есть.
+
+from django.db import migrations
+
+STALE_COLUMNS = {
+    'products_category': ['name', 'description'],
+    'products_product': ['name', 'description'],
+    'products_shop': ['name', 'address', 'city'],
+    'products_tag': ['name'],
+}
+
+
+def drop_stale_columns(apps, schema_editor):
+    connection = schema_editor.connection
+    quote_name = schema_editor.quote_name
+    with connection.cursor() as cursor:
+        for table, columns in STALE_COLUMNS.items():
+            existing = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+            for column in columns:
+                if column in existing:
+                    schema_editor.execute(f'ALTER TABLE {quote_name(table)} DROP COLUMN {quote_name(column)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0025_stockreservation'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_stale_columns, migrations.RunPython.noop),
+            ],
+            state_operations=[
+                migrations.RemoveField(model_name='category', name='description'),
+                migrations.RemoveField(model_name='category', name='name'),
+                migrations.RemoveField(model_name='product', name='description'),
+                migrations.RemoveField(model_name='product', name='name'),
+                migrations.RemoveField(model_name='shop', name='address'),
+                migrations.RemoveField(model_name='shop', name='city'),
+                migrations.RemoveField(model_name='shop', name='name'),
+                migrations.RemoveField(model_name='tag', name='name'),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Буфер просмотров товаров вместо пачек в кэше
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0026_remove_stale_translated_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViewBuffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField(verbose_name='ID товара')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('views', models.PositiveIntegerField(verbose_name='Просмотры')),
+            ],
+            options={
+                'verbose_name': 'Непримененные просмотры товара',
+                'verbose_name_plural': 'Буфер просмотров товаров',
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Недавние просмотры больше не используются: «популярное» сортируется по popularity_score
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0027_productviewbuffer'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='product',
+            name='recent_views',
+        ),
+        migrations.RemoveField(
+            model_name='productlisting',
+            name='recent_views',
+        ),
+    ]
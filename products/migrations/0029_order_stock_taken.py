@@ -0,0 +1,19 @@
+# Отметка о списании остатков при оформлении: отмена возвращает на склад
+# только такие заказы (заказы, оформленные раньше, остатки не списывали)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0028_remove_recent_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_taken',
+            field=models.BooleanField(default=False, verbose_name='Остатки списаны'),
+        ),
+    ]
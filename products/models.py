@@ -1,7 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from django.contrib.postgres.search import SearchVectorField, SearchVector
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import request_finished
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
@@ -132,6 +135,9 @@ class Category(TranslatableModel):
     mega_menu_description = models.TextField(blank=True, verbose_name=_("Описание для мега меню"))
     featured_products = models.ManyToManyField('Product', blank=True, related_name='featured_in_categories', verbose_name=_("Рекомендуемые товары"))
 
+    # Разделитель сегментов в path: "root/child/grandchild"
+    PATH_SEPARATOR = '/'
+
     def __str__(self):
         try:
             return self.name
@@ -140,13 +146,10 @@ class Category(TranslatableModel):
 
     @property
     def level(self):
-        """Возвращает уровень вложенности категории"""
-        level = 0
-        parent = self.parent
-        while parent:
-            level += 1
-            parent = parent.parent
-        return level
+        """Возвращает уровень вложенности категории по сохраненному пути"""
+        if not self.path:
+            return self.category_level
+        return self.path.count(self.PATH_SEPARATOR)
 
     @property
     def is_root(self):
@@ -162,12 +165,35 @@ class Category(TranslatableModel):
         """Возвращает дочерние категории"""
         return self.children.filter(is_active=True).order_by('sort_order', 'slug')
 
+    def get_descendants(self, include_self=False):
+        """Возвращает QuerySet всех потомков по префиксу пути (один индексированный запрос)"""
+        lookup = models.Q(path__startswith=f"{self.path}{self.PATH_SEPARATOR}")
+        if include_self:
+            lookup |= models.Q(pk=self.pk)
+        return Category.objects.filter(lookup)
+
+    def _prune_inactive_branches(self, nodes, key=lambda node: (node.pk, node.parent_id, node.is_active)):
+        """Оставляет только узлы, достижимые от текущей категории через активных родителей.
+
+        Узлы должны идти по возрастанию уровня, чтобы родитель обрабатывался раньше потомков.
+        """
+        reachable = {self.pk}
+        for node in nodes:
+            node_id, parent_id, is_active = key(node)
+            if is_active and parent_id in reachable:
+                reachable.add(node_id)
+                yield node
+
+    def get_descendant_ids(self, include_self=True):
+        """Возвращает id всех активных потомков одним запросом по индексу пути"""
+        rows = self.get_descendants().order_by('category_level').values_list('id', 'parent_id', 'is_active')
+        ids = [row[0] for row in self._prune_inactive_branches(rows, key=lambda row: row)]
+        return [self.pk] + ids if include_self else ids
+
     def get_all_children(self):
-        """Возвращает все дочерние категории рекурсивно"""
-        children = list(self.get_children())
-        for child in children:
-            children.extend(child.get_all_children())
-        return children
+        """Возвращает все активные дочерние категории всех уровней"""
+        descendants = self.get_descendants().order_by('category_level', 'sort_order', 'slug')
+        return list(self._prune_inactive_branches(descendants))
     
     def get_level_2_children(self):
         """Возвращает подкатегории 2-го уровня"""
@@ -195,29 +221,62 @@ class Category(TranslatableModel):
             self.path = self.slug
     
     def update_level(self):
-        """Обновляет уровень категории"""
-        level = 0
-        parent = self.parent
-        while parent:
-            level += 1
-            parent = parent.parent
-        self.category_level = level
+        """Обновляет уровень категории по уровню родителя"""
+        self.category_level = self.parent.category_level + 1 if self.parent else 0
     
     def update_products_count(self):
-        """Обновляет количество товаров в категории"""
-        count = self.products.filter(is_active=True).count()
-        # Добавляем товары из подкатегорий
-        for child in self.get_all_children():
-            count += child.products.filter(is_active=True).count()
+        """Обновляет количество товаров в категории (включая все подкатегории)
+
+        Обычно счетчики поддерживает CategoryCounterService; метод нужен для
+        точечной сверки одной категории.
+        """
+        count = Product.objects.filter(
+            category_id__in=self.get_descendant_ids(),
+            is_active=True
+        ).count()
         self.products_count = count
         self.has_products = count > 0
         return count
-    
+
+    def _move_descendants(self, old_path, old_level):
+        """Переписывает путь и уровень всего поддерева одним UPDATE после перемещения категории"""
+        from django.db.models.functions import Concat, Substr
+        old_prefix = f"{old_path}{self.PATH_SEPARATOR}"
+        Category.objects.filter(path__startswith=old_prefix).update(
+            path=Concat(
+                models.Value(f"{self.path}{self.PATH_SEPARATOR}"),
+                Substr('path', len(old_prefix) + 1),
+                output_field=models.CharField()
+            ),
+            category_level=models.F('category_level') + (self.category_level - old_level)
+        )
+
     def save(self, *args, **kwargs):
-        """Переопределяем save для автоматического обновления level и path"""
+        """Переопределяем save для автоматического обновления level, path, путей поддерева и счетчиков"""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'parent', 'slug', 'path', 'category_level', 'is_active'} & set(update_fields):
+            # Частичное сохранение (например, счетчиков) не затрагивает иерархию
+            return super().save(*args, **kwargs)
+
         self.update_level()
         self.update_path()
+        old = None
+        if self.pk:
+            old = Category.objects.filter(pk=self.pk).values_list('path', 'category_level', 'is_active', 'parent_id').first()
         super().save(*args, **kwargs)
+        if old and old[0] and old[0] != self.path:
+            self._move_descendants(*old[:2])
+            from .listing import ProductListingService
+            ProductListingService.move_category_path(old[0], self.path)
+        if old and (old[0] != self.path or old[2] != self.is_active):
+            # Перемещение или (де)активация меняет счетчики и фасеты целых веток
+            # предков: и прежней (через старого родителя), и новой
+            from django.db import transaction
+            from .category_counts import CategoryCounterService
+            from .facets import FacetService
+            transaction.on_commit(CategoryCounterService.rebuild)
+            changed_ids = {self.pk, old[3]}
+            transaction.on_commit(lambda: FacetService.invalidate_categories(changed_ids))
 
     class Meta:
         verbose_name = _("Категория")
@@ -227,6 +286,8 @@ class Category(TranslatableModel):
             models.Index(fields=['parent', 'is_active', 'category_level']),
             models.Index(fields=['category_level', 'sort_order']),
             models.Index(fields=['path']),
+            # Индекс для префиксного поиска потомков (path LIKE 'root/child/%') в PostgreSQL
+            models.Index(fields=['path'], name='category_path_prefix_idx', opclasses=['varchar_pattern_ops']),
             models.Index(fields=['show_in_megamenu', 'is_active']),
             models.Index(fields=['has_products', 'is_active']),
         ]
@@ -321,6 +382,7 @@ class Product(TranslatableModel):
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00, verbose_name=_("Рейтинг"))
     reviews_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество отзывов"))
     views_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество просмотров"))
+    popularity_score = models.FloatField(default=0, verbose_name=_("Популярность"))
     search_vector = SearchVectorField(null=True, verbose_name=_("Вектор поиска"))
     created_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Дата создания"))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Дата обновления"))
@@ -358,6 +420,11 @@ class Product(TranslatableModel):
             models.Index(fields=['price']),
             models.Index(fields=['rating']),
             models.Index(fields=['views_count']),
+            # Составные ключи keyset-пагинации (products/pagination.py)
+            models.Index(fields=['-popularity_score', 'id'], name='product_popularity_keyset_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_keyset_idx'),
+            models.Index(fields=['-rating', '-reviews_count', 'id'], name='product_rating_keyset_idx'),
+            models.Index(fields=['-created_at', 'id'], name='product_newest_keyset_idx'),
         ]
 
 
@@ -454,6 +521,131 @@ class ProductCharacteristic(models.Model):
         ordering = ['order']
 
 
+class ProductListing(models.Model):
+    """
+    Денормализованная карточка товара для списков каталога
+
+    Одна строка на активный товар и язык; заполняется ProductListingService
+    из Product, переводов, основного изображения, продавца и категории.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='listings', verbose_name=_("Товар"))
+    language_code = models.CharField(max_length=15, verbose_name=_("Язык"))
+    name = models.CharField(max_length=255, verbose_name=_("Название"))
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_("Цена"))
+    discount_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name=_("Цена со скидкой"))
+    final_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_("Итоговая цена"))
+    discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0, verbose_name=_("Процент скидки"))
+    currency = models.CharField(max_length=3, default='RUB', verbose_name=_("Валюта"))
+    image_url = models.CharField(max_length=500, blank=True, verbose_name=_("URL изображения"))
+    seller_name = models.CharField(max_length=255, blank=True, verbose_name=_("Продавец"))
+    brand = models.CharField(max_length=100, blank=True, verbose_name=_("Бренд"))
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_("Категория"))
+    category_path = models.CharField(max_length=500, blank=True, verbose_name=_("Путь категории"))
+    rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, verbose_name=_("Рейтинг"))
+    reviews_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество отзывов"))
+    views_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество просмотров"))
+    popularity_score = models.FloatField(default=0, verbose_name=_("Популярность"))
+    stock_quantity = models.PositiveIntegerField(default=0, verbose_name=_("Количество на складе"))
+    created_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Дата создания"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Дата обновления"))
+
+    def __str__(self):
+        return f"{self.name} [{self.language_code}]"
+
+    class Meta:
+        verbose_name = _("Карточка товара в каталоге")
+        verbose_name_plural = _("Карточки товаров в каталоге")
+        unique_together = ['product', 'language_code']
+        indexes = [
+            # Ключи keyset-пагинации в пределах языка
+            models.Index(fields=['language_code', '-popularity_score', 'id'], name='listing_popularity_idx'),
+            models.Index(fields=['language_code', 'price', 'id'], name='listing_price_idx'),
+            models.Index(fields=['language_code', '-rating', '-reviews_count', 'id'], name='listing_rating_idx'),
+            models.Index(fields=['language_code', '-created_at', 'id'], name='listing_newest_idx'),
+            models.Index(fields=['category', 'language_code'], name='listing_category_idx'),
+        ]
+
+
+class SearchIndexQueue(models.Model):
+    """
+    Очередь товаров, ожидающих переиндексации в поиске
+
+    Одна строка на товар: повторные изменения только сдвигают queued_at,
+    поэтому фоновая задача обрабатывает каждый товар один раз за проход.
+    Ссылка на товар не внешний ключ — удаленный товар тоже нужно убрать из индекса.
+    """
+    product_id = models.BigIntegerField(unique=True, verbose_name=_("ID товара"))
+    queued_at = models.DateTimeField(verbose_name=_("Поставлен в очередь"))
+
+    class Meta:
+        verbose_name = _("Товар в очереди индексации")
+        verbose_name_plural = _("Очередь индексации поиска")
+        ordering = ['queued_at']
+
+
+class ProductViewBuffer(models.Model):
+    """
+    Просмотры товаров, переданные процессами, но еще не примененные к базе
+
+    Каждая передача буфера процесса (ViewCounterService.handoff) добавляет
+    строки одним INSERT, задача flush_product_views суммирует их, применяет
+    и удаляет. Ссылка на товар не внешний ключ: товар могут удалить раньше,
+    чем его просмотры будут применены.
+    """
+    product_id = models.BigIntegerField(verbose_name=_("ID товара"))
+    date = models.DateField(verbose_name=_("Дата"))
+    views = models.PositiveIntegerField(verbose_name=_("Просмотры"))
+
+    class Meta:
+        verbose_name = _("Непримененные просмотры товара")
+        verbose_name_plural = _("Буфер просмотров товаров")
+
+
+class ProductDailyViews(models.Model):
+    """
+    Просмотры товара за один день
+
+    Строка появляется только для дней, когда товар смотрели. Заполняется
+    пачками из счетчика просмотров (ViewCounterService.flush).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_views', verbose_name=_("Товар"))
+    date = models.DateField(verbose_name=_("Дата"))
+    views = models.PositiveIntegerField(default=0, verbose_name=_("Просмотры"))
+
+    class Meta:
+        verbose_name = _("Просмотры товара за день")
+        verbose_name_plural = _("Просмотры товаров по дням")
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='product_daily_views_unique'),
+        ]
+        indexes = [
+            # Суммы за период по всем товарам (популярность за последние дни)
+            models.Index(fields=['date', 'product'], name='product_daily_views_date_idx'),
+        ]
+
+
+class RelatedProduct(models.Model):
+    """
+    Похожий товар для страницы товара
+
+    Для каждого товара хранится до RELATED_PRODUCTS_LIMIT строк в порядке
+    position; таблицу целиком пересобирает фоновая задача
+    (RelatedProductService.rebuild) по совместным покупкам, избранному,
+    общим тегам и характеристикам.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_items', verbose_name=_("Товар"))
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_from', verbose_name=_("Похожий товар"))
+    position = models.PositiveSmallIntegerField(verbose_name=_("Позиция"))
+    score = models.FloatField(default=0, verbose_name=_("Сходство"))
+
+    class Meta:
+        verbose_name = _("Похожий товар")
+        verbose_name_plural = _("Похожие товары")
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'position'], name='related_product_position_unique'),
+        ]
+
+
 class Order(models.Model):
     """Модель заказа"""
     STATUS_CHOICES = [
@@ -481,6 +673,9 @@ class Order(models.Model):
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name=_("Размер скидки"))
     shipping_address = models.TextField(verbose_name=_("Адрес доставки"))
     notes = models.TextField(blank=True, verbose_name=_("Примечания"))
+    # Остатки списаны при оформлении (CheckoutService): только такие заказы
+    # возвращают товары на склад при отмене
+    stock_taken = models.BooleanField(default=False, verbose_name=_("Остатки списаны"))
     created_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Дата создания"))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Дата обновления"))
     
@@ -567,11 +762,14 @@ class Cart(models.Model):
     
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
     
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        # Цена со скидкой, как Product.final_price, считается одним запросом
+        unit_price = Coalesce('product__discount_price', 'product__price')
+        total = self.items.aggregate(total=models.Sum(unit_price * models.F('quantity')))['total']
+        return total or Decimal('0')
     
     class Meta:
         verbose_name = _("Корзина")
@@ -598,6 +796,34 @@ class CartItem(models.Model):
         unique_together = ['cart', 'product']
 
 
+class StockReservation(models.Model):
+    """
+    Резерв товара на время оформления заказа
+
+    Зарезервированные единицы уже вычтены из Product.stock_quantity, поэтому
+    остаток всегда означает свободные единицы. При оформлении заказа резерв
+    списывается, просроченные резервы возвращает на склад периодическая
+    задача (InventoryService.release_expired). Остаток, введенный в админке
+    или форме товара, считается числом единиц на складе, и резервы
+    вычитаются из него (InventoryService.set_on_hand).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations', verbose_name=_("Пользователь"))
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations', verbose_name=_("Товар"))
+    quantity = models.PositiveIntegerField(verbose_name=_("Количество"))
+    expires_at = models.DateTimeField(db_index=True, verbose_name=_("Действует до"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Дата создания"))
+
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity} до {self.expires_at:%H:%M}"
+
+    class Meta:
+        verbose_name = _("Резерв товара")
+        verbose_name_plural = _("Резервы товаров")
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='stock_reservation_user_product_unique'),
+        ]
+
+
 class Commission(models.Model):
     """Модель комиссии"""
     seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='commissions', verbose_name=_("Продавец"))
@@ -692,27 +918,201 @@ class Notification(models.Model):
 
 
 # Сигналы
+# Поля товара, которые попадают в поисковый индекс (кроме переводов, тегов и характеристик)
+SEARCH_INDEX_FIELDS = frozenset({'brand', 'is_active'})
+
+
+def _mark_search_dirty(product_ids):
+    """Ставит товары в очередь переиндексации (в той же транзакции, что и изменение)"""
+    from .search.queue import SearchIndexQueueService
+    SearchIndexQueueService.mark_dirty(product_ids)
+
+
 @receiver(post_save, sender=Product)
-def update_product_search_vector(sender, instance, **kwargs):
-    """Обновляет вектор поиска для товара"""
-    # Проверяем, что это не рекурсивный вызов
-    if not kwargs.get('update_fields') or 'search_vector' not in kwargs.get('update_fields', []):
-        # Проверяем, используем ли мы PostgreSQL (только PostgreSQL поддерживает SearchVector)
-        from django.conf import settings
-        from django.db import transaction
-        
-        # Получаем тип базы данных
-        db_engine = settings.DATABASES['default']['ENGINE']
-        
-        # Используем SearchVector только если это PostgreSQL
-        if 'postgresql' in db_engine:
-            with transaction.atomic():
-                # Обновляем search_vector напрямую через QuerySet, чтобы избежать рекурсии
-                Product.objects.filter(pk=instance.pk).update(
-                    search_vector=SearchVector('name', 'description')
-                )
-        # Для других баз данных (например, SQLite) просто пропускаем обновление search_vector
-        # Это предотвращает ошибку с to_tsvector в SQLite
+@receiver(post_delete, sender=Product)
+def update_product_search_index(sender, instance, **kwargs):
+    """Переиндексирует товар в поисковом индексе после фиксации транзакции"""
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not SEARCH_INDEX_FIELDS & set(update_fields):
+        return
+    _mark_search_dirty([instance.pk])
+
+
+@receiver(post_save, sender=Product._parler_meta.root_model)
+def update_product_search_index_translation(sender, instance, **kwargs):
+    """Переиндексирует товар после изменения названия или описания"""
+    _mark_search_dirty([instance.master_id])
+
+
+@receiver(post_save, sender=ProductCharacteristic)
+@receiver(post_delete, sender=ProductCharacteristic)
+def update_product_search_index_characteristic(sender, instance, **kwargs):
+    """Переиндексирует товар после изменения характеристик"""
+    _mark_search_dirty([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_product_search_index_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """Переиндексирует товары после изменения их тегов"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _mark_search_dirty([instance.pk])
+    elif pk_set:
+        _mark_search_dirty(pk_set)
+
+
+@receiver(post_save, sender=Tag._parler_meta.root_model)
+def update_product_search_index_tag_name(sender, instance, **kwargs):
+    """Переиндексирует товары с переименованным тегом"""
+    _mark_search_dirty(
+        Product.tags.through.objects.filter(tag_id=instance.master_id).values_list('product_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Category._parler_meta.root_model)
+@receiver(post_delete, sender=Category._parler_meta.root_model)
+def bump_category_tree_generation(sender, **kwargs):
+    """Сбрасывает закэшированное дерево категорий при любом изменении категории"""
+    from .category_tree import CategoryTreeService
+    CategoryTreeService.bump_generation()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Product._parler_meta.root_model)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Category._parler_meta.root_model)
+def invalidate_catalog_pages(sender, **kwargs):
+    """Помечает закэшированные страницы каталога и результаты поиска устаревшими после фиксации транзакции"""
+    from django.db import transaction
+    from .page_cache import PageCache
+    from .search.results import SearchResultCache
+
+    update_fields = kwargs.get('update_fields')
+    if sender is Product and update_fields and set(update_fields) <= {'views_count', 'popularity_score'}:
+        # Счетчик просмотров не стоит перерисовки каталога
+        return
+    transaction.on_commit(PageCache.invalidate)
+    transaction.on_commit(SearchResultCache.invalidate)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, **kwargs):
+    """Запоминает прежние категорию и активность товара для фасетов и счетчиков категорий"""
+    instance.__dict__.pop('_old_category_id', None)
+    instance.__dict__.pop('_old_is_active', None)
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'category', 'category_id', 'is_active'} & set(update_fields):
+        return
+    old = None
+    if instance.pk:
+        old = Product.objects.filter(pk=instance.pk).values_list('category_id', 'is_active').first()
+    instance._old_category_id, instance._old_is_active = old or (None, False)
+
+
+@receiver(post_save, sender=Product)
+def update_category_products_count(sender, instance, **kwargs):
+    """Инкрементально переносит товар между счетчиками категорий"""
+    from django.db import transaction
+    from .category_counts import CategoryCounterService
+
+    if not hasattr(instance, '_old_is_active'):
+        return
+    change = (instance._old_category_id, instance._old_is_active, instance.category_id, instance.is_active)
+    transaction.on_commit(lambda: CategoryCounterService.product_changed(*change))
+
+
+@receiver(post_delete, sender=Product)
+def decrement_category_products_count(sender, instance, **kwargs):
+    """Убирает удаленный товар из счетчиков категорий"""
+    from django.db import transaction
+    from .category_counts import CategoryCounterService
+
+    if instance.is_active:
+        # Предков берем сразу: к фиксации категория может быть удалена вместе с товаром
+        category_ids = CategoryCounterService.get_counted_ancestors(instance.category_id)
+        transaction.on_commit(lambda: CategoryCounterService.update_counters(category_ids, -1))
+
+
+@receiver(pre_delete, sender=Category)
+def decrement_ancestor_products_count(sender, instance, **kwargs):
+    """
+    Убирает из счетчиков предков товары удаляемой категории
+
+    Товары при удалении категории отвязываются (SET_NULL) одним UPDATE без
+    сигналов. Для каждой удаляемой категории, включая каскадно удаляемые
+    подкатегории, вычитаются только ее собственные товары, поэтому вложенные
+    удаляемые категории не учитываются дважды.
+    """
+    from django.db import transaction
+    from .category_counts import CategoryCounterService
+
+    direct = Product.objects.filter(category_id=instance.pk, is_active=True).count()
+    if not direct:
+        return
+    category_ids = CategoryCounterService.get_counted_ancestors(instance.pk)[1:]
+    transaction.on_commit(lambda: CategoryCounterService.update_counters(category_ids, -direct))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_facets(sender, instance, **kwargs):
+    """Сбрасывает кэш фасетов затронутых категорий после фиксации транзакции"""
+    from django.db import transaction
+    from .facets import FacetService, FACET_FIELDS
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not FACET_FIELDS.intersection(update_fields):
+        return
+    category_ids = {instance.category_id, getattr(instance, '_old_category_id', None)}
+    transaction.on_commit(lambda: FacetService.invalidate_categories(category_ids))
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_listing(sender, instance, **kwargs):
+    """Обновляет карточки товара в ProductListing после фиксации транзакции"""
+    from django.db import transaction
+    from .listing import ProductListingService, DIRECT_FIELDS
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= DIRECT_FIELDS:
+        # Счетчики и простые поля переносим одним UPDATE без пересборки
+        ProductListingService.update_fields(instance, update_fields)
+        return
+    transaction.on_commit(lambda: ProductListingService.refresh_products([instance.pk]))
+
+
+@receiver(post_save, sender=Product._parler_meta.root_model)
+def refresh_product_listing_translation(sender, instance, **kwargs):
+    """Пересобирает карточки товара при изменении его перевода"""
+    from django.db import transaction
+    from .listing import ProductListingService
+
+    transaction.on_commit(lambda: ProductListingService.refresh_products([instance.master_id]))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_product_listing_image(sender, instance, **kwargs):
+    """Пересобирает карточки товара при изменении его изображений"""
+    from django.db import transaction
+    from .listing import ProductListingService
+
+    transaction.on_commit(lambda: ProductListingService.refresh_products([instance.product_id]))
+
+
+@receiver(post_save, sender=Seller)
+def refresh_product_listing_seller(sender, instance, **kwargs):
+    """Переносит название продавца в карточки его товаров"""
+    from .listing import ProductListingService
+
+    ProductListingService.update_seller_name(instance)
 
 
 @receiver(post_save, sender=Review)
@@ -900,6 +1300,17 @@ class ProductBanner(models.Model):
         ordering = ['sort_order', '-created_at']
 
 
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+@receiver(post_save, sender=ProductBanner)
+@receiver(post_delete, sender=ProductBanner)
+def invalidate_catalog_pages_banners(sender, **kwargs):
+    """Баннеры выводятся на главной, поэтому их изменение тоже сбрасывает кэш страниц"""
+    from django.db import transaction
+    from .page_cache import PageCache
+    transaction.on_commit(PageCache.invalidate)
+
+
 @receiver(post_save, sender=User)
 def create_cart(sender, instance, created, **kwargs):
     """Создает корзину для нового пользователя"""
@@ -907,6 +1318,32 @@ def create_cart(sender, instance, created, **kwargs):
         Cart.objects.create(user=instance)
 
 
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_summary(sender, instance, **kwargs):
+    """Сбрасывает закэшированную сводку корзины (значок в шапке)"""
+    from .cart import CartService
+    if CartService.is_summary_invalidation_suspended():
+        return
+    CartService.invalidate_summary(instance.cart.user_id)
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    """Переносит корзину, собранную до входа, в корзину пользователя"""
+    from .cart import CartService
+    if request is not None and hasattr(request, 'session'):
+        CartService.merge_guest_cart(request, user)
+
+
+@receiver(request_finished)
+def hand_off_product_views(sender, **kwargs):
+    """В конце запроса передает накопленные просмотры товаров в базу, если пора"""
+    from .view_counter import ViewCounterService
+
+    ViewCounterService.handoff_if_due()
+
+
 class StaticPage(models.Model):
     """Модель для статических страниц сайта"""
     title = models.CharField(max_length=200, verbose_name='Заголовок')
@@ -6,7 +6,10 @@ from django.views.decorators.csrf import csrf_exempt
 from django.core.paginator import Paginator
 from django.db.models import Q, Count
 from .models import Order, OrderItem
+from .cart import CartService
+from .checkout import CheckoutService
 import json
+from collections import Counter
 
 
 class OrderListMixin:
@@ -89,10 +92,8 @@ def cancel_order(request, order_id):
     """Отмена заказа"""
     order = get_object_or_404(Order, id=order_id, user=request.user)
     
-    if order.status in ['pending', 'processing']:
-        order.status = 'cancelled'
-        order.save()
-        
+    # Статус меняется вместе с возвратом товаров на склад
+    if CheckoutService.cancel_order(order):
         return JsonResponse({'success': True, 'message': 'Заказ отменен'})
     else:
         return JsonResponse({'success': False, 'message': 'Заказ нельзя отменить'}, status=400)
@@ -104,20 +105,10 @@ def repeat_order(request, order_id):
     """Повторение заказа"""
     order = get_object_or_404(Order, id=order_id, user=request.user)
     
-    # Добавляем товары из заказа в корзину
-    cart = request.session.get('cart', {})
-    
-    for item in order.items.all():
-        product_id = str(item.product.id)
-        if product_id in cart:
-            cart[product_id]['quantity'] += item.quantity
-        else:
-            cart[product_id] = {
-                'quantity': item.quantity,
-                'price': float(item.product.price)
-            }
-    
-    request.session['cart'] = cart
-    request.session.modified = True
+    # Добавляем товары из заказа в корзину одной пакетной записью
+    quantities = Counter()
+    for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+        quantities[product_id] += quantity
+    CartService.get_store(request).add_many(quantities)
     
     return JsonResponse({'success': True, 'message': 'Товары добавлены в корзину'})
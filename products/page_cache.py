@@ -0,0 +1,167 @@
+"""
+Кэш целых страниц каталога для анонимных посетителей
+
+Ключ страницы строится из пути, нормализованных параметров запроса, языка и
+локации. Любое изменение товаров, категорий или баннеров увеличивает
+поколение кэша: записи прошлого поколения еще какое-то время отдаются как
+устаревшие (stale-while-revalidate), пока один запрос под блокировкой
+перерисовывает страницу, поэтому всплеск трафика не превращается во всплеск
+запросов к базе.
+"""
+import hashlib
+import logging
+import re
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import translation
+
+from .cart import CART_SESSION_KEY
+
+logger = logging.getLogger(__name__)
+
+PAGE_GENERATION_KEY = 'page_cache:generation'
+# Сколько секунд страница считается свежей
+PAGE_CACHE_FRESH = 60
+# Сколько еще можно отдавать устаревшую страницу, пока ее перерисовывают
+PAGE_CACHE_STALE = 60 * 10
+PAGE_CACHE_LOCK_TIMEOUT = 30
+
+# Рекламные метки не меняют содержимое страницы
+IGNORED_PARAMS = frozenset({'fbclid', 'gclid', 'yclid', '_'})
+
+# Токен CSRF в закэшированной разметке заменяется на свежий для каждого посетителя
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[A-Za-z0-9]+(")')
+CSRF_PLACEHOLDER = b'__page_cache_csrf__'
+
+
+class PageCache:
+    """Хранение и выдача закэшированных страниц"""
+
+    @staticmethod
+    def get_generation():
+        """Текущее поколение кэша страниц"""
+        generation = cache.get(PAGE_GENERATION_KEY)
+        if generation is None:
+            cache.add(PAGE_GENERATION_KEY, 1, None)
+            generation = cache.get(PAGE_GENERATION_KEY, 1)
+        return generation
+
+    @staticmethod
+    def invalidate():
+        """Делает все закэшированные страницы устаревшими"""
+        try:
+            cache.incr(PAGE_GENERATION_KEY)
+        except ValueError:
+            cache.set(PAGE_GENERATION_KEY, 2, None)
+
+    @staticmethod
+    def is_cacheable(request):
+        """Страницу можно брать из кэша и класть в кэш только для анонимного GET"""
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if request.user.is_authenticated or getattr(request, 'client', None):
+            return False
+        # Корзина (значок в шапке) и ожидающие показа сообщения (flash) делают страницу персональной
+        if getattr(request, 'session', {}).get(CART_SESSION_KEY):
+            return False
+        return not len(get_messages(request))
+
+    @staticmethod
+    def normalize_params(params):
+        """Параметры запроса в каноническом виде: без пустых значений и меток, по порядку"""
+        items = []
+        for name in params:
+            if name in IGNORED_PARAMS or name.startswith('utm_'):
+                continue
+            for value in params.getlist(name):
+                value = value.strip()
+                if value:
+                    items.append((name, value))
+        return urlencode(sorted(items))
+
+    @staticmethod
+    def get_location_id(request):
+        """Локация посетителя (из middleware или сессии)"""
+        location = getattr(request, 'user_location', None)
+        if location is not None:
+            return location.pk
+        return request.session.get('user_location_id') or 0
+
+    @staticmethod
+    def cache_key(request):
+        """Ключ страницы: путь, нормализованные параметры, язык и локация"""
+        raw = f'{request.path}?{PageCache.normalize_params(request.GET)}'
+        digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+        language = translation.get_language() or ''
+        return f'page_cache:{language}:{PageCache.get_location_id(request)}:{digest}'
+
+    @staticmethod
+    def store(request, key, response, generation):
+        """Сохраняет ответ, если он общий для всех анонимных посетителей"""
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return
+        if getattr(request, 'session', None) is not None and request.session.modified:
+            return
+        if not PageCache.is_cacheable(request):
+            return
+        entry = {
+            'content': CSRF_INPUT_RE.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content),
+            'content_type': response['Content-Type'],
+            'generation': generation,
+            'created': time.time(),
+        }
+        cache.set(key, entry, PAGE_CACHE_FRESH + PAGE_CACHE_STALE)
+
+    @staticmethod
+    def build_response(request, entry, state):
+        """Ответ из закэшированной записи со свежим токеном CSRF"""
+        content = entry['content']
+        if CSRF_PLACEHOLDER in content:
+            content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode('ascii'))
+        response = HttpResponse(content, content_type=entry['content_type'])
+        response['X-Page-Cache'] = state
+        return response
+
+
+def cache_anonymous_page(view_func):
+    """
+    Декоратор представления каталога: кэш страниц для анонимных посетителей
+
+    Свежая запись отдается сразу. Устаревшая (по возрасту или поколению)
+    перерисовывается одним запросом, взявшим блокировку, остальные в это
+    время получают устаревшую копию.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not PageCache.is_cacheable(request):
+            return view_func(request, *args, **kwargs)
+
+        key = PageCache.cache_key(request)
+        generation = PageCache.get_generation()
+        entry = cache.get(key)
+        lock_key = f'{key}:lock'
+        locked = False
+        if entry is not None:
+            fresh = entry['generation'] == generation and time.time() - entry['created'] < PAGE_CACHE_FRESH
+            if fresh:
+                return PageCache.build_response(request, entry, 'HIT')
+            locked = cache.add(lock_key, 1, PAGE_CACHE_LOCK_TIMEOUT)
+            if not locked:
+                return PageCache.build_response(request, entry, 'STALE')
+
+        try:
+            response = view_func(request, *args, **kwargs)
+            PageCache.store(request, key, response, generation)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        response['X-Page-Cache'] = 'MISS'
+        return response
+
+    return wrapper
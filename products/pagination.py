@@ -0,0 +1,173 @@
+"""
+Keyset (cursor) пагинация для списков товаров каталога
+
+В отличие от Paginator не выполняет COUNT(*) и OFFSET: следующая страница
+выбирается условием "после последней строки предыдущей страницы" по тем же
+полям, что и сортировка, поэтому стоимость 500-й страницы равна стоимости первой.
+"""
+import operator
+from functools import reduce
+
+from django.core import signing
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+# Порядки сортировки каталога. Последним полем всегда идет уникальный id,
+# чтобы порядок был строго детерминированным.
+SORT_ORDERS = {
+    # Популярность с затуханием по времени (products/popularity.py)
+    'popularity': ('-popularity_score', 'id'),
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', 'id'),
+    'rating': ('-rating', '-reviews_count', 'id'),
+    'newest': ('-created_at', 'id'),
+}
+DEFAULT_SORT = 'popularity'
+
+CURSOR_SALT = 'products.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    """Курсор поврежден, подделан или выдан для другой сортировки"""
+
+
+class KeysetPage:
+    """Страница результатов keyset-пагинации (совместима с шаблонами Paginator)"""
+
+    def __init__(self, object_list, paginator, next_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return False
+
+    def has_other_pages(self):
+        return self.has_next()
+
+
+class KeysetPaginator:
+    """
+    Пагинатор по ключу сортировки с непрозрачными курсорами
+
+    Args:
+        queryset: QuerySet товаров (без сортировки или с любой — она будет заменена)
+        per_page: Размер страницы
+        sort: Ключ из SORT_ORDERS
+    """
+
+    def __init__(self, queryset, per_page, sort=DEFAULT_SORT):
+        if sort not in SORT_ORDERS:
+            sort = DEFAULT_SORT
+        self.sort = sort
+        self.fields = SORT_ORDERS[sort]
+        self.per_page = per_page
+        self.model = queryset.model
+        self.queryset = queryset.order_by(*self._order_by())
+
+    @staticmethod
+    def supports(sort):
+        """Проверяет, можно ли листать данную сортировку курсором"""
+        return sort in SORT_ORDERS
+
+    @cached_property
+    def count(self):
+        """Точное количество строк — считается только по явному запросу"""
+        return self.queryset.order_by().count()
+
+    def get_page(self, cursor=None):
+        """Возвращает страницу, начинающуюся после позиции курсора"""
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1])
+        return KeysetPage(rows, self, next_cursor)
+
+    def encode_cursor(self, obj):
+        """Упаковывает значения ключа сортировки последней строки в подписанный токен"""
+        values = []
+        for name in self._field_names():
+            field = self.model._meta.get_field(name)
+            value = getattr(obj, field.attname)
+            values.append(None if value is None else field.value_to_string(obj))
+        return signing.dumps({'s': self.sort, 'v': values}, salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        """Распаковывает токен обратно в типизированные значения полей"""
+        try:
+            payload = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature as exc:
+            raise InvalidCursor(str(exc)) from exc
+
+        names = self._field_names()
+        if not isinstance(payload, dict) or payload.get('s') != self.sort:
+            raise InvalidCursor('Cursor does not match sort order')
+        values = payload.get('v')
+        if not isinstance(values, list) or len(values) != len(names):
+            raise InvalidCursor('Cursor does not match sort order')
+
+        model_meta = self.model._meta
+        try:
+            return [
+                None if value is None else model_meta.get_field(name).to_python(value)
+                for name, value in zip(names, values)
+            ]
+        except Exception as exc:
+            raise InvalidCursor(str(exc)) from exc
+
+    def _field_names(self):
+        return [field.lstrip('-') for field in self.fields]
+
+    def _order_by(self):
+        # NULLS LAST задаем только для nullable-полей, иначе PostgreSQL не сможет
+        # использовать обычный индекс для обратного сканирования
+        model_meta = self.model._meta
+        ordering = []
+        for field in self.fields:
+            name = field.lstrip('-')
+            nulls_last = True if model_meta.get_field(name).null else None
+            expression = F(name)
+            if field.startswith('-'):
+                ordering.append(expression.desc(nulls_last=nulls_last))
+            else:
+                ordering.append(expression.asc(nulls_last=nulls_last))
+        return ordering
+
+    def _after(self, values):
+        """
+        Строит условие "строка идет после курсора" для составного ключа:
+        (a > x) OR (a = x AND b > y) OR ... с учетом NULLS LAST
+        """
+        model_meta = self.model._meta
+        clauses = []
+        equal_prefix = Q()
+        for field, value in zip(self.fields, values):
+            name = field.lstrip('-')
+            if value is None:
+                # NULL стоит в конце: после него идут только такие же NULL
+                equal_prefix &= Q(**{f'{name}__isnull': True})
+                continue
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            after = Q(**{f'{name}__{lookup}': value})
+            if model_meta.get_field(name).null:
+                after |= Q(**{f'{name}__isnull': True})
+            clauses.append(equal_prefix & after)
+            equal_prefix &= Q(**{name: value})
+        return reduce(operator.or_, clauses)
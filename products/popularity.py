@@ -0,0 +1,161 @@
+"""
+Популярность товаров с затуханием по времени
+
+Каждое событие (просмотр, купленная единица, отзыв) весит тем меньше, чем
+оно старше: вклад уменьшается вдвое за POPULARITY_HALF_LIFE_DAYS дней.
+Сумма вкладов умножается на поправку за рейтинг.
+
+Оценка хранится в «опорной» форме относительно фиксированной даты
+POPULARITY_EPOCH:
+
+    popularity_score = log2(активность на сегодня) + (сегодня - эпоха) / период полураспада
+
+Затухание у всех товаров одинаковое, поэтому в такой форме порядок товаров
+не меняется, пока у них нет новых событий, и пересчитывать их не нужно.
+Периодическая задача пересчитывает только товары с событиями после
+прошлого прохода; +1 к оценке означает «вдвое популярнее».
+"""
+import logging
+import math
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import OrderItem, Product, ProductDailyViews, ProductListing, Review
+
+logger = logging.getLogger(__name__)
+
+POPULARITY_EPOCH = date(2025, 1, 1)
+POPULARITY_HALF_LIFE_DAYS = 7
+# События старше окна весят меньше 1/256 и не учитываются
+POPULARITY_WINDOW_DAYS = 60
+VIEW_WEIGHT = 1
+ORDER_WEIGHT = 20
+REVIEW_WEIGHT = 10
+# Каждая звезда выше или ниже 3 меняет оценку на 10%
+RATING_WEIGHT = 0.1
+NEUTRAL_RATING = 3
+POPULARITY_WATERMARK_KEY = 'popularity:watermark'
+
+
+class PopularityService:
+    """Расчет и обновление popularity_score"""
+
+    @staticmethod
+    def decay(day, today):
+        """Вес события дня day на дату today"""
+        return 2 ** ((day - today).days / POPULARITY_HALF_LIFE_DAYS)
+
+    @staticmethod
+    def score(activity, rating=0, reviews_count=0, today=None):
+        """
+        Оценка популярности в опорной форме
+
+        Args:
+            activity: Взвешенная сумма событий с затуханием на дату today
+            rating: Средний рейтинг товара (учитывается, если есть отзывы)
+        """
+        if activity <= 0:
+            return 0.0
+        today = today or timezone.localdate()
+        if reviews_count:
+            activity *= 1 + RATING_WEIGHT * (float(rating) - NEUTRAL_RATING)
+        return math.log2(activity) + (today - POPULARITY_EPOCH).days / POPULARITY_HALF_LIFE_DAYS
+
+    @staticmethod
+    def get_activity(product_ids, today=None):
+        """
+        Взвешенная активность товаров за окно POPULARITY_WINDOW_DAYS
+
+        Тремя агрегирующими запросами: просмотры по дням, купленные единицы
+        и отзывы по дням создания (отмененные заказы не учитываются).
+
+        Returns:
+            dict: {product_id: активность}
+        """
+        today = today or timezone.localdate()
+        start = today - timedelta(days=POPULARITY_WINDOW_DAYS)
+        since = timezone.make_aware(datetime.combine(start, time.min))
+        activity = defaultdict(float)
+
+        views = ProductDailyViews.objects.filter(
+            product_id__in=product_ids, date__gt=start,
+        ).values_list('product_id', 'date', 'views')
+        for product_id, day, count in views:
+            activity[product_id] += VIEW_WEIGHT * count * PopularityService.decay(day, today)
+
+        orders = OrderItem.objects.filter(
+            product_id__in=product_ids, order__created_at__gte=since,
+        ).exclude(order__status='cancelled').annotate(
+            day=TruncDate('order__created_at'),
+        ).values('product_id', 'day').annotate(units=Sum('quantity')).values_list('product_id', 'day', 'units')
+        for product_id, day, units in orders:
+            activity[product_id] += ORDER_WEIGHT * units * PopularityService.decay(day, today)
+
+        reviews = Review.objects.filter(
+            product_id__in=product_ids, created_at__gte=since, is_moderated=True,
+        ).annotate(
+            day=TruncDate('created_at'),
+        ).values('product_id', 'day').annotate(total=Count('id')).values_list('product_id', 'day', 'total')
+        for product_id, day, total in reviews:
+            activity[product_id] += REVIEW_WEIGHT * total * PopularityService.decay(day, today)
+        return activity
+
+    @staticmethod
+    def get_changed_products(since):
+        """Товары с просмотрами, заказами или отзывами после момента since"""
+        product_ids = set(
+            ProductDailyViews.objects.filter(date__gte=timezone.localdate(since)).values_list('product_id', flat=True)
+        )
+        product_ids.update(
+            OrderItem.objects.filter(order__created_at__gte=since).values_list('product_id', flat=True)
+        )
+        product_ids.update(
+            Review.objects.filter(created_at__gte=since).values_list('product_id', flat=True)
+        )
+        return product_ids
+
+    @staticmethod
+    def update(full=False, batch_size=500):
+        """
+        Пересчитывает popularity_score
+
+        Без full пересчитываются только товары с событиями после прошлого
+        прохода; если отметка прошлого прохода потеряна — все товары.
+
+        Returns:
+            int: Количество пересчитанных товаров
+        """
+        started = timezone.now()
+        since = None if full else cache.get(POPULARITY_WATERMARK_KEY)
+        if since is None:
+            product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        else:
+            product_ids = sorted(PopularityService.get_changed_products(since))
+
+        for offset in range(0, len(product_ids), batch_size):
+            PopularityService.refresh_products(product_ids[offset:offset + batch_size])
+        cache.set(POPULARITY_WATERMARK_KEY, started, None)
+        logger.info('Пересчитана популярность товаров: %s', len(product_ids))
+        return len(product_ids)
+
+    @staticmethod
+    def refresh_products(product_ids):
+        """Пересчитывает оценку пачки товаров и переносит ее в карточки каталога"""
+        today = timezone.localdate()
+        activity = PopularityService.get_activity(product_ids, today)
+        products = list(Product.objects.filter(pk__in=product_ids).only('pk', 'rating', 'reviews_count'))
+        for product in products:
+            product.popularity_score = PopularityService.score(
+                activity.get(product.pk, 0), product.rating, product.reviews_count, today,
+            )
+        with transaction.atomic():
+            Product.objects.bulk_update(products, ['popularity_score'], batch_size=500)
+            ProductListing.objects.filter(product_id__in=product_ids).update(popularity_score=Subquery(
+                Product.objects.filter(pk=OuterRef('product_id')).values('popularity_score')[:1]
+            ))
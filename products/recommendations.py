@@ -0,0 +1,102 @@
+"""
+Рекомендации для корзины и оформления заказа
+
+Кандидаты берутся из двух источников, оба подготовлены заранее:
+похожие товары (RelatedProduct — в том числе совместные покупки) для
+товаров корзины и общий пул в кэше — популярные товары плюс случайная
+выборка каталога. Пул обновляет только периодическая задача, поэтому на
+странице корзины нет сортировки ORDER BY RANDOM() по всей таблице:
+выбор из пула стоит O(limit), а товары догружаются одним запросом по id.
+Пока пула нет в кэше, рекомендации строятся только из похожих товаров, а
+пересборка ставится в очередь.
+"""
+import logging
+import random
+
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+from .models import Product, RelatedProduct
+from .search.rebuild import schedule_rebuild
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_POOL_KEY = 'recommendations:pool'
+RECOMMENDATION_POOL_POPULAR = 100
+RECOMMENDATION_POOL_RANDOM = 100
+# Из корзины берется не больше стольких товаров для поиска похожих
+RECOMMENDATION_SEED_LIMIT = 20
+
+
+class RecommendationPoolService:
+    """Пул кандидатов в рекомендации и выбор из него"""
+
+    @staticmethod
+    def refresh():
+        """
+        Пересобирает пул: популярные товары в наличии и случайная выборка по id
+
+        Случайная выборка — это случайные id из диапазона первичного ключа,
+        проверенные одним запросом, а не сортировка всей таблицы.
+
+        Returns:
+            int: Размер пула
+        """
+        available = Product.objects.filter(is_active=True, stock_quantity__gt=0)
+        pool = list(
+            available.order_by('-popularity_score', 'id').values_list('pk', flat=True)[:RECOMMENDATION_POOL_POPULAR]
+        )
+        bounds = available.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is not None:
+            span = bounds['high'] - bounds['low'] + 1
+            candidates = random.sample(range(bounds['low'], bounds['high'] + 1), min(span, RECOMMENDATION_POOL_RANDOM * 3))
+            chosen = set(pool)
+            pool.extend(
+                product_id for product_id in available.filter(pk__in=candidates).values_list('pk', flat=True)[:RECOMMENDATION_POOL_RANDOM]
+                if product_id not in chosen
+            )
+        cache.set(RECOMMENDATION_POOL_KEY, pool, None)
+        logger.info('Обновлен пул рекомендаций: %s товаров', len(pool))
+        return len(pool)
+
+    @staticmethod
+    def get_pool():
+        """Пул из кэша; при промахе — пустой, а пересборка ставится в очередь"""
+        pool = cache.get(RECOMMENDATION_POOL_KEY)
+        if pool is None:
+            schedule_rebuild('refresh_recommendation_pool')
+            return []
+        return pool
+
+    @staticmethod
+    def sample(pool, exclude, limit):
+        """Случайные limit id из пула, кроме exclude"""
+        count = min(len(pool), limit + len(exclude))
+        return [product_id for product_id in random.sample(pool, count) if product_id not in exclude][:limit]
+
+    @staticmethod
+    def draw(cart_product_ids, limit=12):
+        """
+        Рекомендованные товары, которых еще нет в корзине
+
+        Сначала похожие на товары корзины, затем случайные из пула.
+
+        Args:
+            cart_product_ids: id товаров корзины
+        """
+        exclude = set(cart_product_ids)
+        chosen = []
+        if exclude:
+            seeds = sorted(exclude)[:RECOMMENDATION_SEED_LIMIT]
+            related = RelatedProduct.objects.filter(product_id__in=seeds).order_by('position').values_list('related_id', flat=True)
+            for product_id in related:
+                if product_id not in exclude:
+                    exclude.add(product_id)
+                    chosen.append(product_id)
+                    if len(chosen) >= limit:
+                        break
+        if len(chosen) < limit:
+            chosen.extend(RecommendationPoolService.sample(RecommendationPoolService.get_pool(), exclude, limit - len(chosen)))
+
+        products = Product.objects.filter(pk__in=chosen, is_active=True).select_related('category', 'seller').prefetch_related('images').in_bulk()
+        return [products[product_id] for product_id in chosen if product_id in products]
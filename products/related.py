@@ -0,0 +1,178 @@
+"""
+Похожие товары для страницы товара
+
+Список похожих рассчитывается заранее фоновой задачей и хранится в
+таблице RelatedProduct, поэтому страница товара получает его одним
+запросом по индексу (product, position).
+
+Сходство двух товаров — сумма косинусных мер по нескольким сигналам:
+совместные покупки (товары одного заказа), совместное избранное (товары
+одного пользователя), общие теги и общие значения характеристик. Товары
+той же категории получают надбавку; если кандидатов меньше
+RELATED_PRODUCTS_LIMIT, список добирается популярными товарами категории.
+"""
+import logging
+import math
+from collections import Counter, defaultdict
+from itertools import permutations
+
+from django.db import transaction
+
+from .models import Favorite, OrderItem, Product, ProductCharacteristic, RelatedProduct, User
+
+logger = logging.getLogger(__name__)
+
+RELATED_PRODUCTS_LIMIT = 12
+CO_PURCHASE_WEIGHT = 3
+CO_FAVORITE_WEIGHT = 2
+TAG_WEIGHT = 1
+CHARACTERISTIC_WEIGHT = 0.5
+SAME_CATEGORY_BONUS = 0.5
+# Группы больше этого размера (оптовый заказ, слишком общий тег) не сравниваются попарно
+MAX_GROUP_SIZE = 200
+
+
+class RelatedProductService:
+    """Расчет и чтение похожих товаров"""
+
+    @staticmethod
+    def get_related(product, limit=RELATED_PRODUCTS_LIMIT):
+        """
+        Похожие активные товары в порядке убывания сходства
+
+        Если список для товара еще не рассчитан, возвращаются популярные
+        товары той же категории.
+        """
+        queryset = Product.objects.filter(is_active=True).select_related('category', 'seller').prefetch_related('images')
+        related = list(
+            queryset.filter(related_from__product_id=product.pk).order_by('related_from__position')[:limit]
+        )
+        if related:
+            return related
+        return list(
+            queryset.filter(category_id=product.category_id).exclude(pk=product.pk).order_by('-popularity_score', 'id')[:limit]
+        )
+
+    @staticmethod
+    def add_cooccurrence(scores, groups, weight, allowed=None):
+        """
+        Добавляет косинусное сходство товаров, встречающихся в одних группах
+
+        Args:
+            scores: {product_id: Counter({product_id: сходство})}, дополняется на месте
+            groups: Итерируемое множеств id товаров (заказы, избранное пользователя, теги)
+            weight: Вес сигнала
+            allowed: Множество допустимых товаров (остальные отбрасываются)
+        """
+        frequency = Counter()
+        pairs = defaultdict(Counter)
+        for group in groups:
+            if allowed is not None:
+                group = group & allowed
+            if len(group) < 2 or len(group) > MAX_GROUP_SIZE:
+                continue
+            frequency.update(group)
+            for first, second in permutations(group, 2):
+                pairs[first][second] += 1
+        for first, counts in pairs.items():
+            for second, together in counts.items():
+                scores[first][second] += weight * together / math.sqrt(frequency[first] * frequency[second])
+
+    @staticmethod
+    def get_groups(rows):
+        """Группирует пары (ключ группы, id товара) в множества товаров"""
+        groups = defaultdict(set)
+        for key, product_id in rows:
+            groups[key].add(product_id)
+        return groups.values()
+
+    @staticmethod
+    def compute(limit=RELATED_PRODUCTS_LIMIT):
+        """
+        Рассчитывает похожие товары для всех активных товаров
+
+        Returns:
+            dict: {product_id: [(id похожего товара, сходство), ...]}
+        """
+        products = {
+            product_id: (category_id, popularity)
+            for product_id, category_id, popularity in Product.objects.filter(is_active=True).values_list(
+                'pk', 'category_id', 'popularity_score',
+            )
+        }
+        allowed = set(products)
+        scores = defaultdict(Counter)
+
+        baskets = OrderItem.objects.exclude(order__status='cancelled').values_list('order_id', 'product_id')
+        RelatedProductService.add_cooccurrence(
+            scores, RelatedProductService.get_groups(baskets), CO_PURCHASE_WEIGHT, allowed,
+        )
+
+        # Избранное хранится и в модели Favorite, и в User.favorites
+        favorites = list(Favorite.objects.values_list('user_id', 'product_id'))
+        favorites.extend(User.favorites.through.objects.values_list('user_id', 'product_id'))
+        RelatedProductService.add_cooccurrence(
+            scores, RelatedProductService.get_groups(favorites), CO_FAVORITE_WEIGHT, allowed,
+        )
+
+        tags = Product.tags.through.objects.values_list('tag_id', 'product_id')
+        RelatedProductService.add_cooccurrence(
+            scores, RelatedProductService.get_groups(tags), TAG_WEIGHT, allowed,
+        )
+
+        characteristics = (
+            ((name.strip().lower(), value.strip().lower()), product_id)
+            for product_id, name, value in ProductCharacteristic.objects.values_list('product_id', 'name', 'value')
+        )
+        RelatedProductService.add_cooccurrence(
+            scores, RelatedProductService.get_groups(characteristics), CHARACTERISTIC_WEIGHT, allowed,
+        )
+
+        by_category = defaultdict(list)
+        for product_id, (category_id, popularity) in products.items():
+            by_category[category_id].append((-popularity, product_id))
+        category_top = {
+            category_id: [product_id for _popularity, product_id in sorted(items)[:limit + 1]]
+            for category_id, items in by_category.items()
+        }
+
+        result = {}
+        for product_id, (category_id, _popularity) in products.items():
+            candidates = scores.get(product_id, Counter())
+            for other_id in candidates:
+                if products[other_id][0] == category_id:
+                    candidates[other_id] *= 1 + SAME_CATEGORY_BONUS
+            related = candidates.most_common(limit)
+            if len(related) < limit:
+                chosen = {other_id for other_id, _score in related}
+                chosen.add(product_id)
+                related.extend(
+                    (other_id, 0.0) for other_id in category_top[category_id] if other_id not in chosen
+                )
+                related = related[:limit]
+            result[product_id] = related
+        return result
+
+    @staticmethod
+    def rebuild(batch_size=500):
+        """
+        Пересобирает таблицу RelatedProduct
+
+        Returns:
+            int: Количество товаров, для которых записаны похожие
+        """
+        related = RelatedProductService.compute()
+        product_ids = sorted(related)
+        for offset in range(0, len(product_ids), batch_size):
+            batch = product_ids[offset:offset + batch_size]
+            rows = [
+                RelatedProduct(product_id=product_id, related_id=other_id, position=position, score=score)
+                for product_id in batch
+                for position, (other_id, score) in enumerate(related[product_id])
+            ]
+            with transaction.atomic():
+                RelatedProduct.objects.filter(product_id__in=batch).delete()
+                RelatedProduct.objects.bulk_create(rows, batch_size=1000)
+        RelatedProduct.objects.filter(product__is_active=False).delete()
+        logger.info('Пересчитаны похожие товары: %s', len(product_ids))
+        return len(product_ids)
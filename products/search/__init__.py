@@ -0,0 +1,6 @@
+"""
+Полнотекстовый поиск товаров: анализ текста, инвертированный индекс и бэкенды
+"""
+from .backends import get_search_backend
+
+__all__ = ['get_search_backend']
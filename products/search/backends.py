@@ -0,0 +1,231 @@
+"""
+Бэкенды поиска товаров
+
+Бэкенд выбирается настройкой SEARCH_BACKEND. Все бэкенды умеют сузить
+QuerySet товаров (Product или ProductListing) до найденных и упорядочить
+его по релевантности, поэтому представления не зависят от того, где
+хранится индекс. Перед поиском запрос проходит исправление раскладки,
+транслита и опечаток (rewrite.py).
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Q, Value, When
+
+from ..models import Product, ProductCharacteristic, Tag
+from .index import DiskIndex
+from .rewrite import QueryRewriteService
+from .text import analyze, stem
+
+logger = logging.getLogger(__name__)
+
+# Сколько лучших совпадений индекса ранжируется (rank)
+SEARCH_MAX_RESULTS = 500
+# Больше совпадений filter не передает в базу списком id (IN с тысячами
+# параметров медленный и упирается в лимит переменных SQLite): такой
+# широкий запрос фильтрует DatabaseSearchBackend
+SEARCH_FILTER_MAX_IDS = 900
+
+# Вес полей товара в документе индекса
+FIELD_WEIGHTS = {
+    'name': 3,
+    'brand': 2,
+    'tags': 2,
+    'characteristics': 1,
+    'description': 1,
+}
+
+
+class BaseSearchBackend:
+    """Интерфейс бэкенда поиска"""
+
+    def filter(self, queryset, query, ref='pk'):
+        """Оставляет в queryset только товары, подходящие под запрос"""
+        raise NotImplementedError
+
+    def rank(self, queryset, query, ref='pk'):
+        """Как filter, но упорядочивает результат по релевантности"""
+        return self.filter(queryset, query, ref)
+
+    def rewrite(self, query, known=None):
+        """Исправляет раскладку, транслит и опечатки в запросе (настройка SEARCH_QUERY_REWRITE)"""
+        if not query or not getattr(settings, 'SEARCH_QUERY_REWRITE', True):
+            return query
+        return QueryRewriteService.rewrite(query, known)
+
+    def update_products(self, product_ids):
+        """Переиндексирует товары после изменения"""
+
+    def rebuild(self, batch_size=1000):
+        """Полностью пересобирает индекс"""
+        return 0
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """Поиск средствами базы: search_vector в PostgreSQL, иначе EXISTS по переводам, тегам и бренду"""
+
+    def filter(self, queryset, query, ref='pk'):
+        query = self.rewrite(query)
+        translation_model = Product._parler_meta.root_model
+        tag_translation_model = Tag._parler_meta.root_model
+        in_translations = Exists(translation_model.objects.filter(
+            Q(name__icontains=query) | Q(description__icontains=query),
+            master_id=OuterRef(ref),
+        ))
+        in_tags = Exists(Product.tags.through.objects.filter(
+            product_id=OuterRef(ref),
+            tag_id__in=tag_translation_model.objects.filter(name__icontains=query).values('master_id'),
+        ))
+        return queryset.filter(in_translations | in_tags | Q(brand__icontains=query))
+
+    def rank(self, queryset, query, ref='pk'):
+        if queryset.model is Product and 'postgresql' in settings.DATABASES['default']['ENGINE']:
+            from django.contrib.postgres.search import SearchQuery, SearchRank
+            search_query = SearchQuery(self.rewrite(query))
+            return queryset.annotate(
+                rank=SearchRank(F('search_vector'), search_query)
+            ).filter(search_vector=search_query).order_by('-rank')
+        return self.filter(queryset, query, ref)
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    Поиск по локальному инвертированному индексу с ранжированием BM25
+
+    Пока индекс не собран (нет снимка на диске), запросы обслуживает
+    DatabaseSearchBackend.
+    """
+
+    def __init__(self, path=None):
+        self.disk = DiskIndex(path or settings.SEARCH_INDEX_DIR)
+        self.fallback = DatabaseSearchBackend()
+        self._lock = threading.Lock()
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """Id товаров по убыванию релевантности или None, если индекс не собран"""
+        with self._lock:
+            index = self.disk.sync()
+            if index is None:
+                return None
+        terms = self.analyze(index, query)
+        with self._lock:
+            return [product_id for product_id, _score in index.search(terms, limit)]
+
+    def match(self, query):
+        """Id всех подходящих товаров без ранжирования или None, если индекс не собран"""
+        with self._lock:
+            index = self.disk.sync()
+            if index is None:
+                return None
+        terms = self.analyze(index, query)
+        with self._lock:
+            return index.match(terms)
+
+    def analyze(self, index, query):
+        """Термы запроса после исправления раскладки, транслита и опечаток"""
+        # Слова, уже попавшие в индекс, не исправляются, даже если словарь еще не обновился
+        return analyze(self.rewrite(query, known=lambda token: stem(token) in index.postings))
+
+    def filter(self, queryset, query, ref='pk'):
+        # Фильтр не ограничен SEARCH_MAX_RESULTS: остальные условия (категория,
+        # цена, бренд) могут отсечь лучшие по релевантности товары. Запрос,
+        # под который подходит больше SEARCH_FILTER_MAX_IDS товаров, фильтрует база
+        product_ids = self.match(query)
+        if product_ids is None or len(product_ids) > SEARCH_FILTER_MAX_IDS:
+            return self.fallback.filter(queryset, query, ref)
+        return queryset.filter(**{f'{ref}__in': product_ids})
+
+    def rank(self, queryset, query, ref='pk'):
+        product_ids = self.search(query)
+        if product_ids is None:
+            return self.fallback.rank(queryset, query, ref)
+        if not product_ids:
+            return queryset.none()
+        return queryset.filter(**{f'{ref}__in': product_ids}).annotate(
+            search_rank=Case(
+                *[When(**{ref: product_id}, then=Value(position)) for position, product_id in enumerate(product_ids)],
+                output_field=IntegerField(),
+            )
+        ).order_by('search_rank')
+
+    def update_products(self, product_ids):
+        product_ids = {product_id for product_id in product_ids if product_id}
+        if not product_ids or not self.disk.exists():
+            return
+        documents = self.build_documents(product_ids)
+        with self._lock:
+            self.disk.append({product_id: documents.get(product_id) for product_id in product_ids})
+
+    def rebuild(self, batch_size=1000):
+        with self._lock:
+            since = self.disk.begin_build()
+        product_ids = list(Product.objects.filter(is_active=True).order_by('pk').values_list('pk', flat=True))
+        documents = {}
+        for start in range(0, len(product_ids), batch_size):
+            documents.update(self.build_documents(product_ids[start:start + batch_size]))
+        with self._lock:
+            self.disk.write_snapshot(documents, since)
+        logger.info('Поисковый индекс пересобран: %s товаров', len(documents))
+        return len(documents)
+
+    @staticmethod
+    def build_documents(product_ids):
+        """
+        Термы активных товаров: название и описание на всех языках, бренд,
+        теги и характеристики; частота терма умножается на вес поля
+
+        Returns:
+            dict: {product_id: {терм: взвешенная частота}}
+        """
+        fields = {}
+        for product_id, brand in Product.objects.filter(pk__in=product_ids, is_active=True).values_list('pk', 'brand'):
+            fields[product_id] = {name: [] for name in FIELD_WEIGHTS}
+            fields[product_id]['brand'].append(brand)
+        if not fields:
+            return {}
+
+        translations = Product._parler_meta.root_model.objects.filter(master_id__in=fields)
+        for product_id, name, description in translations.values_list('master_id', 'name', 'description'):
+            fields[product_id]['name'].append(name)
+            fields[product_id]['description'].append(description)
+        product_tags = list(Product.tags.through.objects.filter(product_id__in=fields).values_list('product_id', 'tag_id'))
+        tag_names = defaultdict(list)
+        for tag_id, name in Tag._parler_meta.root_model.objects.filter(
+            master_id__in={tag_id for _product_id, tag_id in product_tags}
+        ).values_list('master_id', 'name'):
+            tag_names[tag_id].append(name)
+        for product_id, tag_id in product_tags:
+            fields[product_id]['tags'].extend(tag_names[tag_id])
+        for product_id, name, value in ProductCharacteristic.objects.filter(
+            product_id__in=fields
+        ).values_list('product_id', 'name', 'value'):
+            fields[product_id]['characteristics'].append(f'{name} {value}')
+
+        documents = {}
+        for product_id, texts in fields.items():
+            terms = {}
+            for field, values in texts.items():
+                weight = FIELD_WEIGHTS[field]
+                # Одинаковые тексты разных языков (например, название модели) учитываются один раз
+                for term in analyze(' '.join(dict.fromkeys(value for value in values if value))):
+                    terms[term] = terms.get(term, 0) + weight
+            documents[product_id] = terms
+        return documents
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    """Экземпляр бэкенда из настройки SEARCH_BACKEND (один на процесс)"""
+    global _backend
+    if _backend is None:
+        from django.utils.module_loading import import_string
+        with _backend_lock:
+            if _backend is None:
+                backend_path = getattr(settings, 'SEARCH_BACKEND', 'products.search.backends.DatabaseSearchBackend')
+                _backend = import_string(backend_path)()
+    return _backend
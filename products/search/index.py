@@ -0,0 +1,263 @@
+"""
+Инвертированный индекс товаров с ранжированием BM25 и хранением на диске
+
+На диске индекс состоит из снимка (snapshot.pickle) и журнала изменений
+(journal-<поколение>.log). Каждая запись журнала — полный набор термов
+одного товара (или удаление), поэтому повторное применение безопасно.
+Процессы держат индекс в памяти и при каждом поиске дочитывают только
+новые записи журнала; пересборка пишет новый снимок с новым поколением
+и начинает новый журнал.
+"""
+import logging
+import math
+import os
+import pickle
+import struct
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = 'snapshot.pickle'
+JOURNAL_NAME = 'journal-{generation}.log'
+RECORD_HEADER = struct.Struct('>I')
+INDEX_LOCK_KEY = 'search_index:lock'
+INDEX_LOCK_TIMEOUT = 60
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class InvertedIndex:
+    """Индекс в памяти: термы документов и списки вхождений"""
+
+    def __init__(self, documents=None):
+        self.documents = {}
+        self.lengths = {}
+        self.postings = defaultdict(dict)
+        self.total_length = 0
+        for product_id, terms in (documents or {}).items():
+            self.put(product_id, terms)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def put(self, product_id, terms):
+        """Добавляет или заменяет документ; terms — {терм: взвешенная частота}"""
+        self.remove(product_id)
+        if not terms:
+            return
+        self.documents[product_id] = terms
+        self.lengths[product_id] = sum(terms.values())
+        self.total_length += self.lengths[product_id]
+        for term, frequency in terms.items():
+            self.postings[term][product_id] = frequency
+
+    def remove(self, product_id):
+        terms = self.documents.pop(product_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.lengths.pop(product_id)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(product_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, terms, limit=None):
+        """
+        Ранжирует документы по BM25
+
+        Сначала ищутся документы со всеми термами запроса; если таких нет,
+        подходят документы хотя бы с одним термом.
+
+        Returns:
+            list: [(product_id, score), ...] по убыванию релевантности
+        """
+        postings, candidates = self._candidates(terms)
+        if not candidates:
+            return []
+
+        total = len(self.documents)
+        average_length = self.total_length / total if total else 1
+        scores = {}
+        for posting in postings:
+            idf = math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for product_id in candidates.intersection(posting):
+                frequency = posting[product_id]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[product_id] / average_length)
+                scores[product_id] = scores.get(product_id, 0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+    def match(self, terms):
+        """Все документы, подходящие под запрос (по тем же правилам, что search), без ранжирования"""
+        return self._candidates(terms)[1]
+
+    def _candidates(self, terms):
+        """Списки вхождений термов запроса и документы со всеми термами (или хотя бы с одним)"""
+        terms = [term for term in dict.fromkeys(terms) if term in self.postings]
+        if not terms:
+            return [], set()
+        postings = sorted((self.postings[term] for term in terms), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting.keys()
+        if not candidates:
+            candidates = set().union(*postings)
+        return postings, candidates
+
+
+class DiskIndex:
+    """Снимок и журнал индекса в каталоге path, загруженные в память процесса"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.index = None
+        self.generation = None
+        self.snapshot_stamp = None
+        self.journal_offset = 0
+
+    @property
+    def snapshot_path(self):
+        return self.path / SNAPSHOT_NAME
+
+    def journal_path(self, generation=None):
+        return self.path / JOURNAL_NAME.format(generation=generation or self.generation)
+
+    def exists(self):
+        return self.snapshot_path.exists()
+
+    def sync(self):
+        """Подтягивает изменения с диска: новый снимок целиком или хвост журнала"""
+        try:
+            stat = self.snapshot_path.stat()
+        except FileNotFoundError:
+            self.index = None
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self.snapshot_stamp:
+            with open(self.snapshot_path, 'rb') as snapshot:
+                data = pickle.load(snapshot)
+            self.index = InvertedIndex(data['documents'])
+            self.generation = data['generation']
+            self.snapshot_stamp = stamp
+            self.journal_offset = 0
+        self._replay()
+        return self.index
+
+    def append(self, changes):
+        """Записывает изменения документов в журнал; changes — {product_id: terms или None}"""
+        if not changes:
+            return
+        payload = b''.join(
+            RECORD_HEADER.pack(len(record)) + record
+            for record in (pickle.dumps(change, pickle.HIGHEST_PROTOCOL) for change in changes.items())
+        )
+        with self.lock():
+            if self.sync() is None:
+                return
+            with open(self.journal_path(), 'ab') as journal:
+                journal.write(payload)
+        self._replay()
+
+    def begin_build(self):
+        """Позиция журнала перед чтением базы для пересборки (передается в write_snapshot)"""
+        self.sync()
+        return self.generation, self.journal_offset
+
+    def write_snapshot(self, documents, since=None):
+        """
+        Атомарно заменяет снимок новым поколением
+
+        Записи журнала, появившиеся после позиции since (из begin_build),
+        применяются поверх собранных документов, чтобы изменения во время
+        пересборки не потерялись.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        generation = uuid.uuid4().hex
+        with self.lock():
+            if since and self.sync() is not None and since[0] == self.generation:
+                for _offset, (product_id, terms) in self._read_journal(self.journal_path(), since[1]):
+                    if terms:
+                        documents[product_id] = terms
+                    else:
+                        documents.pop(product_id, None)
+            tmp_path = self.path / f'{SNAPSHOT_NAME}.{generation}.tmp'
+            with open(tmp_path, 'wb') as snapshot:
+                pickle.dump({'generation': generation, 'documents': documents}, snapshot, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+            for journal in self.path.glob(JOURNAL_NAME.format(generation='*')):
+                journal.unlink(missing_ok=True)
+        self.sync()
+
+    def lock(self):
+        return _CacheLock(INDEX_LOCK_KEY, INDEX_LOCK_TIMEOUT)
+
+    def _replay(self):
+        if self.index is None:
+            return
+        for offset, (product_id, terms) in self._read_journal(self.journal_path(), self.journal_offset):
+            self.index.put(product_id, terms)
+            self.journal_offset = offset
+
+    def _read_journal(self, path, offset):
+        try:
+            journal = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with journal:
+            journal.seek(offset)
+            while True:
+                header = journal.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                (size,) = RECORD_HEADER.unpack(header)
+                record = journal.read(size)
+                if len(record) < size:
+                    # Запись еще дописывается другим процессом
+                    break
+                offset += RECORD_HEADER.size + size
+                yield offset, pickle.loads(record)
+
+
+class IndexLockTimeout(Exception):
+    """Блокировку поискового индекса держит другой процесс дольше INDEX_LOCK_TIMEOUT"""
+
+
+class _CacheLock:
+    """
+    Межпроцессная блокировка через cache.add (как в кэше страниц)
+
+    Значение ключа — случайный токен владельца: снимает блокировку только
+    тот, кто ее взял. Если ее не удалось взять за timeout, запись не
+    выполняется (IndexLockTimeout) — товары останутся в очереди индексации
+    до следующего прохода.
+    """
+
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+        self.owner = uuid.uuid4().hex
+        self.acquired = False
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while not cache.add(self.key, self.owner, self.timeout):
+            if time.monotonic() > deadline:
+                raise IndexLockTimeout(f'Не дождались блокировки поискового индекса {self.key}')
+            time.sleep(0.05)
+        self.acquired = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.acquired and cache.get(self.key) == self.owner:
+            cache.delete(self.key)
+        self.acquired = False
@@ -0,0 +1,141 @@
+"""
+Отложенное обновление поиска: очередь измененных товаров
+
+Сигналы только отмечают товар в таблице SearchIndexQueue (в той же
+транзакции, что и само изменение). Фоновая задача раз в несколько секунд
+забирает очередь пачками и для каждой пачки одним UPDATE пересчитывает
+search_vector (PostgreSQL) и одной записью журнала обновляет локальный
+индекс SEARCH_BACKEND. Массовые импорты отключают отметки и в конце
+пересобирают поиск целиком.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import Product, SearchIndexQueue
+from .backends import get_search_backend
+from .results import SearchResultCache
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+class SearchIndexQueueService:
+    """Очередь переиндексации и пакетное обновление поиска"""
+
+    @staticmethod
+    def is_suspended():
+        return getattr(_state, 'suspended', 0) > 0
+
+    @staticmethod
+    def mark_dirty(product_ids):
+        """Ставит товары в очередь (повторная отметка только обновляет время)"""
+        if SearchIndexQueueService.is_suspended():
+            return
+        product_ids = {product_id for product_id in product_ids if product_id}
+        if not product_ids:
+            return
+        now = timezone.now()
+        SearchIndexQueue.objects.bulk_create(
+            [SearchIndexQueue(product_id=product_id, queued_at=now) for product_id in product_ids],
+            update_conflicts=True,
+            unique_fields=['product_id'],
+            update_fields=['queued_at'],
+        )
+
+    @staticmethod
+    def process(batch_size=500):
+        """
+        Обрабатывает всю очередь пачками
+
+        Строки удаляются, только если товар не был отмечен повторно во время
+        обработки, иначе он останется в очереди до следующего прохода.
+        """
+        processed = 0
+        while True:
+            started = timezone.now()
+            product_ids = list(
+                SearchIndexQueue.objects.filter(queued_at__lte=started)
+                .order_by('queued_at').values_list('product_id', flat=True)[:batch_size]
+            )
+            if not product_ids:
+                break
+            SearchIndexQueueService.refresh_products(product_ids)
+            SearchIndexQueue.objects.filter(product_id__in=product_ids, queued_at__lte=started).delete()
+            processed += len(product_ids)
+        if processed:
+            # Индекс догнал изменения — выдача, собранная по старому индексу, больше не нужна
+            SearchResultCache.invalidate()
+            logger.info('Переиндексировано товаров из очереди: %s', processed)
+        return processed
+
+    @staticmethod
+    def refresh_products(product_ids):
+        """Обновляет search_vector и поисковый индекс для пачки товаров"""
+        SearchIndexQueueService.update_search_vectors(product_ids)
+        get_search_backend().update_products(product_ids)
+
+    @staticmethod
+    def update_search_vectors(product_ids=None):
+        """
+        Пересчитывает Product.search_vector одним UPDATE (только PostgreSQL)
+
+        Название и описание лежат в таблице переводов, поэтому вектор
+        собирается из всех переводов товара: названия с весом A, описания — B.
+        """
+        if 'postgresql' not in settings.DATABASES['default']['ENGINE']:
+            return 0
+        from django.contrib.postgres.aggregates import StringAgg
+        from django.contrib.postgres.search import SearchVector
+
+        translations = Product._parler_meta.root_model.objects.filter(master_id=OuterRef('pk')).order_by().values('master_id')
+
+        def joined(field):
+            return Coalesce(
+                Subquery(translations.annotate(text=StringAgg(field, ' ')).values('text')[:1]),
+                Value(''),
+            )
+
+        queryset = Product.objects.all()
+        if product_ids is not None:
+            queryset = queryset.filter(pk__in=product_ids)
+        return queryset.update(
+            search_vector=SearchVector(joined('name'), weight='A')
+            + SearchVector(joined('description'), weight='B')
+            + SearchVector('brand', weight='B')
+        )
+
+    @staticmethod
+    def rebuild(batch_size=1000):
+        """Полная пересборка: очередь очищается, векторы и индекс пересчитываются для всех товаров"""
+        SearchIndexQueue.objects.filter(queued_at__lte=timezone.now()).delete()
+        SearchIndexQueueService.update_search_vectors()
+        total = get_search_backend().rebuild(batch_size=batch_size)
+        SearchResultCache.invalidate()
+        return total
+
+    @staticmethod
+    @contextmanager
+    def suspended(rebuild=True):
+        """
+        Отключает отметки на время массового импорта в текущем потоке
+
+        Пример:
+            with SearchIndexQueueService.suspended():
+                ... создание тысяч товаров ...
+            # по выходе поиск пересобирается целиком
+        """
+        _state.suspended = getattr(_state, 'suspended', 0) + 1
+        try:
+            yield
+        finally:
+            _state.suspended -= 1
+        if rebuild and not SearchIndexQueueService.is_suspended():
+            total = SearchIndexQueueService.rebuild()
+            logger.info('Поиск пересобран после импорта: %s товаров', total)
@@ -0,0 +1,35 @@
+"""
+Фоновая пересборка поисковых структур (и пула рекомендаций), которых не
+оказалось в кэше
+
+Запрос пользователя не должен собирать индекс сам: при промахе кэша он
+обходится пустым результатом (или последней копией из памяти процесса), а
+сборка ставится в очередь Celery. Повторно задача ставится не чаще раза в
+timeout секунд, и отправка идет в отдельном потоке, чтобы недоступный
+брокер не задерживал ответ.
+"""
+import logging
+import threading
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+REBUILD_LOCK_KEY = 'search_rebuild_queued:{task}'
+
+
+def schedule_rebuild(task_name, timeout=60):
+    """Ставит задачу products.tasks.<task_name> в очередь, если она еще не поставлена"""
+    if not cache.add(REBUILD_LOCK_KEY.format(task=task_name), True, timeout):
+        return False
+    from .. import tasks
+
+    def send():
+        try:
+            getattr(tasks, task_name).delay()
+        except Exception:
+            logger.exception('Не удалось поставить в очередь задачу %s', task_name)
+            cache.delete(REBUILD_LOCK_KEY.format(task=task_name))
+
+    threading.Thread(target=send, daemon=True).start()
+    return True
@@ -0,0 +1,248 @@
+"""
+Кэш результатов поиска: упорядоченные списки id по нормализованному запросу
+
+Ключ строится из нормализованных параметров (запрос в нижнем регистре без
+лишних пробелов, фильтры после ProductQueryCompiler.clean, сортировка,
+язык), поэтому «Смартфон  samsung» и «смартфон Samsung» с теми же фильтрами
+попадают в одну запись. В кэше лежит только список id в порядке выдачи;
+страница вырезается из него и догружается одним запросом по id.
+
+Поиск без явно выбранной сортировки упорядочивается по релевантности:
+сначала лучшие совпадения в порядке ранжирования бэкенда (BM25), затем
+остальные совпадения по популярности (ranked_ids).
+
+Любое изменение каталога и каждая обработка очереди переиндексации
+увеличивают поколение — записи прошлых поколений больше не читаются.
+"""
+import hashlib
+import json
+import logging
+
+from django.core import signing
+from django.core.cache import cache
+from django.utils import translation
+
+from ..pagination import DEFAULT_SORT, SORT_ORDERS, InvalidCursor, KeysetPage, KeysetPaginator
+from .backends import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+SEARCH_RESULTS_GENERATION_KEY = 'search_results:generation'
+SEARCH_RESULTS_CACHE_KEY = 'search_results:{generation}:{digest}'
+SEARCH_RESULTS_TIMEOUT = 60 * 10
+
+CURSOR_SALT = 'products.search.results.cursor'
+# Ключ сортировки выдачи поиска по релевантности (в ключе кэша и курсоре)
+RELEVANCE_SORT = 'relevance'
+
+
+class SearchResultCache:
+    """Хранение и чтение упорядоченных списков id результатов поиска"""
+
+    @staticmethod
+    def get_generation():
+        """Текущее поколение кэша результатов"""
+        generation = cache.get(SEARCH_RESULTS_GENERATION_KEY)
+        if generation is None:
+            cache.add(SEARCH_RESULTS_GENERATION_KEY, 1, None)
+            generation = cache.get(SEARCH_RESULTS_GENERATION_KEY, 1)
+        return generation
+
+    @staticmethod
+    def invalidate():
+        """Делает все закэшированные результаты устаревшими"""
+        try:
+            cache.incr(SEARCH_RESULTS_GENERATION_KEY)
+        except ValueError:
+            cache.set(SEARCH_RESULTS_GENERATION_KEY, 2, None)
+
+    @staticmethod
+    def normalize_query(query):
+        """Запрос в нижнем регистре, слова через один пробел"""
+        return ' '.join(str(query or '').lower().split())
+
+    @staticmethod
+    def normalize(compiler, **extra):
+        """
+        Канонический набор параметров выдачи ProductQueryCompiler
+
+        Args:
+            compiler: ProductQueryCompiler с уже очищенными фильтрами
+            extra: Дополнительные части ключа (например, сортировка по релевантности)
+        """
+        params = {name: value for name, value in compiler.filters.items() if value not in (None, '', [], False)}
+        if 'q' in params:
+            params['q'] = SearchResultCache.normalize_query(params['q'])
+        for name in ('shops', 'tags'):
+            if name in params:
+                params[name] = sorted(set(params[name]))
+        params['sort'] = compiler.sort
+        if compiler.category is not None:
+            params['category_id'] = compiler.category.pk
+        params.update(extra)
+        return params
+
+    @staticmethod
+    def cache_key(model, params):
+        payload = json.dumps(
+            {'model': model._meta.label_lower, 'language': translation.get_language(), 'params': params},
+            sort_keys=True, default=str, ensure_ascii=False,
+        )
+        digest = hashlib.md5(payload.encode('utf-8')).hexdigest()
+        return SEARCH_RESULTS_CACHE_KEY.format(generation=SearchResultCache.get_generation(), digest=digest)
+
+    @staticmethod
+    def get_ids(model, params, build, ref='pk'):
+        """
+        Упорядоченные id товаров выдачи из кэша или одним запросом
+
+        Args:
+            model: Модель выдачи (часть ключа кэша)
+            params: Нормализованные параметры (ключ кэша)
+            build: Функция, возвращающая отфильтрованный и отсортированный QuerySet
+                (или готовый список id); вызывается только при промахе, так что
+                поиск и фильтры не выполняются
+            ref: Поле с id товара ('pk' для Product, 'product_id' для ProductListing)
+        """
+        key = SearchResultCache.cache_key(model, params)
+        ids = cache.get(key)
+        if ids is None:
+            # Список не обрезается: по его длине считаются количество и страницы выдачи
+            ids = build()
+            if not isinstance(ids, list):
+                ids = list(ids.values_list(ref, flat=True))
+            cache.set(key, ids, SEARCH_RESULTS_TIMEOUT)
+        return ids
+
+    @staticmethod
+    def results(params, build, base, ref='pk'):
+        """
+        Результаты поиска в виде последовательности для Paginator и пагинаторов DRF
+
+        Args:
+            base: QuerySet для догрузки страницы по id (select_related, prefetch_related)
+        """
+        ids = SearchResultCache.get_ids(base.model, params, build, ref)
+        return CachedResults(ids, base.order_by(), ref)
+
+    @staticmethod
+    def ranked_ids(queryset, compiler, ref='product_id'):
+        """
+        id выдачи поиска по релевантности
+
+        Сначала совпадения, ранжированные бэкендом (не больше
+        SEARCH_MAX_RESULTS), затем остальные совпадения по популярности, так
+        что товары за пределами ранжирования не пропадают из выдачи. Бэкенд
+        без ранжирования (поиск в базе не на PostgreSQL) дает порядок по
+        популярности.
+        """
+        ranked = get_search_backend().rank(compiler.filter(queryset, search=False), compiler.filters['q'], ref)
+        ids = list(ranked.values_list(ref, flat=True)) if ranked.query.order_by else []
+        seen = set(ids)
+        matches = compiler.filter(queryset).order_by(*SORT_ORDERS[DEFAULT_SORT]).values_list(ref, flat=True)
+        return ids + [product_id for product_id in matches if product_id not in seen]
+
+    @staticmethod
+    def search_results(queryset, compiler, ref='product_id'):
+        """Выдача поиска для Paginator: по релевантности или в порядке compiler.sort"""
+        if compiler.relevance_sort:
+            return SearchResultCache.results(
+                SearchResultCache.normalize(compiler, sort=RELEVANCE_SORT),
+                lambda: SearchResultCache.ranked_ids(queryset, compiler, ref),
+                queryset,
+                ref,
+            )
+        return SearchResultCache.results(
+            SearchResultCache.normalize(compiler), lambda: compiler.compile(queryset), queryset, ref,
+        )
+
+    @staticmethod
+    def paginator(queryset, compiler, per_page, sort=DEFAULT_SORT, ref='product_id'):
+        """
+        Пагинатор с интерфейсом KeysetPaginator: для поиска — по закэшированной выдаче
+
+        Args:
+            queryset: Карточки ProductListing без фильтров (их применяет compiler)
+            sort: Ключ из SORT_ORDERS — порядок тот же, что дал бы KeysetPaginator;
+                поиск без явной сортировки идет по релевантности (RELEVANCE_SORT)
+        """
+        if not compiler.filters['q']:
+            return KeysetPaginator(compiler.filter(queryset), per_page, sort)
+        if compiler.relevance_sort:
+            return CachedResultPaginator(SearchResultCache.search_results(queryset, compiler, ref), per_page, RELEVANCE_SORT)
+        results = SearchResultCache.results(
+            SearchResultCache.normalize(compiler, sort=sort),
+            lambda: KeysetPaginator(compiler.filter(queryset), per_page, sort).queryset,
+            queryset,
+            ref,
+        )
+        return CachedResultPaginator(results, per_page, sort)
+
+
+class CachedResults:
+    """
+    Список результатов по закэшированным id
+
+    Срез догружает объекты одним запросом и возвращает их в порядке id;
+    товары, удаленные после кэширования, пропускаются.
+    """
+
+    def __init__(self, ids, base, ref='pk'):
+        self.ids = ids
+        self.base = base
+        self.ref = ref
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.hydrate(self.ids[index])
+        objects = self.hydrate([self.ids[index]])
+        if not objects:
+            raise IndexError(index)
+        return objects[0]
+
+    def hydrate(self, ids):
+        if not ids:
+            return []
+        objects = {getattr(obj, self.ref): obj for obj in self.base.filter(**{f'{self.ref}__in': ids})}
+        return [objects[product_id] for product_id in ids if product_id in objects]
+
+
+class CachedResultPaginator:
+    """Постраничная выдача CachedResults с подписанным курсором-смещением"""
+
+    def __init__(self, results, per_page, sort):
+        self.results = results
+        self.per_page = per_page
+        self.sort = sort
+
+    @property
+    def count(self):
+        return len(self.results)
+
+    def get_page(self, cursor=None):
+        offset = self.decode_cursor(cursor) if cursor else 0
+        rows = self.results[offset:offset + self.per_page]
+        next_offset = offset + self.per_page
+        next_cursor = self.encode_cursor(next_offset) if next_offset < len(self.results) else None
+        return KeysetPage(rows, self, next_cursor)
+
+    def encode_cursor(self, offset):
+        return signing.dumps({'s': self.sort, 'o': offset}, salt=CURSOR_SALT)
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature as exc:
+            raise InvalidCursor(str(exc)) from exc
+        if not isinstance(payload, dict) or payload.get('s') != self.sort or not isinstance(payload.get('o'), int):
+            raise InvalidCursor('Cursor does not match sort order')
+        return max(payload['o'], 0)
@@ -0,0 +1,284 @@
+"""
+Переписывание поисковых запросов: раскладка, транслит и опечатки
+
+Каждое слово запроса, которого нет в словаре каталога (названия товаров,
+бренды и названия категорий), последовательно проверяется как набранное
+в другой раскладке («cvfhnajy» → «смартфон»), как транслит («naushniki» →
+«наушники») и, если ни то ни другое не подошло, исправляется на ближайшее
+слово словаря с ограниченным расстоянием Дамерау-Левенштейна. Кандидаты
+для исправления находятся без перебора словаря: по заранее посчитанным
+удалениям символов из начала слов (алгоритм SymSpell).
+
+Словарь строится из базы, хранится в кэше и держится в памяти процесса,
+как индекс подсказок.
+"""
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.core.cache import cache
+
+from ..models import Category, Product
+from .rebuild import schedule_rebuild
+from .text import CYRILLIC_RE, STOP_WORDS, TOKEN_RE, stem
+
+logger = logging.getLogger(__name__)
+
+VOCABULARY_CACHE_KEY = 'search_rewrite:vocabulary'
+VOCABULARY_CACHE_TIMEOUT = 60 * 60 * 24
+VOCABULARY_REFRESH_INTERVAL = 60
+# Удаления считаются только по первым PREFIX_LENGTH символам слова
+PREFIX_LENGTH = 7
+# Слова короче не исправляются: слишком много равноудаленных кандидатов
+MIN_CORRECTION_LENGTH = 4
+
+EN_LAYOUT = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+RU_LAYOUT = 'йцукенгшщзхъфывапролджэячсмитьбюё'
+EN_TO_RU_LAYOUT = str.maketrans(EN_LAYOUT, RU_LAYOUT)
+RU_TO_EN_LAYOUT = str.maketrans(RU_LAYOUT, EN_LAYOUT)
+
+# Транслит: сначала проверяются более длинные сочетания
+LATIN_TO_CYRILLIC = (
+    ('shch', 'щ'), ('sch', 'щ'), ('zh', 'ж'), ('kh', 'х'), ('ts', 'ц'), ('ch', 'ч'), ('sh', 'ш'),
+    ('yu', 'ю'), ('ju', 'ю'), ('ya', 'я'), ('ja', 'я'), ('yo', 'ё'), ('jo', 'ё'), ('ye', 'е'),
+    ('a', 'а'), ('b', 'б'), ('v', 'в'), ('w', 'в'), ('g', 'г'), ('d', 'д'), ('e', 'е'), ('z', 'з'),
+    ('i', 'и'), ('j', 'й'), ('y', 'ы'), ('k', 'к'), ('c', 'к'), ('q', 'к'), ('l', 'л'), ('m', 'м'),
+    ('n', 'н'), ('o', 'о'), ('p', 'п'), ('r', 'р'), ('s', 'с'), ('t', 'т'), ('u', 'у'), ('f', 'ф'),
+    ('h', 'х'), ('x', 'кс'),
+)
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+
+def swap_layout(word):
+    """Слово, набранное в другой раскладке клавиатуры"""
+    if CYRILLIC_RE.search(word):
+        return word.translate(RU_TO_EN_LAYOUT)
+    return word.translate(EN_TO_RU_LAYOUT)
+
+
+def to_cyrillic(word):
+    """Латинский транслит → кириллица (кириллические символы не меняются)"""
+    result = []
+    position = 0
+    while position < len(word):
+        for latin, cyrillic in LATIN_TO_CYRILLIC:
+            if word.startswith(latin, position):
+                result.append(cyrillic)
+                position += len(latin)
+                break
+        else:
+            result.append(word[position])
+            position += 1
+    return ''.join(result)
+
+
+def to_latin(word):
+    """Кириллица → латинский транслит"""
+    return ''.join(CYRILLIC_TO_LATIN.get(char, char) for char in word)
+
+
+def max_distance(word):
+    """Допустимое число опечаток в зависимости от длины слова"""
+    if len(word) < MIN_CORRECTION_LENGTH:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def edit_distance(first, second, limit):
+    """
+    Расстояние Дамерау-Левенштейна (с перестановкой соседних символов)
+
+    Возвращает limit + 1, как только становится ясно, что расстояние больше limit.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous_previous = None
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            cost = 0 if first[i - 1] == second[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (
+                previous_previous is not None and i > 1 and j > 1
+                and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        # Перестановка может опереться на предыдущую строку, поэтому проверяются обе
+        if min(current) > limit and min(previous) >= limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(prefix, distance):
+    """Все строки, получаемые из prefix удалением не более distance символов"""
+    result = {prefix}
+    for count in range(1, min(distance, len(prefix) - 1) + 1):
+        for positions in combinations(range(len(prefix)), count):
+            result.add(''.join(char for index, char in enumerate(prefix) if index not in positions))
+    return result
+
+
+class QueryRewriter:
+    """
+    Переписывание запросов по словарю {слово: частота}
+
+    Неизменяемый объект: строится один раз на версию словаря.
+    """
+
+    def __init__(self, words):
+        self.words = words
+        self.stems = {stem(word) for word in words}
+        self.deletes = defaultdict(list)
+        for word in words:
+            if len(word) >= MIN_CORRECTION_LENGTH:
+                for delete in _deletes(word[:PREFIX_LENGTH], max_distance(word)):
+                    self.deletes[delete].append(word)
+
+    def is_known(self, word, known=None):
+        """Все токены слова есть в словаре (с точностью до словоформы), числа и короткие токены не проверяются"""
+        for token in TOKEN_RE.findall(word):
+            if token in STOP_WORDS or token in self.words or len(token) < 3 or any(char.isdigit() for char in token):
+                continue
+            if stem(token) in self.stems or (known is not None and known(token)):
+                continue
+            return False
+        return True
+
+    def correct(self, word):
+        """
+        Ближайшее слово словаря в пределах max_distance
+
+        Returns:
+            tuple: (слово, расстояние) или None
+        """
+        limit = max_distance(word)
+        if not limit:
+            return None
+        best = None
+        checked = set()
+        for delete in _deletes(word[:PREFIX_LENGTH], limit):
+            for candidate in self.deletes.get(delete, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                bound = min(limit, max_distance(candidate))
+                distance = edit_distance(word, candidate, bound)
+                if distance <= bound:
+                    key = (distance, -self.words[candidate], candidate)
+                    if best is None or key < best:
+                        best = key
+        return (best[2], best[0]) if best else None
+
+    def rewrite_word(self, word, known=None):
+        """Исправленное слово или оно само, если исправлять нечего"""
+        variants = [swap_layout(word)]
+        # Буквы х, ъ, ж, э, б, ю, ё в латинской раскладке — знаки препинания: «xt[jk» → «чехол»
+        if not TOKEN_RE.fullmatch(word) and TOKEN_RE.fullmatch(variants[0]) and self.is_known(variants[0], known):
+            return variants[0]
+        if self.is_known(word, known):
+            return word
+        if not CYRILLIC_RE.search(word):
+            variants.append(to_cyrillic(word))
+        for variant in variants:
+            if TOKEN_RE.fullmatch(variant) and self.is_known(variant, known):
+                return variant
+
+        # Опечатка в самом слове, в слове другой раскладки или в транслите
+        best = None
+        for order, variant in enumerate([word] + variants):
+            if not TOKEN_RE.fullmatch(variant):
+                continue
+            corrected = self.correct(variant)
+            if corrected and (best is None or (corrected[1], order) < best[0]):
+                best = ((corrected[1], order), corrected[0])
+        return best[1] if best else word
+
+    def rewrite(self, query, known=None):
+        """
+        Переписывает запрос по словам
+
+        Args:
+            query: Текст запроса
+            known: Необязательная проверка токена по поисковому индексу (слова
+                из индекса не исправляются, даже если словарь еще не обновился)
+        """
+        words = []
+        for word in str(query or '').split():
+            rewritten = self.rewrite_word(word.lower(), known)
+            # Неисправленные слова сохраняют регистр (важно для icontains в SQLite)
+            words.append(word if rewritten == word.lower() else rewritten)
+        return ' '.join(words)
+
+
+class QueryRewriteService:
+    """Построение, хранение и применение словаря переписывания запросов"""
+
+    _local = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def rewrite(query, known=None):
+        rewritten = QueryRewriteService.get_rewriter().rewrite(query, known)
+        if rewritten != ' '.join(str(query or '').split()):
+            logger.debug('Запрос «%s» переписан в «%s»', query, rewritten)
+            return rewritten
+        return query
+
+    @staticmethod
+    def get_rewriter():
+        """
+        Словарь из памяти процесса; с кэшем сверяется раз в VOCABULARY_REFRESH_INTERVAL
+
+        Если словаря нет в кэше, сборка ставится в очередь, а до ее окончания
+        используется последняя копия из памяти (или пустой словарь — запросы
+        не переписываются).
+        """
+        now = time.monotonic()
+        local = QueryRewriteService._local
+        if local and now - local['checked'] < VOCABULARY_REFRESH_INTERVAL:
+            return local['rewriter']
+
+        with QueryRewriteService._lock:
+            data = cache.get(VOCABULARY_CACHE_KEY)
+            if data is None:
+                schedule_rebuild('rebuild_search_vocabulary', VOCABULARY_REFRESH_INTERVAL)
+                if not local:
+                    return QueryRewriter({})
+                local['checked'] = now
+                return local['rewriter']
+            if local.get('version') != data['version']:
+                local['rewriter'] = QueryRewriter(data['words'])
+                local['version'] = data['version']
+            local['checked'] = now
+        return local['rewriter']
+
+    @staticmethod
+    def build():
+        """Собирает словарь из названий активных товаров, брендов и категорий и кладет его в кэш"""
+        words = Counter()
+        product_translations = Product._parler_meta.root_model.objects.filter(master__is_active=True)
+        category_translations = Category._parler_meta.root_model.objects.filter(master__is_active=True)
+        for queryset in (
+            product_translations.values_list('name', flat=True),
+            Product.objects.filter(is_active=True).exclude(brand='').values_list('brand', flat=True),
+            category_translations.values_list('name', flat=True),
+        ):
+            for text in queryset.iterator():
+                words.update(
+                    token for token in TOKEN_RE.findall(str(text).lower())
+                    if len(token) >= 3 and not any(char.isdigit() for char in token)
+                )
+
+        data = {'version': time.time(), 'words': dict(words)}
+        cache.set(VOCABULARY_CACHE_KEY, data, VOCABULARY_CACHE_TIMEOUT)
+        logger.info('Построен словарь исправления запросов: %s слов', len(words))
+        return data
@@ -0,0 +1,191 @@
+"""
+Подсказки поиска по мере ввода (названия товаров, бренды, категории)
+
+Индекс подсказок строится из ProductListing и дерева категорий отдельно
+для каждого языка и хранится в кэше. Процесс держит его в памяти и сверяет
+версию с кэшем не чаще раза в SUGGEST_REFRESH_INTERVAL секунд, поэтому на
+нажатие клавиши база не запрашивается.
+
+Префиксный поиск: отсортированный список ключей (текст подсказки с каждого
+слова) и bisect по префиксу. Для коротких префиксов, под которые попадает
+слишком много ключей, лучшие подсказки посчитаны заранее.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.urls import reverse
+from django.utils import translation
+
+from ..category_tree import CategoryTreeService
+from ..listing import ProductListingService
+from .rebuild import schedule_rebuild
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_CACHE_KEY = 'search_suggest:{language}'
+SUGGEST_CACHE_TIMEOUT = 60 * 60 * 24
+SUGGEST_REFRESH_INTERVAL = 60
+# Префиксы не длиннее этого получают заранее посчитанный топ
+PRECOMPUTED_PREFIX_LENGTH = 2
+PRECOMPUTED_TOP = 20
+# Сколько ключей максимум просматривается для длинного префикса
+MAX_SCANNED_KEYS = 5000
+SUGGESTION_TYPES = ('products', 'brands', 'categories')
+
+NORMALIZE_RE = re.compile(r'[^0-9a-zа-я]+')
+
+
+def normalize(text):
+    """Нижний регистр, ё → е, любые разделители → один пробел"""
+    return NORMALIZE_RE.sub(' ', str(text or '').lower().replace('ё', 'е')).strip()
+
+
+class SuggestIndex:
+    """
+    Неизменяемый индекс подсказок одного языка
+
+    entries: [(type, text, url, weight)], keys: отсортированные [(ключ, номер записи)]
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        keys = set()
+        for position, (_type, text, _url, _weight) in enumerate(entries):
+            words = normalize(text).split(' ')
+            for start in range(len(words)):
+                if words[start]:
+                    keys.add((' '.join(words[start:]), position))
+        self.keys = sorted(keys)
+        self.top = self._precompute()
+
+    def _precompute(self):
+        top = defaultdict(set)
+        for key, position in self.keys:
+            for length in range(1, min(PRECOMPUTED_PREFIX_LENGTH, len(key)) + 1):
+                top[key[:length]].add(position)
+        return {prefix: self._best(positions, PRECOMPUTED_TOP) for prefix, positions in top.items()}
+
+    def _best(self, positions, limit):
+        """Не более limit самых популярных записей каждого типа"""
+        by_type = defaultdict(list)
+        for position in positions:
+            by_type[self.entries[position][0]].append(position)
+        return [
+            position
+            for suggestion_type in SUGGESTION_TYPES
+            for position in heapq.nlargest(
+                limit, by_type[suggestion_type], key=lambda position: (self.entries[position][3], -position)
+            )
+        ]
+
+    def candidates(self, prefix):
+        """Номера записей, у которых какое-то слово (с продолжением) начинается с prefix"""
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+            return self.top.get(prefix, [])
+        start = bisect_left(self.keys, (prefix,))
+        positions = set()
+        for key, position in self.keys[start:start + MAX_SCANNED_KEYS]:
+            if not key.startswith(prefix):
+                break
+            positions.add(position)
+        return positions
+
+    def suggest(self, query, limit=5):
+        """Лучшие подсказки каждого типа: {'products': [...], 'brands': [...], 'categories': [...]}"""
+        result = {suggestion_type: [] for suggestion_type in SUGGESTION_TYPES}
+        prefix = normalize(query)
+        if not prefix:
+            return result
+        seen = set()
+        # С запасом: одинаковые названия разных товаров показываются один раз
+        for position in self._best(self.candidates(prefix), limit * 2):
+            suggestion_type, text, url, _weight = self.entries[position]
+            if len(result[suggestion_type]) < limit and (suggestion_type, normalize(text)) not in seen:
+                seen.add((suggestion_type, normalize(text)))
+                result[suggestion_type].append({'text': text, 'url': url})
+        return result
+
+
+class SuggestService:
+    """Построение, хранение и чтение индексов подсказок"""
+
+    _local = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def suggest(query, language=None, limit=5):
+        index = SuggestService.get_index(language)
+        return index.suggest(query, limit) if index else {suggestion_type: [] for suggestion_type in SUGGESTION_TYPES}
+
+    @staticmethod
+    def get_index(language=None):
+        """
+        Индекс языка из памяти процесса; с кэшем сверяется раз в SUGGEST_REFRESH_INTERVAL
+
+        Если индекса нет в кэше, сборка ставится в очередь, а до ее окончания
+        используется последняя копия из памяти (или None — подсказок нет).
+        """
+        language = ProductListingService.get_language(language)
+        now = time.monotonic()
+        local = SuggestService._local.get(language)
+        if local and now - local['checked'] < SUGGEST_REFRESH_INTERVAL:
+            return local['index']
+
+        with SuggestService._lock:
+            data = cache.get(SUGGEST_CACHE_KEY.format(language=language))
+            if data is None:
+                schedule_rebuild('rebuild_search_suggestions', SUGGEST_REFRESH_INTERVAL)
+                if not local:
+                    return None
+                local['checked'] = now
+                return local['index']
+            if not local or local['version'] != data['version']:
+                local = {'version': data['version'], 'index': SuggestIndex(data['entries'])}
+            local['checked'] = now
+            SuggestService._local[language] = local
+        return local['index']
+
+    @staticmethod
+    def build(language):
+        """Собирает записи подсказок языка и кладет их в кэш"""
+        listings = ProductListingService.listing_queryset(language)
+        entries = [
+            ('products', name, reverse('product_detail', args=[product_id]), views_count)
+            for product_id, name, views_count in listings.values_list('product_id', 'name', 'views_count')
+        ]
+        for brand, views in listings.exclude(brand='').values('brand').annotate(views=Sum('views_count')).values_list('brand', 'views'):
+            entries.append(('brands', brand, f"{reverse('index')}?{urlencode({'brand': brand})}", views or 0))
+
+        # Вес категории — просмотры товаров всего ее поддерева
+        views_by_path = defaultdict(int)
+        for path, views in listings.values('category_path').annotate(views=Sum('views_count')).values_list('category_path', 'views'):
+            parts = (path or '').split('/')
+            for depth in range(1, len(parts) + 1):
+                views_by_path['/'.join(parts[:depth])] += views or 0
+        stack = list(CategoryTreeService.get_tree(language))
+        while stack:
+            node = stack.pop()
+            stack.extend(node['children'])
+            entries.append(('categories', node['name'], reverse('category', args=[node['slug']]), views_by_path.get(node['path'], 0)))
+
+        data = {'version': time.time(), 'entries': entries}
+        cache.set(SUGGEST_CACHE_KEY.format(language=language), data, SUGGEST_CACHE_TIMEOUT)
+        logger.info('Построен индекс подсказок %s: %s записей', language, len(entries))
+        return data
+
+    @staticmethod
+    def rebuild():
+        """Пересобирает индексы подсказок всех языков"""
+        total = 0
+        for language in ProductListingService.get_languages():
+            with translation.override(language):
+                total += len(SuggestService.build(language)['entries'])
+        return total
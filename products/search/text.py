@@ -0,0 +1,204 @@
+"""
+Разбор текста для поискового индекса: токенизация и стемминг
+
+Русские слова обрабатываются алгоритмом Snowball (Портера) для русского
+языка, английские — облегченным стеммером Портера. Один и тот же анализ
+применяется и к документам, и к запросам, поэтому важна не лингвистическая
+точность, а одинаковое приведение словоформ.
+"""
+import re
+
+TOKEN_RE = re.compile(r'[а-яё]+|[a-z0-9]+')
+CYRILLIC_RE = re.compile(r'[а-яё]')
+
+STOP_WORDS = frozenset({
+    'и', 'в', 'во', 'на', 'с', 'со', 'для', 'по', 'из', 'от', 'до', 'к', 'у', 'о', 'об', 'не', 'а', 'но', 'или',
+    'the', 'and', 'for', 'of', 'with', 'in', 'on', 'to', 'a', 'an', 'or', 'by',
+})
+
+# --- Русский (Snowball) ---
+
+RU_VOWELS = 'аеиоуыэюя'
+RU_PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+RU_PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+RU_ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым',
+    'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+RU_PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+RU_PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+RU_REFLEXIVE = ('ся', 'сь')
+RU_VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+RU_VERB_2 = (
+    'ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены', 'ить',
+    'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю',
+)
+RU_NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой', 'ий', 'ям',
+    'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я',
+)
+RU_SUPERLATIVE = ('ейше', 'ейш')
+RU_DERIVATIONAL = ('ость', 'ост')
+
+
+def _longest(endings):
+    return tuple(sorted(endings, key=len, reverse=True))
+
+
+RU_PERFECTIVE_GERUND_1 = _longest(RU_PERFECTIVE_GERUND_1)
+RU_PERFECTIVE_GERUND_2 = _longest(RU_PERFECTIVE_GERUND_2)
+RU_ADJECTIVE = _longest(RU_ADJECTIVE)
+RU_VERB_1 = _longest(RU_VERB_1)
+RU_VERB_2 = _longest(RU_VERB_2)
+RU_NOUN = _longest(RU_NOUN)
+
+
+def _ru_regions(word):
+    """Начало областей RV и R2 (индексы в слове)"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in RU_VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in RU_VOWELS and word[i - 1] in RU_VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in RU_VOWELS and word[i - 1] in RU_VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _ru_strip(rv, endings, after_a=False):
+    """Отрезает первое подходящее окончание; для групп 1 перед ним должна стоять «а» или «я»"""
+    for ending in endings:
+        if rv.endswith(ending):
+            stem = rv[:-len(ending)]
+            if after_a and not stem.endswith(('а', 'я')):
+                continue
+            return stem
+    return None
+
+
+def _ru_strip_adjectival(rv):
+    stem = _ru_strip(rv, RU_ADJECTIVE)
+    if stem is None:
+        return None
+    for endings, after_a in ((RU_PARTICIPLE_2, False), (RU_PARTICIPLE_1, True)):
+        shorter = _ru_strip(stem, endings, after_a)
+        if shorter is not None:
+            return shorter
+    return stem
+
+
+def stem_russian(word):
+    """Стемминг русского слова по алгоритму Snowball"""
+    word = word.replace('ё', 'е')
+    rv_start, r2_start = _ru_regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    stem = _ru_strip(rv, RU_PERFECTIVE_GERUND_2)
+    if stem is None:
+        stem = _ru_strip(rv, RU_PERFECTIVE_GERUND_1, after_a=True)
+    if stem is None:
+        reflexive = _ru_strip(rv, RU_REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        for strip in (
+            _ru_strip_adjectival,
+            lambda value: _ru_strip(value, RU_VERB_2),
+            lambda value: _ru_strip(value, RU_VERB_1, after_a=True),
+            lambda value: _ru_strip(value, RU_NOUN),
+        ):
+            stem = strip(rv)
+            if stem is not None:
+                break
+        else:
+            stem = rv
+    rv = stem
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные окончания только в R2
+    for ending in RU_DERIVATIONAL:
+        if rv.endswith(ending) and len(prefix) + len(rv) - len(ending) >= r2_start:
+            rv = rv[:-len(ending)]
+            break
+
+    # Шаг 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _ru_strip(rv, RU_SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith('нн') else superlative
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+# --- Английский (облегченный Портер) ---
+
+EN_VOWELS = 'aeiouy'
+EN_SUFFIXES = (
+    ('ational', 'ate'), ('tional', 'tion'), ('ization', 'ize'), ('iveness', 'ive'), ('fulness', 'ful'),
+    ('ousness', 'ous'), ('alism', 'al'), ('ation', 'ate'), ('ness', ''), ('ment', ''), ('ful', ''),
+    ('able', ''), ('ible', ''), ('ly', ''),
+)
+
+
+def _en_has_vowel(value):
+    return any(char in EN_VOWELS for char in value)
+
+
+def stem_english(word):
+    """Облегченный стемминг английского слова (множественное число, -ed/-ing, частые суффиксы)"""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("'s"):
+        word = word[:-2]
+    if word.endswith('sses'):
+        word = word[:-2]
+    elif word.endswith('ies') and len(word) > 4:
+        word = word[:-3] + 'y'
+    elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+
+    for ending in ('ingly', 'edly', 'ing', 'ed'):
+        if word.endswith(ending) and _en_has_vowel(word[:-len(ending)]) and len(word) - len(ending) >= 3:
+            word = word[:-len(ending)]
+            if word.endswith(('at', 'bl', 'iz')):
+                word += 'e'
+            elif len(word) > 2 and word[-1] == word[-2] and word[-1] not in 'lsz' and word[-1] not in EN_VOWELS:
+                word = word[:-1]
+            break
+
+    for ending, replacement in EN_SUFFIXES:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            word = word[:-len(ending)] + replacement
+            break
+    return word
+
+
+def stem(token):
+    """Основа токена в зависимости от алфавита"""
+    if CYRILLIC_RE.match(token):
+        return stem_russian(token) if len(token) > 2 else token
+    return stem_english(token)
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре без стоп-слов"""
+    if not text:
+        return []
+    return [token for token in TOKEN_RE.findall(str(text).lower()) if token not in STOP_WORDS]
+
+
+def analyze(text):
+    """Список поисковых термов текста (основы слов)"""
+    return [stem(token) for token in tokenize(text)]
@@ -1,8 +1,10 @@
-from django.db.models import F
 # PostgreSQL search imports (conditionally imported where needed)
 # from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
 from ..models import Product, Category, Shop, Tag
 from ..repositories.product_repository import ProductRepository # Импортируем репозиторий
+from ..catalog_filters import ProductQueryCompiler
+from ..search.results import SearchResultCache
+from ..view_counter import ViewCounterService
 from django.utils import translation
 
 class ProductService:
@@ -28,56 +30,17 @@ class ProductService:
 
     @staticmethod
     def get_filtered_products(filters):
-        queryset = ProductRepository.get_all_products()
-
-        category_id = filters.get('category')
-        if category_id:
-            queryset = queryset.filter(category__id=category_id)
-
-        shop_ids = filters.getlist('shops')
-        if shop_ids:
-            queryset = queryset.filter(shops__id__in=shop_ids).distinct()
-
-        tag_ids = filters.getlist('tags')
-        if tag_ids:
-            queryset = queryset.filter(tags__id__in=tag_ids).distinct()
-
-        price_min = filters.get('price_min')
-        if price_min:
-            queryset = queryset.filter(price__gte=price_min)
-
-        price_max = filters.get('price_max')
-        if price_max:
-            queryset = queryset.filter(price__lte=price_max)
-
-        query = filters.get('q')
-        if query:
-            # Проверяем, используем ли мы PostgreSQL (только PostgreSQL поддерживает SearchVector)
-            from django.conf import settings
-            db_engine = settings.DATABASES['default']['ENGINE']
-            
-            if 'postgresql' in db_engine:
-                # Используем полнотекстовый поиск PostgreSQL
-                from django.contrib.postgres.search import SearchQuery, SearchRank
-                from django.db.models import F
-                search_query = SearchQuery(query)
-                queryset = queryset.annotate(
-                    rank=SearchRank(F('search_vector'), search_query)
-                ).filter(search_vector=search_query).order_by('-rank')
-            else:
-                # Для других баз данных (например, SQLite) используем простой поиск по названию и описанию
-                from django.db import models
-                queryset = queryset.filter(
-                    models.Q(name__icontains=query) | models.Q(description__icontains=query)
-                )
-
-        return queryset
+        """QuerySet каталога; для поиска (q) — последовательность по закэшированному списку id"""
+        compiler = ProductQueryCompiler(filters)
+        products = ProductRepository.get_all_products()
+        if not compiler.filters['q']:
+            return compiler.compile(products)
+        return SearchResultCache.results(SearchResultCache.normalize(compiler), lambda: compiler.compile(products), products)
 
     @staticmethod
-    def increment_product_views(product):
-        product.views_count = F('views_count') + 1
-        product.save(update_fields=['views_count'])
-        product.refresh_from_db()
+    def increment_product_views(product, request=None):
+        """Учитывает просмотр (отложенно, с отсевом повторов по сессии, если передан request)"""
+        ViewCounterService.record(request, product.pk)
         return product
 
     @staticmethod
@@ -218,4 +218,97 @@ def send_promotional_emails(user_ids, subject, template_name, context=None):
             failed_count += 1
     
     logger.info(f"Promotional emails queued: {sent_count} sent, {failed_count} failed")
-    return f"Promotional emails queued: {sent_count} sent, {failed_count} failed"
\ No newline at end of file
+    return f"Promotional emails queued: {sent_count} sent, {failed_count} failed"
+
+@shared_task
+def rebuild_product_listings():
+    """Полная пересборка карточек каталога (страховка от изменений в обход сигналов)"""
+    from .listing import ProductListingService
+    
+    total = ProductListingService.rebuild()
+    return f"Rebuilt {total} product listings"
+
+@shared_task
+def process_search_index_queue():
+    """Переиндексация товаров, накопившихся в очереди поиска (пачками)"""
+    from .search.queue import SearchIndexQueueService
+    
+    total = SearchIndexQueueService.process()
+    return f"Reindexed {total} queued products"
+
+@shared_task
+def rebuild_search_index():
+    """Пересборка поиска: search_vector и локальный индекс (заодно сжимает журнал изменений)"""
+    from .search.queue import SearchIndexQueueService
+    
+    total = SearchIndexQueueService.rebuild()
+    return f"Indexed {total} products"
+
+@shared_task
+def rebuild_search_suggestions():
+    """Пересборка индексов подсказок поиска по всем языкам"""
+    from .search.suggest import SuggestService
+    
+    total = SuggestService.rebuild()
+    return f"Built {total} search suggestions"
+
+@shared_task
+def rebuild_search_vocabulary():
+    """Пересборка словаря исправления поисковых запросов"""
+    from .search.rewrite import QueryRewriteService
+    
+    data = QueryRewriteService.build()
+    return f"Built vocabulary of {len(data['words'])} words"
+
+@shared_task
+def flush_product_views():
+    """Запись накопленных просмотров товаров в базу"""
+    from .view_counter import ViewCounterService
+    
+    total = ViewCounterService.flush()
+    return f"Flushed {total} product views"
+
+
+@shared_task
+def rollup_product_views():
+    """Удаление дневной статистики просмотров старше срока хранения"""
+    from .view_stats import ProductViewStatsService
+    
+    deleted = ProductViewStatsService.rollup()
+    return f"Deleted {deleted} old daily view rows"
+
+
+@shared_task
+def update_popularity_scores():
+    """Пересчет популярности товаров с новыми просмотрами, заказами и отзывами"""
+    from .popularity import PopularityService
+    
+    updated = PopularityService.update()
+    return f"Updated popularity for {updated} products"
+
+
+@shared_task
+def rebuild_related_products():
+    """Пересчет похожих товаров по покупкам, избранному, тегам и характеристикам"""
+    from .related import RelatedProductService
+    
+    total = RelatedProductService.rebuild()
+    return f"Rebuilt related products for {total} products"
+
+
+@shared_task
+def refresh_recommendation_pool():
+    """Обновление пула рекомендаций для корзины"""
+    from .recommendations import RecommendationPoolService
+    
+    size = RecommendationPoolService.refresh()
+    return f"Recommendation pool has {size} products"
+
+
+@shared_task
+def release_expired_reservations():
+    """Возврат на склад просроченных резервов товаров"""
+    from .inventory import InventoryService
+    
+    released = InventoryService.release_expired()
+    return f"Released {released} expired reservations"
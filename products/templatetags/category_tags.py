@@ -1,9 +1,8 @@
 from django import template
-from ..models import Category
+from ..category_tree import CategoryTreeService
 
 register = template.Library()
 
 @register.inclusion_tag('products/tags/category_tree.html')
 def show_category_tree():
-    root_categories = Category.objects.filter(parent__isnull=True).prefetch_related('children')
-    return {'root_categories': root_categories}
\ No newline at end of file
+    return {'root_categories': CategoryTreeService.get_tree()}
@@ -1,6 +1,38 @@
-from django.test import TestCase
+import threading
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from django.test import TestCase, RequestFactory
+from unittest.mock import patch
 from django.contrib.auth import get_user_model
-from .models import Task, MoodTracking
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import translation
+from .models import Task, MoodTracking, Category, Product, ProductListing, SearchIndexQueue, ProductDailyViews, Order, StockReservation
+from .pagination import KeysetPaginator, InvalidCursor
+from .facets import FacetService
+from .catalog_filters import ProductQueryCompiler
+from .listing import ProductListingService
+from .card_cache import ProductCardCache
+from .category_tree import CategoryTreeService
+from .page_cache import PageCache
+from .view_counter import ViewCounterService
+from .view_stats import ProductViewStatsService
+from .popularity import PopularityService, POPULARITY_HALF_LIFE_DAYS
+from .related import RelatedProductService
+from .recommendations import RecommendationPoolService
+from .cart import CART_SESSION_KEY, CacheCartStore, CartContents, DatabaseCartStore, CartLine, CartService, normalize_quantities
+from .checkout import CheckoutService
+from .inventory import InsufficientStock, InventoryService
+from .search.index import InvertedIndex
+from .search.text import analyze
+from .search.queue import SearchIndexQueueService
+from .search.suggest import SuggestIndex
+from .search.rewrite import QueryRewriter
+from .search.results import SearchResultCache
 
 User = get_user_model()
 
@@ -72,4 +104,865 @@ class MoodTrackingModelTest(TestCase):
         )
         
         # The string representation includes the mood display and timestamp
-        self.assertIn('Очень радостное', str(mood))
\ No newline at end of file
+        self.assertIn('Очень радостное', str(mood))
+
+
+
+class CategorySubtreeTest(TestCase):
+    def test_inactive_branches_are_pruned(self):
+        """Test that descendants below an inactive category are skipped"""
+        root = Category(pk=1, slug='root', path='root')
+        rows = [
+            (2, 1, True),    # root/child
+            (3, 1, False),   # root/hidden
+            (4, 2, True),    # root/child/leaf
+            (5, 3, True),    # root/hidden/leaf
+        ]
+        kept = [row[0] for row in root._prune_inactive_branches(rows, key=lambda row: row)]
+        self.assertEqual(kept, [2, 4])
+
+    def test_descendants_are_filtered_by_path_prefix(self):
+        """Test that the subtree lookup is a single prefix filter on path"""
+        root = Category(pk=1, slug='root', path='root')
+        sql = str(root.get_descendants().query)
+        self.assertIn('"products_category"."path" LIKE', sql)
+        self.assertIn("root/%", sql)
+
+    def test_moving_a_subtree_rewrites_paths_levels_and_listings(self):
+        """Test that moving a category rewrites its descendants and their product cards"""
+        with self.captureOnCommitCallbacks(execute=True):
+            phones = Category.objects.create(slug='phones', name='Телефоны')
+            smart = Category.objects.create(slug='smart', name='Смартфоны', parent=phones)
+            android = Category.objects.create(slug='android', name='Android', parent=smart)
+            gadgets = Category.objects.create(slug='gadgets', name='Гаджеты')
+            product = Product.objects.create(sku='p1', category=android, price=100)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            smart.parent = gadgets
+            smart.save()
+
+        android.refresh_from_db()
+        self.assertEqual(android.path, 'gadgets/smart/android')
+        self.assertEqual(android.category_level, 2)
+        self.assertEqual(Category.objects.get(pk=smart.pk).category_level, 1)
+        self.assertEqual(
+            set(ProductListing.objects.filter(product=product).values_list('category_path', flat=True)),
+            {'gadgets/smart/android'},
+        )
+        self.assertEqual(gadgets.get_descendant_ids(), [gadgets.pk, smart.pk, android.pk])
+        self.assertEqual(phones.get_descendant_ids(), [phones.pk])
+
+
+class CategoryCounterServiceTest(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.phones = Category.objects.create(slug='phones', name='Телефоны')
+            self.smart = Category.objects.create(slug='smart', name='Смартфоны', parent=self.phones)
+            self.android = Category.objects.create(slug='android', name='Android', parent=self.smart)
+            self.gadgets = Category.objects.create(slug='gadgets', name='Гаджеты')
+            Product.objects.create(sku='p1', category=self.android, price=100)
+            Product.objects.create(sku='p2', category=self.smart, price=100)
+
+    def assertCounts(self, expected):
+        counts = dict(Category.objects.values_list('slug', 'products_count'))
+        self.assertEqual({slug: counts.get(slug) for slug in expected}, expected)
+
+    def test_new_products_are_counted_by_ancestors(self):
+        """Test that creating products increments every counted ancestor"""
+        self.assertCounts({'phones': 2, 'smart': 2, 'android': 1, 'gadgets': 0})
+
+    def test_moving_a_category_moves_its_products(self):
+        """Test that a moved subtree is subtracted from old and added to new ancestors"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.smart.parent = self.gadgets
+            self.smart.save()
+        self.assertCounts({'phones': 0, 'smart': 2, 'android': 1, 'gadgets': 2})
+
+    def test_deactivated_category_is_not_passed_up(self):
+        """Test that an inactive category keeps its count but ancestors drop it"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.android.is_active = False
+            self.android.save()
+        self.assertCounts({'phones': 1, 'smart': 1, 'android': 1})
+
+    def test_deleting_a_category_updates_ancestors(self):
+        """Test that deleting a subtree subtracts its products once from surviving ancestors"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.smart.delete()
+        self.assertCounts({'phones': 0, 'gadgets': 0})
+        self.assertFalse(Category.objects.get(pk=self.phones.pk).has_products)
+
+    def test_deleting_a_product_with_its_category(self):
+        """Test that a product deleted in the same transaction as its category is subtracted once"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(category=self.android).delete()
+            self.android.delete()
+        self.assertCounts({'phones': 1, 'smart': 1})
+
+
+class KeysetPaginatorTest(TestCase):
+    def test_cursor_round_trip(self):
+        """Test that a cursor restores the sort key of the last row"""
+        paginator = KeysetPaginator(Product.objects.all(), 20, 'popularity')
+        cursor = paginator.encode_cursor(Product(pk=7, popularity_score=96.5))
+        self.assertEqual(paginator.decode_cursor(cursor), [96.5, 7])
+
+    def test_invalid_cursor_is_rejected(self):
+        """Test that tampered cursors and cursors of another sort are rejected"""
+        paginator = KeysetPaginator(Product.objects.all(), 20, 'popularity')
+        cursor = paginator.encode_cursor(Product(pk=7, popularity_score=96.5))
+        with self.assertRaises(InvalidCursor):
+            paginator.decode_cursor(cursor + 'x')
+        with self.assertRaises(InvalidCursor):
+            KeysetPaginator(Product.objects.all(), 20, 'price_asc').decode_cursor(cursor)
+
+    def test_filtered_category_pages_follow_the_cursor(self):
+        """Test that the category page starts in cursor mode and the next page keeps the filters"""
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(slug='kettles', name='Чайники')
+            for number in range(18):
+                brand, price = ('Other', 100) if number % 6 == 2 else ('Acme', 900 if number % 6 == 5 else 100 + number)
+                Product.objects.create(
+                    sku=f'k{number}', category=category, brand=brand, price=price, popularity_score=100 - number,
+                )
+        expected = list(
+            Product.objects.filter(brand='Acme', price__lte=500).order_by('-popularity_score').values_list('pk', flat=True)
+        )
+        self.assertEqual(len(expected), 12)
+
+        compiler = ProductQueryCompiler(QueryDict('brand=Acme&price_max=500'), category=category)
+        paginator = SearchResultCache.paginator(ProductListingService.listing_queryset(), compiler, 8)
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        self.assertEqual([card.product_id for card in first] + [card.product_id for card in second], expected)
+        self.assertFalse(second.has_next())
+
+        url = f'/ru/category/{category.slug}/'
+        response = self.client.get(url, {'brand': 'Acme', 'price_max': '500', 'per_page': '12'})
+        self.assertIsNone(response.context['total_products'])
+        self.assertEqual([card.product_id for card in response.context['products']], expected)
+        self.assertFalse(response.context['products'].has_next())
+
+        response = self.client.get(url, {'brand': 'Acme', 'per_page': '12'})
+        page = response.context['products']
+        self.assertTrue(page.has_next())
+        link = QueryDict(f'brand=Acme&per_page=12&cursor={page.next_cursor}').urlencode()
+        self.assertContains(response, f'href="?{link}"'.replace('&', '&amp;'))
+
+
+class FacetServiceTest(TestCase):
+    def test_price_edges_cover_whole_range(self):
+        """Test that price buckets start at the minimum and end at the maximum"""
+        self.assertEqual(FacetService._price_edges(0, 7), [0, 2, 4, 6, 7])
+        self.assertEqual(FacetService._price_edges(10, 10), [10, 10])
+        self.assertEqual(FacetService._price_edges(None, None), [])
+
+    def test_moving_a_category_drops_facets_of_both_ancestor_chains(self):
+        """Test that a moved category resets the facets of its old and new ancestors"""
+        from .facets import FACETS_CACHE_KEY
+        with self.captureOnCommitCallbacks(execute=True):
+            phones = Category.objects.create(slug='phones', name='Телефоны')
+            smart = Category.objects.create(slug='smart', name='Смартфоны', parent=phones)
+            gadgets = Category.objects.create(slug='gadgets', name='Гаджеты')
+        keys = [FACETS_CACHE_KEY.format(category.pk) for category in (phones, smart, gadgets)]
+        cache.set_many({key: {'total': 1} for key in keys})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            smart.parent = gadgets
+            smart.save()
+        self.assertEqual(cache.get_many(keys), {})
+
+        cache.set_many({key: {'total': 1} for key in keys})
+        with self.captureOnCommitCallbacks(execute=True):
+            smart.is_active = False
+            smart.save()
+        self.assertEqual(set(cache.get_many(keys)), {keys[0]})
+
+
+class ProductQueryCompilerTest(TestCase):
+    def test_relations_are_filtered_with_exists(self):
+        """Test that tag and search filters use EXISTS instead of JOIN + DISTINCT"""
+        compiler = ProductQueryCompiler({'tags': '1,2', 'q': 'phone', 'price_min': 'abc', 'sort': 'unknown'})
+        sql = str(compiler.compile().query)
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertEqual(compiler.filters['tags'], [1, 2])
+        self.assertIsNone(compiler.filters['price_min'])
+        self.assertEqual(compiler.sort, 'popularity')
+
+    def test_listing_subqueries_are_bound_to_product_id(self):
+        """Test that filters on listing rows correlate EXISTS with product_id"""
+        queryset = ProductListingService.listing_queryset('en')
+        sql = str(ProductQueryCompiler({'tags': '1'}).compile(queryset).query)
+        self.assertIn('"products_productlisting"."product_id"', sql)
+        self.assertIn('"products_productlisting"."language_code" = en', sql)
+
+
+    def test_api_keeps_exact_filters_and_name_ordering(self):
+        """Test that the product API still accepts exact price filters, currency and ordering=name"""
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        from .api.views import ProductViewSet
+
+        def list_ids(params):
+            view = ProductViewSet(action='list', request=Request(APIRequestFactory().get('/api/products/', params)), format_kwarg=None)
+            return list(view.filter_queryset(view.get_queryset()).values_list('pk', flat=True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            kettle = Product.objects.create(sku='p1', name='Чайник', price=100, discount_price=90, currency='RUB')
+            toaster = Product.objects.create(sku='p2', name='Тостер', price=200, currency='USD')
+            blender = Product.objects.create(sku='p3', name='Блендер', price=100, currency='RUB')
+
+        self.assertEqual(sorted(list_ids({'price': '100'})), sorted([kettle.pk, blender.pk]))
+        self.assertEqual(list_ids({'discount_price': '90'}), [kettle.pk])
+        self.assertEqual(list_ids({'currency': 'USD'}), [toaster.pk])
+        with translation.override('ru'):
+            self.assertEqual(list_ids({'ordering': 'name'}), [blender.pk, toaster.pk, kettle.pk])
+            self.assertEqual(list_ids({'ordering': '-name'}), [kettle.pk, toaster.pk, blender.pk])
+
+    def test_load_more_ignores_unknown_category(self):
+        """Test that an unknown category slug does not empty the feed"""
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(sku='p1', price=100)
+        response = self.client.get('/ru/load-more-products/', {'category': 'missing-slug', 'with_count': '1'})
+        self.assertEqual(response.json()['total_products'], 1)
+        self.assertIn(f'/product/{product.pk}/', response.json()['html'])
+
+
+class ProductCardCacheTest(TestCase):
+    def test_card_key_changes_with_listing_version(self):
+        """Test that the fragment key depends on language and listing version"""
+        from datetime import datetime, timezone as dt_timezone
+        listing = ProductListing(product_id=5, language_code='ru', updated_at=datetime(2025, 1, 1, tzinfo=dt_timezone.utc))
+        key = ProductCardCache.cache_key(listing)
+        self.assertIn(':ru:5:', key)
+        listing.updated_at = datetime(2025, 1, 2, tzinfo=dt_timezone.utc)
+        self.assertNotEqual(ProductCardCache.cache_key(listing), key)
+
+    def test_renaming_a_seller_changes_the_card_key(self):
+        """Test that a new seller name bumps the listing version used by the fragment cache"""
+        from .models import Seller
+        user = User.objects.create_user(username='seller', email='seller@example.com', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            seller = Seller.objects.create(user=user, company_name='Старое имя')
+            product = Product.objects.create(sku='p1', price=100, seller=seller)
+        listing = ProductListing.objects.filter(product=product).first()
+        ProductListing.objects.filter(pk=listing.pk).update(updated_at=listing.updated_at - timedelta(days=1))
+        listing.refresh_from_db()
+        key = ProductCardCache.cache_key(listing)
+
+        seller.company_name = 'Новое имя'
+        seller.save()
+        listing.refresh_from_db()
+        self.assertEqual(listing.seller_name, 'Новое имя')
+        self.assertNotEqual(ProductCardCache.cache_key(listing), key)
+
+
+class CategoryTreeServiceTest(TestCase):
+    def test_menu_keeps_only_megamenu_branches(self):
+        """Test that the mega menu drops categories hidden from it together with their children"""
+        tree = [
+            {'id': 1, 'show_in_megamenu': True, 'children': [
+                {'id': 2, 'show_in_megamenu': False, 'children': [
+                    {'id': 3, 'show_in_megamenu': True, 'children': []},
+                ]},
+                {'id': 4, 'show_in_megamenu': True, 'children': []},
+            ]},
+        ]
+        menu = CategoryTreeService._menu(tree)
+        self.assertEqual([child['id'] for child in menu[0]['children']], [4])
+        self.assertEqual(len(tree[0]['children']), 2)
+
+    def test_breadcrumbs_follow_stored_path(self):
+        """Test that breadcrumbs are resolved from path prefixes without touching parents"""
+        names = {
+            'by_id': {1: ('Электроника', 'electronics'), 2: ('Телефоны', 'phones')},
+            'by_path': {'electronics': 1, 'electronics/phones': 2},
+        }
+        category = Category(pk=2, slug='phones', path='electronics/phones')
+        with patch.object(CategoryTreeService, 'get_names', return_value=names), self.assertNumQueries(0):
+            crumbs = CategoryTreeService.get_breadcrumbs(category)
+        self.assertEqual([crumb['name'] for crumb in crumbs], ['Электроника', 'Телефоны'])
+        self.assertEqual(crumbs[0]['path'], 'electronics')
+
+
+class PageCacheTest(TestCase):
+    def test_params_are_normalized(self):
+        """Test that parameter order, empty values and tracking tags do not split the page cache"""
+        first = QueryDict('sort=price_asc&brand=&utm_source=mail&tags=2&tags=1')
+        second = QueryDict('tags=1&sort=price_asc&tags=2')
+        self.assertEqual(PageCache.normalize_params(first), PageCache.normalize_params(second))
+        self.assertNotEqual(PageCache.normalize_params(first), PageCache.normalize_params(QueryDict('sort=rating')))
+
+
+class SearchIndexTest(TestCase):
+    def test_word_forms_share_terms(self):
+        """Test that Russian and English word forms are reduced to the same term"""
+        self.assertEqual(analyze('смартфоны'), analyze('смартфонов'))
+        self.assertEqual(analyze('наушники'), analyze('наушник'))
+        self.assertEqual(analyze('headphones'), analyze('headphone'))
+
+    def test_bm25_prefers_documents_with_all_terms(self):
+        """Test that documents containing every query term rank first and removed documents disappear"""
+        index = InvertedIndex({
+            1: {term: 3 for term in analyze('беспроводные наушники')},
+            2: {term: 3 for term in analyze('наушники')},
+            3: {term: 3 for term in analyze('беспроводная мышь')},
+        })
+        self.assertEqual([product_id for product_id, _score in index.search(analyze('беспроводные наушники'))], [1])
+        index.remove(1)
+        self.assertEqual(sorted(product_id for product_id, _score in index.search(analyze('беспроводные наушники'))), [2, 3])
+
+    def test_filter_is_not_capped_by_the_ranking_limit(self):
+        """Test that the backend filter keeps every match while ranking stays limited"""
+        import tempfile
+        from django.test import override_settings
+        from .search.backends import InvertedIndexBackend, SEARCH_MAX_RESULTS
+        index = InvertedIndex({product_id: {term: 1 for term in analyze('чайник')} for product_id in range(1, 601)})
+        with tempfile.TemporaryDirectory() as path, override_settings(SEARCH_QUERY_REWRITE=False):
+            backend = InvertedIndexBackend(path)
+            with patch.object(backend.disk, 'sync', return_value=index):
+                self.assertEqual(backend.match('чайники'), set(range(1, 601)))
+                self.assertEqual(len(backend.search('чайники')), SEARCH_MAX_RESULTS)
+
+    def test_broad_filter_falls_back_to_the_database(self):
+        """Test that a query matching more than SEARCH_FILTER_MAX_IDS products is not sent as an IN list"""
+        import tempfile
+        from django.test import override_settings
+        from .search.backends import InvertedIndexBackend, SEARCH_FILTER_MAX_IDS
+        index = InvertedIndex({
+            product_id: {term: 1 for term in analyze('чайник')} for product_id in range(1, SEARCH_FILTER_MAX_IDS + 2)
+        })
+        with tempfile.TemporaryDirectory() as path, override_settings(SEARCH_QUERY_REWRITE=False):
+            backend = InvertedIndexBackend(path)
+            queryset = Product.objects.all()
+            with patch.object(backend.disk, 'sync', return_value=index), \
+                    patch.object(backend.fallback, 'filter', return_value=queryset.none()) as fallback:
+                backend.filter(queryset, 'чайники')
+                fallback.assert_called_once_with(queryset, 'чайники', 'pk')
+                index.remove(1)
+                self.assertIn(' IN (', str(backend.filter(queryset, 'чайники').query))
+                fallback.assert_called_once()
+
+    def test_index_write_waits_for_the_lock_owner(self):
+        """Test that a writer that cannot get the index lock skips the write and leaves the owner's lock"""
+        import tempfile
+        from .search.index import INDEX_LOCK_KEY, DiskIndex, IndexLockTimeout
+        with tempfile.TemporaryDirectory() as path:
+            disk = DiskIndex(path)
+            disk.write_snapshot({1: {'чайник': 1}})
+            cache.set(INDEX_LOCK_KEY, 'other', 60)
+            try:
+                with patch('products.search.index.INDEX_LOCK_TIMEOUT', 0.1), self.assertRaises(IndexLockTimeout):
+                    disk.append({2: {'чайник': 1}})
+                self.assertEqual(cache.get(INDEX_LOCK_KEY), 'other')
+            finally:
+                cache.delete(INDEX_LOCK_KEY)
+            disk.append({2: {'чайник': 1}})
+            self.assertEqual(set(disk.sync().documents), {1, 2})
+            self.assertIsNone(cache.get(INDEX_LOCK_KEY))
+
+    def test_queue_coalesces_and_can_be_suspended(self):
+        """Test that repeated marks keep one queue row per product and suspended imports queue nothing"""
+        SearchIndexQueueService.mark_dirty([1, 2])
+        SearchIndexQueueService.mark_dirty([2])
+        self.assertEqual(sorted(SearchIndexQueue.objects.values_list('product_id', flat=True)), [1, 2])
+        with SearchIndexQueueService.suspended(rebuild=False):
+            SearchIndexQueueService.mark_dirty([3])
+        self.assertFalse(SearchIndexQueue.objects.filter(product_id=3).exists())
+
+    def test_suggestions_match_any_word_prefix(self):
+        """Test that suggestions match the start of any word and are ordered by popularity"""
+        index = SuggestIndex([
+            ('products', 'Смартфон Apple iPhone 15', '/p/1/', 10),
+            ('products', 'Чехол для смартфона', '/p/2/', 50),
+            ('brands', 'Apple', '/?brand=Apple', 60),
+            ('categories', 'Смартфоны', '/c/phones/', 5),
+        ])
+        result = index.suggest('смарт')
+        self.assertEqual([item['url'] for item in result['products']], ['/p/2/', '/p/1/'])
+        self.assertEqual([item['url'] for item in result['categories']], ['/c/phones/'])
+        self.assertEqual([item['text'] for item in index.suggest('ap')['brands']], ['Apple'])
+        self.assertEqual(index.suggest('iphone 15')['products'][0]['url'], '/p/1/')
+
+    def test_missing_suggest_index_is_queued_not_built(self):
+        """Test that a cache miss returns no suggestions and queues one rebuild instead of building in the request"""
+        from .search.rebuild import REBUILD_LOCK_KEY
+        from .search.suggest import SUGGEST_CACHE_KEY, SuggestService
+        cache.delete_many([SUGGEST_CACHE_KEY.format(language='ru'), REBUILD_LOCK_KEY.format(task='rebuild_search_suggestions')])
+        SuggestService._local.pop('ru', None)
+        with patch.object(SuggestService, 'build') as build, \
+                patch('products.tasks.rebuild_search_suggestions.delay') as delay, \
+                patch('products.search.rebuild.threading.Thread') as thread:
+            self.assertEqual(SuggestService.suggest('смарт', 'ru'), {'products': [], 'brands': [], 'categories': []})
+            SuggestService.suggest('смартф', 'ru')
+            build.assert_not_called()
+            self.assertEqual(thread.call_count, 1)
+            thread.call_args.kwargs['target']()
+            delay.assert_called_once_with()
+
+    def test_rewriter_fixes_layout_translit_and_typos(self):
+        """Test that wrong keyboard layout, transliteration and typos are rewritten to catalog words"""
+        rewriter = QueryRewriter({'смартфон': 5, 'наушники': 3, 'холодильник': 2, 'чехол': 1, 'samsung': 4})
+        self.assertEqual(rewriter.rewrite('cvfhnajy'), 'смартфон')
+        self.assertEqual(rewriter.rewrite('xt[jk'), 'чехол')
+        self.assertEqual(rewriter.rewrite('naushniki'), 'наушники')
+        self.assertEqual(rewriter.rewrite('холодилник samsng'), 'холодильник samsung')
+        self.assertEqual(rewriter.rewrite('Смартфоны S24'), 'Смартфоны S24')
+
+    def test_missing_vocabulary_leaves_queries_unchanged(self):
+        """Test that without a cached vocabulary queries pass through and a rebuild is queued"""
+        from .search.rebuild import REBUILD_LOCK_KEY
+        from .search.rewrite import VOCABULARY_CACHE_KEY, QueryRewriteService
+        cache.delete_many([VOCABULARY_CACHE_KEY, REBUILD_LOCK_KEY.format(task='rebuild_search_vocabulary')])
+        QueryRewriteService._local.clear()
+        with patch.object(QueryRewriteService, 'build') as build, \
+                patch('products.search.rebuild.threading.Thread') as thread:
+            self.assertEqual(QueryRewriteService.rewrite('cvfhnajy'), 'cvfhnajy')
+            build.assert_not_called()
+            self.assertEqual(thread.call_count, 1)
+
+    def test_cached_results_keep_every_id(self):
+        """Test that the cached result list is not truncated, so count and paging cover every match"""
+        Product.objects.bulk_create([Product(sku=f'bulk-{number}', price=100) for number in range(1200)])
+        params = {'q': f'bulk {uuid.uuid4().hex}', 'sort': 'popularity'}
+        build = lambda: Product.objects.order_by('pk')
+        ids = SearchResultCache.get_ids(Product, params, build)
+        self.assertEqual(len(ids), 1200)
+        self.assertEqual(SearchResultCache.get_ids(Product, params, build), ids)
+
+    def test_result_cache_key_ignores_query_formatting(self):
+        """Test that equivalent searches share a cache key and invalidation changes it"""
+        first = ProductQueryCompiler(QueryDict('q=Смартфон  Samsung&tags=3,1'))
+        second = ProductQueryCompiler(QueryDict('tags=1&tags=3&q=смартфон samsung'))
+        key = SearchResultCache.cache_key(Product, SearchResultCache.normalize(first))
+        self.assertEqual(key, SearchResultCache.cache_key(Product, SearchResultCache.normalize(second)))
+        SearchResultCache.invalidate()
+        self.assertNotEqual(key, SearchResultCache.cache_key(Product, SearchResultCache.normalize(first)))
+
+    def test_search_page_is_ordered_by_relevance(self):
+        """Test that a search without an explicit sort lists products by rank, not by popularity"""
+        from django.test import override_settings
+        from .search import get_search_backend
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(slug='teapots', name='Чайники')
+            products = [
+                Product.objects.create(sku=f't{number}', category=category, price=100, popularity_score=score)
+                for number, score in enumerate([30, 20, 10])
+            ]
+        # Чем выше частота терма в коротком документе, тем выше BM25
+        index = InvertedIndex({
+            products[0].pk: {'чайник': 1, 'стекл': 5, 'литр': 5},
+            products[1].pk: {'чайник': 6},
+            products[2].pk: {'чайник': 3, 'литр': 1},
+        })
+        SearchResultCache.invalidate()
+        url = f'/ru/category/{category.slug}/'
+        with override_settings(SEARCH_QUERY_REWRITE=False), \
+                patch.object(get_search_backend().disk, 'sync', return_value=index):
+            ranked = self.client.get(url, {'q': 'чайник'}).context['products']
+            popular = self.client.get(url, {'q': 'чайник', 'sort': 'popularity'}).context['products']
+        self.assertEqual([card.product_id for card in ranked], [products[1].pk, products[2].pk, products[0].pk])
+        self.assertEqual([card.product_id for card in popular], [product.pk for product in products])
+
+
+class ViewCounterTest(TestCase):
+    def test_views_are_deduplicated_and_flushed_in_batches(self):
+        """Test that repeated views by one visitor count once and reach the database only on flush"""
+        from .models import ProductViewBuffer
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(sku='p1', price=100)
+        first = RequestFactory().get('/', REMOTE_ADDR=f'10.0.{uuid.uuid4().int % 250}.1')
+        second = RequestFactory().get('/', REMOTE_ADDR=f'10.0.{uuid.uuid4().int % 250}.2')
+        with self.assertNumQueries(0):
+            self.assertTrue(ViewCounterService.record(first, product.pk))
+            self.assertFalse(ViewCounterService.record(first, product.pk))
+            self.assertTrue(ViewCounterService.record(second, product.pk))
+        ViewCounterService.handoff()
+        self.assertEqual(sum(ProductViewBuffer.objects.values_list('views', flat=True)), 2)
+
+        self.assertEqual(ViewCounterService.flush(), 2)
+        product.refresh_from_db()
+        self.assertEqual(product.views_count, 2)
+        self.assertEqual(ProductListing.objects.get(product=product, language_code='ru').views_count, 2)
+        self.assertFalse(ProductViewBuffer.objects.exists())
+        self.assertEqual(ViewCounterService.flush(), 0)
+
+    def test_buffer_is_handed_off_at_request_end_when_due(self):
+        """Test that the end of a request moves the buffer to the database only once it is due"""
+        from django.core.signals import request_finished
+        from .models import ProductViewBuffer
+        product = Product.objects.create(sku='p2', price=100)
+        ViewCounterService.record(None, product.pk)
+        request_finished.send(sender=self.__class__)
+        self.assertFalse(ProductViewBuffer.objects.exists())
+
+        with patch('products.view_counter.VIEW_HANDOFF_INTERVAL', 0):
+            request_finished.send(sender=self.__class__)
+        self.assertEqual(list(ProductViewBuffer.objects.values_list('product_id', 'views')), [(product.pk, 1)])
+
+
+class ProductViewStatsTest(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first = Product.objects.create(sku='p1', price=100)
+            self.second = Product.objects.create(sku='p2', price=100)
+
+    def test_daily_views_are_placed_by_date(self):
+        """Test that daily rows fill a zero-based series from start to end"""
+        ProductDailyViews.objects.bulk_create([
+            ProductDailyViews(product=self.first, date=date(2025, 1, 1), views=5),
+            ProductDailyViews(product=self.first, date=date(2025, 1, 3), views=2),
+            ProductDailyViews(product=self.first, date=date(2025, 1, 5), views=9),
+        ])
+        series = ProductViewStatsService.get_daily_views([self.first.pk, self.second.pk], date(2025, 1, 1), date(2025, 1, 4))
+        self.assertEqual(series, {self.first.pk: [5, 0, 2, 0], self.second.pk: [0, 0, 0, 0]})
+
+    def test_views_are_merged_into_existing_rows(self):
+        """Test that new views add to existing daily rows, create missing ones and skip deleted products"""
+        day = date(2025, 1, 1)
+        ProductDailyViews.objects.create(product=self.first, date=day, views=3)
+        ProductViewStatsService.add_daily_views({
+            (self.first.pk, day): 2,
+            (self.first.pk, day + timedelta(days=1)): 4,
+            (self.second.pk, day): 1,
+            (self.second.pk + 1000, day): 7,
+            (self.second.pk, day + timedelta(days=1)): 0,
+        })
+        self.assertEqual(
+            set(ProductDailyViews.objects.values_list('product_id', 'date', 'views')),
+            {(self.first.pk, day, 5), (self.first.pk, day + timedelta(days=1), 4), (self.second.pk, day, 1)},
+        )
+
+    def test_overlapping_batches_add_up(self):
+        """Test that two batches for the same product and day both count"""
+        day = date(2025, 1, 1)
+        ProductViewStatsService.add_daily_views({(self.first.pk, day): 2, (self.second.pk, day): 1})
+        ProductViewStatsService.add_daily_views({(self.first.pk, day): 3, (self.first.pk, day + timedelta(days=1)): 1})
+        self.assertEqual(
+            set(ProductDailyViews.objects.values_list('product_id', 'date', 'views')),
+            {(self.first.pk, day, 5), (self.first.pk, day + timedelta(days=1), 1), (self.second.pk, day, 1)},
+        )
+
+    def test_rollup_deletes_rows_past_retention(self):
+        """Test that the rollup keeps rows inside the retention period and deletes older ones"""
+        from django.utils import timezone
+        from .view_stats import PRODUCT_VIEWS_RETENTION_DAYS
+        today = timezone.localdate()
+        oldest_kept = today - timedelta(days=PRODUCT_VIEWS_RETENTION_DAYS)
+        ProductDailyViews.objects.bulk_create([
+            ProductDailyViews(product=self.first, date=today, views=1),
+            ProductDailyViews(product=self.first, date=oldest_kept, views=1),
+            ProductDailyViews(product=self.first, date=oldest_kept - timedelta(days=1), views=1),
+            ProductDailyViews(product=self.second, date=oldest_kept - timedelta(days=30), views=1),
+        ])
+        self.assertEqual(ProductViewStatsService.rollup(), 2)
+        self.assertEqual(sorted(ProductDailyViews.objects.values_list('date', flat=True)), [oldest_kept, today])
+
+
+class PopularityServiceTest(TestCase):
+    def test_scores_of_different_days_are_comparable(self):
+        """Test that unchanged activity keeps its order while newer activity outranks older"""
+        today = date(2025, 3, 1)
+        week_later = today + timedelta(days=POPULARITY_HALF_LIFE_DAYS)
+        old = PopularityService.score(100, today=today)
+        # Та же активность неделю спустя затухла вдвое — оценка та же
+        self.assertAlmostEqual(PopularityService.score(50, today=week_later), old)
+        self.assertGreater(PopularityService.score(51, today=week_later), old)
+        self.assertGreater(PopularityService.score(100, 5, 10, today), PopularityService.score(100, 2, 10, today))
+        self.assertEqual(PopularityService.score(0, today=today), 0)
+
+
+class RelatedProductServiceTest(TestCase):
+    def test_cooccurrence_prefers_frequent_pairs(self):
+        """Test that products bought together more often are more similar"""
+        scores = defaultdict(Counter)
+        groups = [{1, 2}, {1, 2}, {1, 3}, {1, 4, 5}]
+        RelatedProductService.add_cooccurrence(scores, groups, 1, allowed={1, 2, 3, 4})
+        self.assertEqual([product_id for product_id, _score in scores[1].most_common()], [2, 3, 4])
+        self.assertAlmostEqual(scores[1][2], scores[2][1])
+        self.assertNotIn(5, scores)
+
+
+class RecommendationPoolServiceTest(TestCase):
+    def test_sample_skips_cart_products(self):
+        """Test that products already in the cart are never recommended"""
+        pool = list(range(1, 21))
+        for _attempt in range(20):
+            sample = RecommendationPoolService.sample(pool, {1, 2, 3}, 10)
+            self.assertEqual(len(sample), 10)
+            self.assertEqual(len(set(sample)), 10)
+            self.assertFalse({1, 2, 3} & set(sample))
+
+    def test_missing_pool_is_queued_not_built(self):
+        """Test that a pool cache miss returns no candidates and queues the refresh task instead of building inline"""
+        from .recommendations import RECOMMENDATION_POOL_KEY
+        from .search.rebuild import REBUILD_LOCK_KEY
+        cache.delete_many([RECOMMENDATION_POOL_KEY, REBUILD_LOCK_KEY.format(task='refresh_recommendation_pool')])
+        with patch.object(RecommendationPoolService, 'refresh') as refresh, \
+                patch('products.search.rebuild.threading.Thread') as thread:
+            self.assertEqual(RecommendationPoolService.get_pool(), [])
+            refresh.assert_not_called()
+            self.assertEqual(thread.call_count, 1)
+
+
+class CartServiceTest(TestCase):
+    def test_contents_use_final_price_once_per_line(self):
+        """Test that cart totals are computed from discounted prices of hydrated lines"""
+        contents = CartContents([
+            CartLine(Product(pk=1, price=Decimal('100'), discount_price=Decimal('80')), 2),
+            CartLine(Product(pk=2, price=Decimal('15.50')), 3),
+        ])
+        self.assertEqual(contents.total_items, 5)
+        self.assertEqual(contents.total_price, Decimal('206.50'))
+        self.assertEqual(contents.product_ids, [1, 2])
+
+    def test_empty_cart_needs_no_queries(self):
+        """Test that an empty cart is hydrated without touching the database"""
+        with self.assertNumQueries(0):
+            contents = CartService.hydrate({})
+        self.assertEqual((len(contents), contents.total_price), (0, 0))
+
+
+class CartStoreTest(TestCase):
+    def test_legacy_session_formats_are_normalized(self):
+        """Test that both old session cart formats become {product_id: quantity}"""
+        legacy = {'1': 2, '2': {'quantity': 3, 'price': 10.0}, '3': 0, 'x': 1}
+        self.assertEqual(normalize_quantities(legacy), {1: 2, 2: 3})
+
+    def test_guest_cart_writes_only_its_token_to_session(self):
+        """Test that the guest cart lives in the cache and the session keeps only its key"""
+        session = {}
+        store = CacheCartStore(session)
+        store.add(1, 2)
+        store.add(1, 5, limit=4)
+        store.add(2, 1)
+        self.assertEqual(list(session), [CART_SESSION_KEY])
+        self.assertEqual(CacheCartStore(session).get(), {1: 4, 2: 1})
+        store.clear()
+        self.assertEqual(CacheCartStore(session).get(), {})
+
+    def test_guest_cart_keeps_one_key_per_line(self):
+        """Test that guest cart lines live under separate keys and old whole-dict carts are converted"""
+        from .cart import CART_CACHE_KEY, CART_LINE_KEY
+        session = {}
+        first, second = CacheCartStore(session), CacheCartStore(session)
+        first.add(1, 1)
+        second.add(2, 3)
+        first.add(1, 2)
+        first.set(3, 5)
+        second.remove(3)
+        self.assertEqual(CacheCartStore(session).get(), {1: 3, 2: 3})
+        token = session[CART_SESSION_KEY]
+        self.assertEqual(cache.get(CART_LINE_KEY.format(token=token, product_id=1)), 3)
+
+        # Корзина прежнего формата (словарь целиком) переносится в позиции при чтении
+        cache.set(CART_CACHE_KEY.format(token=token), {'1': 2, '4': {'quantity': 1}})
+        self.assertEqual(CacheCartStore(session).get(), {1: 2, 4: 1})
+        self.assertEqual(cache.get(CART_CACHE_KEY.format(token=token)), [1, 4])
+
+    def test_concurrent_guest_adds_keep_every_product(self):
+        """Test that two requests adding different products at once both stay in the cart"""
+        from django.test import override_settings
+        # Как у Redis, add в локальном кэше атомарен (в файловом — нет)
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'cart-lock-test'}}
+        with override_settings(CACHES=locmem):
+            self.add_concurrently()
+
+    def add_concurrently(self):
+        session = {}
+        CacheCartStore(session).add(1, 1)
+        barrier = threading.Barrier(2)
+        original = CacheCartStore.get_product_ids
+
+        def get_product_ids(store):
+            product_ids = original(store)
+            # Без блокировки оба запроса прочитали бы один и тот же список
+            try:
+                barrier.wait(timeout=0.2)
+            except threading.BrokenBarrierError:
+                pass
+            return product_ids
+
+        def add(product_id):
+            CacheCartStore(session).add(product_id, 1)
+
+        with patch.object(CacheCartStore, 'get_product_ids', get_product_ids):
+            threads = [threading.Thread(target=add, args=(product_id,)) for product_id in (2, 3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(CacheCartStore(session).get(), {1: 1, 2: 1, 3: 1})
+
+    def test_guest_summary_is_served_from_cache(self):
+        """Test that the header badge summary of a guest cart needs no database queries"""
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.session = {}
+        self.assertEqual(CartService.get_summary(request), {'count': 0, 'subtotal': 0, 'currency': 'RUB'})
+        CacheCartStore(request.session).save({})
+        cache.set(CacheCartStore(request.session).summary_key, {'count': 2, 'subtotal': Decimal('10'), 'currency': 'RUB'})
+        with self.assertNumQueries(0):
+            self.assertEqual(CartService.get_summary(request)['count'], 2)
+
+
+class CheckoutServiceTest(TestCase):
+    def test_unavailable_covers_missing_and_inactive_products(self):
+        """Test that checkout rejects removed and inactive cart lines before touching stock"""
+        products = {
+            1: Product(pk=1, is_active=True, stock_quantity=0),
+            3: Product(pk=3, is_active=False, stock_quantity=9),
+        }
+        self.assertEqual(CheckoutService.get_unavailable(products, [1, 3, 4]), [3, 4])
+        self.assertEqual(CheckoutService.get_shipping_cost('post'), Decimal('150.00'))
+        self.assertEqual(CheckoutService.get_shipping_cost('pickup'), Decimal('0.00'))
+
+    def test_cancel_returns_stock_once(self):
+        """Test that cancelling an order puts its units back on stock only on the first cancel"""
+        user = get_user_model().objects.create_user(username='canceller', email='canceller@example.com')
+        product = Product.objects.create(sku='CANCEL-1', price=Decimal('100.00'), stock_quantity=5, name='Товар')
+        DatabaseCartStore(user).add(product.pk, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = CheckoutService.place_order(user, Order(shipping_address='Москва'), 'pickup', 'card')
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(CheckoutService.cancel_order(order))
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 5)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+
+        self.assertFalse(CheckoutService.cancel_order(order))
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 5)
+
+    def test_repeated_checkout_page_keeps_one_hold(self):
+        """Test that opening the checkout page twice holds the cart once and only extends the hold"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        user = get_user_model().objects.create_user(username='twotabs', email='twotabs@example.com')
+        product = Product.objects.create(sku='CHECKOUT-1', price=Decimal('100.00'), stock_quantity=5, name='Товар')
+        DatabaseCartStore(user).add(product.pk, 2)
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(reverse('checkout_view')).status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 3)
+        expires_at = StockReservation.objects.get(user=user).expires_at
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('checkout_view')).status_code, 200)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "products_product"')])
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 3)
+        self.assertGreater(StockReservation.objects.get(user=user).expires_at, expires_at)
+
+    def test_cancel_skips_orders_placed_without_taking_stock(self):
+        """Test that cancelling an order whose stock was never taken leaves stock alone"""
+        from .models import OrderItem
+        user = get_user_model().objects.create_user(username='legacy', email='legacy@example.com')
+        product = Product.objects.create(sku='CANCEL-2', price=Decimal('100.00'), stock_quantity=5, name='Товар')
+        order = Order.objects.create(user=user, status='confirmed', total_amount=Decimal('200.00'), shipping_address='Москва')
+        OrderItem.objects.create(order=order, product=product, quantity=2, price=Decimal('100.00'), total_price=Decimal('200.00'))
+        self.assertTrue(CheckoutService.cancel_order(order))
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 5)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+
+
+class InventoryServiceTest(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.other = User.objects.create_user(username='other', email='other@example.com')
+        self.product = Product.objects.create(sku='STOCK-1', price=Decimal('100.00'), stock_quantity=10, name='Товар')
+
+    def assertStock(self, expected):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, expected)
+
+    def test_conditional_take_reports_shortages(self):
+        """Test that a decrement no row can satisfy changes nothing and names the products"""
+        with self.assertRaises(InsufficientStock) as raised:
+            InventoryService.take({987654: 1, 987655: 0})
+        self.assertEqual(raised.exception.product_ids, [987654])
+        self.assertEqual(InventoryService.release_expired(), 0)
+
+    def test_reserve_takes_units_off_free_stock(self):
+        """Test that a hold leaves the rest free and reports what could not be held"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(InventoryService.reserve(self.buyer, {self.product.pk: 4}), [])
+        self.assertStock(6)
+        self.assertEqual(InventoryService.get_available(self.product, self.buyer), 10)
+        self.assertEqual(InventoryService.get_available(self.product, self.other), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(InventoryService.reserve(self.other, {self.product.pk: 7}), [self.product.pk])
+        self.assertStock(6)
+        self.assertFalse(StockReservation.objects.filter(user=self.other).exists())
+
+    def test_consume_uses_own_hold_then_free_stock(self):
+        """Test that an order takes the buyer's hold first and only the rest from free stock"""
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryService.reserve(self.buyer, {self.product.pk: 3})
+            InventoryService.consume(self.buyer, {self.product.pk: 5})
+        self.assertStock(5)
+        self.assertFalse(StockReservation.objects.filter(user=self.buyer).exists())
+
+    def test_consume_returns_surplus_hold(self):
+        """Test that held units the order did not need go back on stock"""
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryService.reserve(self.buyer, {self.product.pk: 4})
+            InventoryService.consume(self.buyer, {self.product.pk: 1})
+        self.assertStock(9)
+        self.assertFalse(StockReservation.objects.filter(user=self.buyer).exists())
+
+    def test_release_expired_returns_stock(self):
+        """Test that only expired holds are released and their units returned"""
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryService.reserve(self.buyer, {self.product.pk: 2}, ttl=timedelta(seconds=-1))
+            InventoryService.reserve(self.other, {self.product.pk: 3})
+        self.assertStock(5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(InventoryService.release_expired(), 1)
+        self.assertStock(7)
+        self.assertEqual(list(StockReservation.objects.values_list('user', flat=True)), [self.other.pk])
+
+    def test_admin_stock_is_on_hand_count(self):
+        """Test that stock entered in the admin has live holds subtracted and expiry never overshoots it"""
+        from types import SimpleNamespace
+        from django.contrib import admin
+        from .admin import ProductAdmin
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryService.reserve(self.buyer, {self.product.pk: 2}, ttl=timedelta(seconds=-1))
+            InventoryService.reserve(self.other, {self.product.pk: 3}, ttl=timedelta(seconds=-1))
+        model_admin = ProductAdmin(Product, admin.site)
+
+        def enter_stock(on_hand):
+            self.product.refresh_from_db()
+            self.product.stock_quantity = on_hand
+            form = SimpleNamespace(changed_data=['stock_quantity'], cleaned_data={'stock_quantity': on_hand})
+            model_admin.save_model(None, self.product, form, change=True)
+
+        enter_stock(20)
+        self.assertStock(15)
+        enter_stock(4)
+        self.assertStock(0)
+        self.assertEqual(
+            dict(StockReservation.objects.values_list('user', 'quantity')), {self.buyer.pk: 2, self.other.pk: 2},
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryService.release_expired()
+        self.assertStock(4)
+
+        # Прямое сохранение задает свободный остаток как есть и резервы не читает
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.product.stock_quantity = 7
+        with CaptureQueriesContext(connection) as queries:
+            self.product.save()
+        self.assertFalse([query for query in queries if 'stockreservation' in query['sql']])
+        self.assertStock(7)
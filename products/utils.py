@@ -219,42 +219,47 @@ class CategorySubcategoryGenerator:
         template = self.SUBCATEGORIES_MAP[template_key]
         created_categories = []
         
+        # Всё существующее поддерево загружаем одним запросом по индексу пути,
+        # чтобы не проверять каждую подкатегорию отдельным запросом
+        existing = {
+            (node.parent_id, node.safe_translation_getter('name', any_language=True)): node
+            for node in category.get_descendants().prefetch_related('translations')
+        }
+        
         # Создаем подкатегории 2-го уровня
         for subcategory_name in template['level_2']:
-            unique_slug = self._generate_unique_slug(subcategory_name, category)
-            
-            subcategory, created = Category.objects.get_or_create(
-                name=subcategory_name,
-                parent=category,
-                defaults={
-                    'slug': unique_slug,
-                    'category_level': 1,
-                    'is_active': True,
-                    'show_in_megamenu': True,
-                    'sort_order': len(created_categories)
-                }
-            )
-            if created:
+            subcategory = existing.get((category.pk, subcategory_name))
+            if subcategory is None:
+                unique_slug = self._generate_unique_slug(subcategory_name, category)
+                
+                subcategory = Category.objects.create(
+                    name=subcategory_name,
+                    parent=category,
+                    slug=unique_slug,
+                    category_level=1,
+                    is_active=True,
+                    show_in_megamenu=True,
+                    sort_order=len(created_categories)
+                )
                 created_categories.append(subcategory)
             
             # Создаем подкатегории 3-го уровня
             if subcategory_name in template['level_3']:
                 for sub_subcategory_name in template['level_3'][subcategory_name]:
+                    if (subcategory.pk, sub_subcategory_name) in existing:
+                        continue
                     sub_unique_slug = self._generate_unique_slug(sub_subcategory_name, subcategory)
                     
-                    sub_subcategory, sub_created = Category.objects.get_or_create(
+                    sub_subcategory = Category.objects.create(
                         name=sub_subcategory_name,
                         parent=subcategory,
-                        defaults={
-                            'slug': sub_unique_slug,
-                            'category_level': 2,
-                            'is_active': True,
-                            'show_in_megamenu': True,
-                            'sort_order': 0
-                        }
+                        slug=sub_unique_slug,
+                        category_level=2,
+                        is_active=True,
+                        show_in_megamenu=True,
+                        sort_order=0
                     )
-                    if sub_created:
-                        created_categories.append(sub_subcategory)
+                    created_categories.append(sub_subcategory)
         
         return created_categories
     
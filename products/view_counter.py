@@ -0,0 +1,169 @@
+"""
+Отложенный счетчик просмотров товаров (write-behind)
+
+Страница товара не пишет в базу: просмотр учитывается в памяти процесса,
+повторные просмотры тем же посетителем за VIEW_DEDUP_TIMEOUT отбрасываются
+(метка в кэше через cache.add). В конце запроса, если первый просмотр в
+буфере ждет дольше VIEW_HANDOFF_INTERVAL секунд или буфер переполнен,
+накопленные приращения одним INSERT складываются в таблицу
+ProductViewBuffer (сигнал request_finished), а периодическая задача
+flush_product_views забирает ее строки пачками и применяет к
+Product.views_count и карточкам ProductListing несколькими UPDATE — по
+одному на каждое различное приращение, — а также к дневным просмотрам
+(ProductDailyViews).
+
+Передача идет через базу, а не через кэш: файловый кэш не гарантирует
+атомарных incr/add, и пачки разных процессов могли бы затереть друг друга.
+Фоновых потоков и обработчиков выхода нет: процесс, в который перестали
+приходить запросы, передаст свой буфер со следующим запросом, а при
+остановке теряет не больше VIEW_HANDOFF_INTERVAL секунд своих просмотров.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, ProductListing, ProductViewBuffer
+from .view_stats import ProductViewStatsService
+
+logger = logging.getLogger(__name__)
+
+VIEW_DEDUP_KEY = 'product_views:seen:{visitor}:{product_id}'
+VIEW_DEDUP_TIMEOUT = 60 * 30
+VIEW_HANDOFF_INTERVAL = 5
+# Пачка передается раньше срока, если в буфере накопилось столько товаров
+VIEW_HANDOFF_MAX_PRODUCTS = 1000
+# Сколько строк буфера применяется за одну транзакцию
+VIEW_FLUSH_BATCH_SIZE = 5000
+
+
+class ViewCounterService:
+    """Учет просмотров товаров без записи в базу на пути запроса"""
+
+    _buffer = Counter()
+    _lock = threading.Lock()
+    # Время (time.monotonic) первого просмотра в непустом буфере
+    _started = None
+
+    @staticmethod
+    def record(request, product_id):
+        """
+        Учитывает просмотр товара посетителем
+
+        Returns:
+            bool: True, если просмотр засчитан (а не повтор в пределах VIEW_DEDUP_TIMEOUT)
+        """
+        if request is not None:
+            key = VIEW_DEDUP_KEY.format(visitor=ViewCounterService.get_visitor(request), product_id=product_id)
+            if not cache.add(key, 1, VIEW_DEDUP_TIMEOUT):
+                return False
+        with ViewCounterService._lock:
+            if not ViewCounterService._buffer:
+                ViewCounterService._started = time.monotonic()
+            ViewCounterService._buffer[(product_id, timezone.localdate())] += 1
+        return True
+
+    @staticmethod
+    def get_visitor(request):
+        """Идентификатор посетителя: сессия, иначе пользователь, иначе IP и User-Agent"""
+        session = getattr(request, 'session', None)
+        if session is not None and session.session_key:
+            visitor = f's:{session.session_key}'
+        elif getattr(request, 'user', None) is not None and request.user.is_authenticated:
+            visitor = f'u:{request.user.pk}'
+        else:
+            visitor = f"a:{request.META.get('REMOTE_ADDR', '')}:{request.META.get('HTTP_USER_AGENT', '')}"
+        return hashlib.md5(visitor.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def handoff():
+        """Передает буфер процесса в базу одним INSERT"""
+        with ViewCounterService._lock:
+            deltas = dict(ViewCounterService._buffer)
+            ViewCounterService._buffer.clear()
+            ViewCounterService._started = None
+        if not deltas:
+            return 0
+        try:
+            ProductViewBuffer.objects.bulk_create([
+                ProductViewBuffer(product_id=product_id, date=day, views=views)
+                for (product_id, day), views in deltas.items()
+            ])
+        except Exception:
+            # Просмотры возвращаются в буфер и уйдут со следующей передачей
+            logger.exception('Не удалось передать просмотры товаров')
+            with ViewCounterService._lock:
+                if not ViewCounterService._buffer:
+                    ViewCounterService._started = time.monotonic()
+                ViewCounterService._buffer.update(deltas)
+            return 0
+        return len(deltas)
+
+    @staticmethod
+    def handoff_if_due():
+        """Передает буфер в конце запроса, если он ждет дольше VIEW_HANDOFF_INTERVAL или переполнен"""
+        with ViewCounterService._lock:
+            due = bool(ViewCounterService._buffer) and (
+                len(ViewCounterService._buffer) >= VIEW_HANDOFF_MAX_PRODUCTS
+                or time.monotonic() - ViewCounterService._started >= VIEW_HANDOFF_INTERVAL
+            )
+        return ViewCounterService.handoff() if due else 0
+
+    @staticmethod
+    def flush(batch_size=VIEW_FLUSH_BATCH_SIZE):
+        """
+        Применяет накопленные в ProductViewBuffer просмотры к базе
+
+        Строки забираются пачками с блокировкой (SKIP LOCKED), применяются и
+        удаляются в одной транзакции, поэтому параллельные запуски задачи не
+        учитывают одни и те же просмотры дважды.
+
+        Returns:
+            int: Количество учтенных просмотров
+        """
+        total = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    ProductViewBuffer.objects.select_for_update(skip_locked=True)
+                    .order_by('pk').values_list('pk', 'product_id', 'date', 'views')[:batch_size]
+                )
+                totals = Counter()
+                for _pk, product_id, day, views in rows:
+                    totals[(product_id, day)] += views
+                ViewCounterService.apply(totals)
+                ProductViewBuffer.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            total += sum(totals.values())
+            if len(rows) < batch_size:
+                break
+
+        if total:
+            logger.info('Записано просмотров: %s', total)
+        return total
+
+    @staticmethod
+    def apply(totals):
+        """
+        Прибавляет просмотры к товарам, карточкам и дневной статистике
+
+        Args:
+            totals: {(product_id, дата): просмотры}
+        """
+        per_product = Counter()
+        for (product_id, _day), views in totals.items():
+            per_product[product_id] += views
+        by_delta = defaultdict(list)
+        for product_id, delta in per_product.items():
+            if delta > 0:
+                by_delta[delta].append(product_id)
+        with transaction.atomic():
+            for delta, product_ids in by_delta.items():
+                Product.objects.filter(pk__in=product_ids).update(views_count=F('views_count') + delta)
+                ProductListing.objects.filter(product_id__in=product_ids).update(views_count=F('views_count') + delta)
+            ProductViewStatsService.add_daily_views(totals)
@@ -0,0 +1,89 @@
+"""
+Просмотры товаров по дням
+
+Счетчик просмотров (ViewCounterService) передает сюда пачки приращений с
+датой; они складываются в строки ProductDailyViews. По ним считаются
+популярность товаров (PopularityService) и графики аналитики. Периодическая
+задача удаляет строки старше PRODUCT_VIEWS_RETENTION_DAYS.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, ProductDailyViews
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_VIEWS_RETENTION_DAYS = 400
+
+
+class ProductViewStatsService:
+    """Запись и чтение дневных просмотров товаров"""
+
+    @staticmethod
+    def add_daily_views(views_by_day):
+        """
+        Прибавляет просмотры к дневным строкам
+
+        Недостающие строки создаются с нулем (INSERT ... ON CONFLICT DO
+        NOTHING), затем просмотры прибавляются в базе через F(), по одному
+        UPDATE на каждую пару (дата, приращение). Поэтому параллельные
+        запуски не затирают приращения друг друга и не падают на
+        уникальности (product, date).
+
+        Args:
+            views_by_day: {(product_id, date): просмотры}
+        """
+        views_by_day = {key: views for key, views in views_by_day.items() if views > 0}
+        if not views_by_day:
+            return
+        # Удаленные за время буферизации товары пропускаются
+        alive = set(Product.objects.filter(
+            pk__in={product_id for product_id, _day in views_by_day},
+        ).values_list('pk', flat=True))
+        views_by_day = {key: views for key, views in views_by_day.items() if key[0] in alive}
+
+        by_delta = defaultdict(list)
+        for (product_id, day), views in views_by_day.items():
+            by_delta[(day, views)].append(product_id)
+        with transaction.atomic():
+            ProductDailyViews.objects.bulk_create(
+                [ProductDailyViews(product_id=product_id, date=day, views=0) for product_id, day in views_by_day],
+                batch_size=500, ignore_conflicts=True,
+            )
+            for (day, views), product_ids in by_delta.items():
+                ProductDailyViews.objects.filter(product_id__in=product_ids, date=day).update(views=F('views') + views)
+
+    @staticmethod
+    def get_daily_views(product_ids, start, end):
+        """
+        Просмотры товаров по дням за период одним запросом
+
+        Returns:
+            dict: {product_id: [просмотры за start, start + 1 день, ..., end]}
+        """
+        days = (end - start).days + 1
+        result = {product_id: [0] * days for product_id in product_ids}
+        rows = ProductDailyViews.objects.filter(
+            product_id__in=product_ids, date__gte=start, date__lte=end,
+        ).values_list('product_id', 'date', 'views')
+        for product_id, day, views in rows:
+            result[product_id][(day - start).days] = views
+        return result
+
+    @staticmethod
+    def rollup():
+        """
+        Удаляет дневные строки старше PRODUCT_VIEWS_RETENTION_DAYS
+
+        Returns:
+            int: Количество удаленных строк
+        """
+        retention_start = timezone.localdate() - timedelta(days=PRODUCT_VIEWS_RETENTION_DAYS)
+        deleted, _details = ProductDailyViews.objects.filter(date__lt=retention_start).delete()
+        logger.info('Удалено старых строк дневных просмотров: %s', deleted)
+        return deleted
@@ -3,7 +3,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.paginator import Paginator
-from django.db.models import Q, Min, Max
+from django.db.models import Min, Max
 from django.urls import reverse_lazy
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
 from django.contrib.messages.views import SuccessMessageMixin
@@ -13,24 +13,37 @@ from django.utils import translation
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 from django.views.decorators.http import require_http_methods
-from django.db.models import F, Count
-from decimal import Decimal
-from django.db import models
+from django.db.models import Count
 # PostgreSQL search imports (conditionally imported where needed)
 # from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
 from django_filters.views import FilterView
 from .filters import ProductFilter # Этот файл еще не создан, но будет создан позже
 from .forms import ProductForm, ProductImageForm, CategoryForm, ShopForm, TagForm, OrderForm, OrderItemForm, TaskForm, MoodTrackingForm
-from .models import Product, Category, Shop, Tag, ProductImage, User, Location, UserLocation, PageCategory, Page, Order, OrderItem, Cart, CartItem, Banner, ProductBanner, Task, MoodTracking
+from .models import Product, Category, Shop, Tag, ProductImage, User, Location, UserLocation, PageCategory, Page, Order, Cart, CartItem, Banner, ProductBanner, Task, MoodTracking
+from .catalog_filters import ProductQueryCompiler
+from .card_cache import ProductCardCache
+from .category_tree import CategoryTreeService
+from .checkout import CheckoutError, CheckoutService
+from .facets import FacetService
+from .inventory import InventoryService
+from .listing import ProductListingService
+from .page_cache import cache_anonymous_page
+from .related import RelatedProductService
+from .search import get_search_backend
+from .search.results import RELEVANCE_SORT, SearchResultCache
+from .view_counter import ViewCounterService
+from .pagination import InvalidCursor, SORT_ORDERS, DEFAULT_SORT
 # from .services.product_service import ProductService # Импортируем сервис
 from django.forms import inlineformset_factory
 
 # Аутентификация перенесена в products/views/auth_views.py
 
 # Главная страница и список товаров
+@cache_anonymous_page
 def index(request):
     """Главная страница с товарами в стиле Ozon"""
-    products = Product.objects.filter(is_active=True).select_related('category', 'seller').prefetch_related('images', 'tags')
+    # Карточки берутся из денормализованной таблицы ProductListing
+    products = ProductListingService.listing_queryset()
     categories = Category.objects.all()[:12]
     banners = Banner.objects.filter(is_active=True).order_by('sort_order')
     
@@ -48,35 +61,17 @@ def index(request):
     if category_param:
         # Убираем возможные суффиксы типа :1
         category_param = category_param.split(':')[0]
-        
-        # Пытаемся найти категорию по ID или slug
-        try:
-            # Если это число, ищем по ID
-            category_id = int(category_param)
-            products = products.filter(category_id=category_id)
-        except ValueError:
-            # Если не число, ищем по slug
-            products = products.filter(category__slug=category_param)
     
-    # Поиск
+    # Фильтрация по категории (ID или slug) и поиск
     search_query = request.GET.get('q')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(tags__name__icontains=search_query)
-        ).distinct()
+    compiler = ProductQueryCompiler(request.GET)
     
-    # Пагинация
-    paginator = Paginator(products, 20)
-    page_number = request.GET.get('page')
-    products = paginator.get_page(page_number)
+    # Первая страница ленты; следующие подгружает load_more_products по курсору.
+    # Выдача поиска листается по закэшированному списку id
+    products = SearchResultCache.paginator(products, compiler, 20).get_page()
     
-    # Получаем корневые категории для мегаменю
-    root_categories = Category.objects.filter(
-        parent__isnull=True, 
-        is_active=True
-    ).order_by('sort_order')
+    # Дерево категорий из кэша (мегаменю приходит из контекстного процессора)
+    root_categories = CategoryTreeService.get_tree()
     
     # Если это страница категории, перенаправляем на правильный URL категории
     if not is_main_page and category_param:
@@ -93,9 +88,9 @@ def index(request):
     # Главная страница
     context = {
         'products': products,
+        'product_cards': ProductCardCache.render_cards(products),
         'categories': categories,
         'root_categories': root_categories,
-        'catalog_categories': root_categories,  # Для мегаменю
         'search_query': search_query,
         'is_main_page': is_main_page,
         'category_param': category_param,
@@ -107,147 +102,84 @@ def index(request):
 
 @require_http_methods(["GET"])
 def load_more_products(request):
-    """AJAX endpoint для загрузки следующих страниц товаров"""
-    page = request.GET.get('page', 1)
-    search_query = request.GET.get('q', '')
-    category_param = request.GET.get('category', '')
-    
-    try:
-        page = int(page)
-    except (ValueError, TypeError):
-        page = 1
-    
-    # Получаем товары (такая же логика как в index)
-    products = Product.objects.filter(is_active=True).select_related('category', 'seller').prefetch_related('images', 'tags')
-    
-    # Фильтрация по категории
+    """AJAX endpoint для загрузки следующих страниц товаров (keyset-пагинация по курсору)"""
+    cursor = request.GET.get('cursor')
+    with_count = request.GET.get('with_count') == '1'
+    
+    # Получаем карточки товаров (такая же логика как в index)
+    products = ProductListingService.listing_queryset()
+    compiler = ProductQueryCompiler(request.GET)
+    category_param = compiler.filters['category']
     if category_param:
-        category_param = category_param.split(':')[0]
-        try:
-            if category_param.isdigit():
-                category = Category.objects.get(id=category_param)
-            else:
-                category = Category.objects.get(slug=category_param)
-            products = products.filter(category=category)
-        except Category.DoesNotExist:
-            pass
-    
-    # Поиск
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(tags__name__icontains=search_query)
-        ).distinct()
+        lookup = {'pk': int(category_param)} if category_param.isdigit() else {'slug': category_param}
+        if not Category.objects.filter(**lookup).exists():
+            # Неизвестная категория не фильтрует ленту, как и до перехода на компилятор
+            compiler.filters['category'] = ''
     
-    # Сортировка
-    products = products.order_by('-views_count', '-reviews_count')
-    
-    # Пагинация
-    paginator = Paginator(products, 20)
+    # Пагинация: сортировка по популярности, следующая страница — после курсора
+    paginator = SearchResultCache.paginator(products, compiler, 20)
     try:
-        products_page = paginator.get_page(page)
-    except:
-        return JsonResponse({'error': 'Invalid page'}, status=400)
+        products_page = paginator.get_page(cursor)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
     
-    # Рендерим HTML для товаров
-    products_html = render_to_string('products/includes/product_cards.html', {
-        'products': products_page
-    })
+    # Собираем HTML из закэшированных фрагментов карточек
+    products_html = ProductCardCache.render_html(products_page)
     
-    return JsonResponse({
+    response = {
         'html': products_html,
         'has_next': products_page.has_next(),
-        'next_page': products_page.next_page_number() if products_page.has_next() else None,
-        'current_page': page,
-        'total_pages': paginator.num_pages
-    })
+        'next_cursor': products_page.next_cursor,
+    }
+    if with_count:
+        response['total_products'] = paginator.count
+    return JsonResponse(response)
 
 
+@cache_anonymous_page
 def category_view(request, category_slug):
     """Страница категории в стиле Ozon с расширенной функциональностью"""
     category = get_object_or_404(Category, slug=category_slug, is_active=True)
     
-    # Получаем товары категории и всех подкатегорий
-    category_ids = [category.id]
-    all_subcategories = category.get_all_children()
-    category_ids.extend([subcat.id for subcat in all_subcategories])
-    
-    products = Product.objects.filter(
-        category_id__in=category_ids, 
-        is_active=True
-    ).select_related('seller', 'category').prefetch_related('images', 'tags', 'shops', 'characteristics')
+    products = ProductListingService.listing_queryset()
     
     # Получаем все категории для навигации
     categories = Category.objects.filter(is_active=True).prefetch_related('children')
     
-    # Фильтрация и поиск
+    # Товары категории и всех подкатегорий с фильтрами, поиском и сортировкой одним запросом
+    compiler = ProductQueryCompiler(request.GET, category=category)
     search_query = request.GET.get('q')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(tags__name__icontains=search_query) |
-            Q(brand__icontains=search_query)
-        ).distinct()
-    
-    # Фильтрация по цене
-    price_min = request.GET.get('price_min')
-    price_max = request.GET.get('price_max')
-    if price_min:
-        try:
-            products = products.filter(price__gte=float(price_min))
-        except ValueError:
-            pass
-    if price_max:
-        try:
-            products = products.filter(price__lte=float(price_max))
-        except ValueError:
-            pass
-    
-    # Фильтрация по бренду
-    brand = request.GET.get('brand')
-    if brand:
-        products = products.filter(brand__icontains=brand)
-    
-    # Фильтрация по рейтингу
-    min_rating = request.GET.get('min_rating')
-    if min_rating:
-        try:
-            products = products.filter(rating__gte=float(min_rating))
-        except ValueError:
-            pass
-    
-    # Фильтрация по наличию
-    in_stock = request.GET.get('in_stock')
-    if in_stock == '1':
-        products = products.filter(stock_quantity__gt=0)
-    
-    # Сортировка
-    sort_by = request.GET.get('sort', 'popularity')
-    if sort_by == 'price_asc':
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        products = products.order_by('-price')
-    elif sort_by == 'rating':
-        products = products.order_by('-rating', '-reviews_count')
-    elif sort_by == 'newest':
-        products = products.order_by('-created_at')
-    elif sort_by == 'name_asc':
-        products = products.order_by('translations__name')
-    elif sort_by == 'name_desc':
-        products = products.order_by('-translations__name')
-    else:  # popularity
-        products = products.order_by('-views_count', '-reviews_count', '-created_at')
+    # Поиск без явной сортировки упорядочен по релевантности
+    sort_by = RELEVANCE_SORT if compiler.relevance_sort else compiler.sort
     
     # Пагинация
     per_page = int(request.GET.get('per_page', 20))
     if per_page not in [12, 20, 40, 60]:
         per_page = 20
     
-    paginator = Paginator(products, per_page)
-    page_number = request.GET.get('page')
-    products_page = paginator.get_page(page_number)
+    # Листаем курсором без COUNT(*) и OFFSET с первой же страницы; нумерованные
+    # страницы остаются для сортировок по названию и старых ссылок с ?page=
+    products_page = None
+    total_products = None
+    if compiler.keyset_sort and not request.GET.get('page'):
+        paginator = SearchResultCache.paginator(products, compiler, per_page, compiler.sort)
+        try:
+            products_page = paginator.get_page(request.GET.get('cursor'))
+        except InvalidCursor:
+            products_page = paginator.get_page()
+        if compiler.filters['q']:
+            # Выдача поиска уже лежит в кэше списком id — количество известно без запроса
+            total_products = paginator.count
+    if products_page is None:
+        if compiler.filters['q']:
+            # Выдача поиска: страница вырезается из закэшированного списка id
+            object_list = SearchResultCache.search_results(products, compiler)
+        else:
+            object_list = compiler.compile(products)
+        paginator = Paginator(object_list, per_page)
+        page_number = request.GET.get('page')
+        products_page = paginator.get_page(page_number)
+        total_products = paginator.count
     
     # Подкатегории (прямые дочерние)
     subcategories = Category.objects.filter(
@@ -255,26 +187,21 @@ def category_view(request, category_slug):
         is_active=True
     ).order_by('sort_order')
     
-    # Построение breadcrumbs
-    breadcrumbs = []
-    current_category = category
-    while current_category:
-        breadcrumbs.insert(0, current_category)
-        current_category = current_category.parent
+    # Хлебные крошки по сохраненному пути категории (без обхода родителей)
+    breadcrumbs = CategoryTreeService.get_breadcrumbs(category)
     
-    # Получаем уникальные бренды для фильтра
-    available_brands = products.values_list('brand', flat=True).distinct().exclude(brand='')
-    available_brands = [brand for brand in available_brands if brand]
-    
-    # Статистика по ценам для фильтра
-    price_stats = products.aggregate(
-        min_price=models.Min('price'),
-        max_price=models.Max('price')
-    )
+    # Фасеты боковой панели считаются по поддереву категории и берутся из кэша
+    facets = FacetService.get_category_facets(category)
+    available_brands = [facet['brand'] for facet in facets['brands']]
+    price_stats = {
+        'min_price': facets['price']['min'],
+        'max_price': facets['price']['max'],
+    }
     
     context = {
         'category': category,
         'products': products_page,
+        'product_cards': ProductCardCache.render_cards(products_page),
         'categories': categories,
         'subcategories': subcategories,
         'breadcrumbs': breadcrumbs,
@@ -283,25 +210,24 @@ def category_view(request, category_slug):
         'per_page': per_page,
         'available_brands': available_brands,
         'price_stats': price_stats,
+        'facets': facets,
         'current_filters': {
-            'price_min': price_min,
-            'price_max': price_max,
-            'brand': brand,
-            'min_rating': min_rating,
-            'in_stock': in_stock,
+            'price_min': request.GET.get('price_min'),
+            'price_max': request.GET.get('price_max'),
+            'brand': request.GET.get('brand'),
+            'min_rating': request.GET.get('min_rating'),
+            'in_stock': request.GET.get('in_stock'),
         },
-        'total_products': paginator.count,
+        'total_products': total_products,
     }
     return render(request, 'category_ozon.html', context)
 
 
+@cache_anonymous_page
 def catalog_view(request):
     """Главная страница каталога с категориями всех уровней"""
-    # Получаем корневые категории
-    root_categories = Category.objects.filter(
-        parent__isnull=True,
-        is_active=True
-    ).prefetch_related('children__children').order_by('sort_order')
+    # Дерево категорий всех уровней из кэша
+    root_categories = CategoryTreeService.get_tree()
     
     # Популярные категории (с наибольшим количеством товаров)
     popular_categories = Category.objects.filter(
@@ -317,7 +243,7 @@ def catalog_view(request):
     # Популярные товары
     popular_products = Product.objects.filter(
         is_active=True
-    ).select_related('category', 'seller').prefetch_related('images').order_by('-views_count', '-reviews_count')[:12]
+    ).select_related('category', 'seller').prefetch_related('images').order_by(*SORT_ORDERS['popularity'])[:12]
     
     context = {
         'root_categories': root_categories,
@@ -332,78 +258,37 @@ def category_products_ajax(request, category_slug):
     """AJAX endpoint для загрузки товаров категории"""
     category = get_object_or_404(Category, slug=category_slug, is_active=True)
     
-    # Получаем товары категории и всех подкатегорий
-    category_ids = [category.id]
-    all_subcategories = category.get_all_children()
-    category_ids.extend([subcat.id for subcat in all_subcategories])
-    
-    products = Product.objects.filter(
-        category_id__in=category_ids, 
-        is_active=True
-    ).select_related('seller', 'category').prefetch_related('images')
+    products = ProductListingService.listing_queryset()
     
     # Применяем фильтры (аналогично category_view)
-    search_query = request.GET.get('q')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(tags__name__icontains=search_query) |
-            Q(brand__icontains=search_query)
-        ).distinct()
-    
-    # Фильтрация по цене
-    price_min = request.GET.get('price_min')
-    price_max = request.GET.get('price_max')
-    if price_min:
-        try:
-            products = products.filter(price__gte=float(price_min))
-        except ValueError:
-            pass
-    if price_max:
-        try:
-            products = products.filter(price__lte=float(price_max))
-        except ValueError:
-            pass
-    
-    # Сортировка
-    sort_by = request.GET.get('sort', 'popularity')
-    if sort_by == 'price_asc':
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        products = products.order_by('-price')
-    elif sort_by == 'rating':
-        products = products.order_by('-rating', '-reviews_count')
-    elif sort_by == 'newest':
-        products = products.order_by('-created_at')
-    else:  # popularity
-        products = products.order_by('-views_count', '-reviews_count')
+    compiler = ProductQueryCompiler(request.GET, category=category)
     
-    # Пагинация
-    page = request.GET.get('page', 1)
-    per_page = int(request.GET.get('per_page', 20))
+    # Keyset-пагинация по курсору; сортировки по названию листаются по популярности
+    try:
+        per_page = int(request.GET.get('per_page', 20))
+    except ValueError:
+        per_page = 20
+    per_page = min(max(per_page, 1), 60)
     
-    paginator = Paginator(products, per_page)
+    paginator = SearchResultCache.paginator(products, compiler, per_page, compiler.keyset_sort or DEFAULT_SORT)
     try:
-        products_page = paginator.get_page(page)
-    except:
-        return JsonResponse({'error': 'Invalid page'}, status=400)
+        products_page = paginator.get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
     
-    # Рендерим HTML для товаров
-    products_html = render_to_string('products/includes/product_cards.html', {
-        'products': products_page
-    })
+    # Собираем HTML из закэшированных фрагментов карточек
+    products_html = ProductCardCache.render_html(products_page)
     
-    return JsonResponse({
+    response = {
         'html': products_html,
         'has_next': products_page.has_next(),
-        'has_previous': products_page.has_previous(),
-        'next_page': products_page.next_page_number() if products_page.has_next() else None,
-        'previous_page': products_page.previous_page_number() if products_page.has_previous() else None,
-        'current_page': int(page),
-        'total_pages': paginator.num_pages,
-        'total_products': paginator.count
-    })
+        'next_cursor': products_page.next_cursor,
+        'sort': paginator.sort,
+    }
+    # Точное количество считается только по запросу клиента
+    if request.GET.get('with_count') == '1':
+        response['total_products'] = paginator.count
+    return JsonResponse(response)
 
 class ProductListView(FilterView):
     model = Product
@@ -413,26 +298,11 @@ class ProductListView(FilterView):
     filterset_class = ProductFilter
 
     def get_queryset(self):
-        queryset = super().get_queryset().prefetch_related('images', 'category', 'seller', 'tags')
+        queryset = super().get_queryset().select_related('category', 'seller').prefetch_related('images', 'tags')
         query = self.request.GET.get('q')
         if query:
-            # Проверяем, используем ли мы PostgreSQL (только PostgreSQL поддерживает SearchVector)
-            from django.conf import settings
-            db_engine = settings.DATABASES['default']['ENGINE']
-            
-            if 'postgresql' in db_engine:
-                # Используем полнотекстовый поиск PostgreSQL
-                from django.contrib.postgres.search import SearchQuery, SearchRank
-                search_query = SearchQuery(query)
-                queryset = queryset.annotate(
-                    rank=SearchRank(F('search_vector'), search_query)
-                ).filter(search_vector=search_query).order_by('-rank')
-            else:
-                # Для других баз данных (например, SQLite) используем простой поиск по названию и описанию
-                from django.db import models
-                queryset = queryset.filter(
-                    models.Q(name__icontains=query) | models.Q(description__icontains=query)
-                )
+            # Поисковый бэкенд (SEARCH_BACKEND) сортирует результат по релевантности
+            queryset = get_search_backend().rank(queryset, query)
         return queryset
 
     def get_context_data(self, **kwargs):
@@ -450,23 +320,18 @@ class ProductDetailView(DetailView):
 
     def get_object(self, queryset=None):
         obj = super().get_object(queryset=queryset)
-        # Увеличиваем счетчик просмотров
-        obj.views_count = F('views_count') + 1
-        obj.save(update_fields=['views_count'])
-        obj.refresh_from_db() # Обновляем объект после сохранения
+        # Просмотр копится в памяти и попадает в базу пачкой (ViewCounterService)
+        ViewCounterService.record(self.request, obj.pk)
         return obj
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product = self.get_object()
+        product = self.object
         context['images'] = product.images.all()
         context['is_favorite'] = self.request.user.is_authenticated and product.favorited_by.filter(pk=self.request.user.pk).exists()
         
-        # Похожие товары
-        related_products = Product.objects.filter(
-            category=product.category
-        ).exclude(pk=product.pk)[:4]
-        context['related_products'] = related_products
+        # Похожие товары — заранее рассчитанный список (RelatedProductService)
+        context['related_products'] = RelatedProductService.get_related(product, 4)
         
         return context
 
@@ -563,6 +428,11 @@ class ProductUpdateView(ManagerRequiredMixin, SuccessMessageMixin, UpdateView):
         context = self.get_context_data()
         images_formset = context['images_formset']
         if images_formset.is_valid():
+            # Введено число единиц на складе: действующие резервы вычитаются из него
+            if 'stock_quantity' in form.changed_data:
+                form.instance.stock_quantity = InventoryService.set_on_hand(
+                    form.instance.pk, form.cleaned_data['stock_quantity'],
+                )
             self.object = form.save()
             images_formset.instance = self.object
             images_formset.save()
@@ -831,7 +701,7 @@ def toggle_favorite(request, pk):
 
 # AJAX для фильтрации товаров (бесконечная прокрутка)
 def product_filter_ajax(request):
-    products = ProductService.get_filtered_products(request.GET)
+    products = ProductQueryCompiler(request.GET).compile()
     paginator = Paginator(products, 12)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -856,16 +726,11 @@ def product_detail(request, product_id):
     """Детальная страница товара"""
     product = get_object_or_404(Product, id=product_id)
     
-    # Увеличиваем счетчик просмотров
-    product.views_count = F('views_count') + 1
-    product.save(update_fields=['views_count'])
-    product.refresh_from_db()  # Обновляем объект после сохранения
+    # Просмотр копится в памяти и попадает в базу пачкой (ViewCounterService)
+    ViewCounterService.record(request, product.pk)
     
-    # Получаем похожие товары из той же категории
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_active=True
-    ).exclude(id=product.id)[:5]
+    # Похожие товары — заранее рассчитанный список (RelatedProductService)
+    related_products = RelatedProductService.get_related(product, 5)
     
     context = {
         'product': product,
@@ -927,44 +792,28 @@ def checkout_view(request):
     if request.method == 'POST':
         form = OrderForm(request.POST)
         if form.is_valid():
-            # Создаем заказ
-            order = form.save(commit=False)
-            order.user = request.user
-            order.payment_method = form.cleaned_data['payment_method']
-            order.delivery_method = form.cleaned_data['delivery_method']
-            
-            # Рассчитываем общую сумму
-            total_amount = sum(item.total_price for item in cart_items)
-            order.total_amount = total_amount
-            
-            # Добавляем стоимость доставки
-            if order.delivery_method == 'courier':
-                order.shipping_cost = Decimal('300.00')  # 300 рублей за курьерскую доставку
-            elif order.delivery_method == 'post':
-                order.shipping_cost = Decimal('150.00')  # 150 рублей за почтовую доставку
-            else:  # pickup
-                order.shipping_cost = Decimal('0.00')  # Бесплатно при самовывозе
-            
-            order.total_amount += order.shipping_cost
-            order.save()
-            
-            # Создаем позиции заказа
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.final_price,
-                    total_price=cart_item.total_price
+            # Остатки проверяются и списываются вместе с созданием заказа
+            try:
+                order = CheckoutService.place_order(
+                    request.user,
+                    form.save(commit=False),
+                    form.cleaned_data['delivery_method'],
+                    form.cleaned_data['payment_method'],
                 )
-            
-            # Очищаем корзину
-            cart_items.delete()
+            except CheckoutError as error:
+                messages.error(request, str(error))
+                return redirect('cart')
             
             messages.success(request, _("Заказ успешно оформлен! Номер заказа: {}").format(order.order_number))
             return redirect('order_detail', order_id=order.id)
     else:
         form = OrderForm()
+        # Товары корзины держатся за покупателем, пока он заполняет форму
+        shortages = CheckoutService.reserve_cart(request.user)
+        if shortages:
+            messages.warning(request, _("Недостаточно товара на складе: {}").format(
+                ', '.join(str(product) for product in shortages)
+            ))
     
     context = {
         'form': form,
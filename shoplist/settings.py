@@ -137,6 +137,7 @@ TEMPLATES = [
                 'django.template.context_processors.i18n', # Для мультиязычности
                 'products.context_processors.catalog_categories', # Категории каталога
                 'products.context_processors.client', # Клиент в шаблонах
+                'products.context_processors.cart_summary', # Сводка корзины для шапки
             ],
         },
     },
@@ -314,6 +315,13 @@ CACHES = {
 SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 SESSION_CACHE_ALIAS = 'default'
 
+# Поиск товаров: локальный инвертированный индекс (BM25) с откатом на поиск в базе,
+# пока индекс не собран командой rebuild_search_index
+SEARCH_BACKEND = 'products.search.backends.InvertedIndexBackend'
+SEARCH_INDEX_DIR = BASE_DIR / 'search_index'
+# Исправление раскладки, транслита и опечаток в запросе перед поиском
+SEARCH_QUERY_REWRITE = True
+
 # Настройки кэширования для parler
 PARLER_CACHE = 'default'
 
@@ -587,4 +595,48 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'products.tasks.backup_database',
         'schedule': 86400.0,  # Каждый день
     },
+    'rebuild-product-listings': {
+        'task': 'products.tasks.rebuild_product_listings',
+        'schedule': 86400.0,  # Каждый день
+    },
+    'process-search-index-queue': {
+        'task': 'products.tasks.process_search_index_queue',
+        'schedule': 15.0,  # Каждые 15 секунд
+    },
+    'rebuild-search-suggestions': {
+        'task': 'products.tasks.rebuild_search_suggestions',
+        'schedule': 600.0,  # Каждые 10 минут
+    },
+    'flush-product-views': {
+        'task': 'products.tasks.flush_product_views',
+        'schedule': 30.0,  # Каждые 30 секунд
+    },
+    'rollup-product-views': {
+        'task': 'products.tasks.rollup_product_views',
+        'schedule': 86400.0,  # Каждый день
+    },
+    'update-popularity-scores': {
+        'task': 'products.tasks.update_popularity_scores',
+        'schedule': 900.0,  # Каждые 15 минут
+    },
+    'rebuild-related-products': {
+        'task': 'products.tasks.rebuild_related_products',
+        'schedule': 86400.0,  # Каждый день
+    },
+    'refresh-recommendation-pool': {
+        'task': 'products.tasks.refresh_recommendation_pool',
+        'schedule': 600.0,  # Каждые 10 минут
+    },
+    'release-expired-reservations': {
+        'task': 'products.tasks.release_expired_reservations',
+        'schedule': 60.0,  # Каждую минуту
+    },
+    'rebuild-search-vocabulary': {
+        'task': 'products.tasks.rebuild_search_vocabulary',
+        'schedule': 600.0,  # Каждые 10 минут
+    },
+    'rebuild-search-index': {
+        'task': 'products.tasks.rebuild_search_index',
+        'schedule': 86400.0,  # Каждый день
+    },
 }
\ No newline at end of file
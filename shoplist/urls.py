@@ -116,6 +116,7 @@ urlpatterns += i18n_patterns(
     # Дополнительные API endpoints для категорий
     path('api/categories/<int:category_id>/level3/', api_views.category_subcategories, name='api_category_level3'),
     path('api/categories/search/', api_views.search_categories, name='api_categories_search'),
+    path('api/search/suggest/', api_views.search_suggest, name='api_search_suggest'),
     path('api/categories/stats/', api_views.category_stats, name='api_categories_stats'),
     
     # Статические страницы